@@ -0,0 +1,93 @@
+import zlib
+
+from mongodb_consistent_backup.Errors import OperationError
+
+
+def import_zstandard():
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        raise OperationError("Native archive zstd compression requires the 'zstandard' python module!")
+
+
+# Compressors of the archive stream, each with the interface of the
+# zlib compress objects: .compress(data) and .flush() return compressed data.
+# .decompressor() returns an object of the zlib decompress object interface.
+class NoneCompressor:
+    extension = "tar"
+
+    def __init__(self, level=0, threads=0):
+        pass
+
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return ""
+
+    @staticmethod
+    def decompressor():
+        return NoneCompressor()
+
+    def decompress(self, data):
+        return data
+
+
+class GzipCompressor:
+    extension = "tar.gz"
+
+    def __init__(self, level=0, threads=0):
+        if not level or level < 1:
+            level = 6
+        # a zlib window with 16 added writes the gzip format
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    @staticmethod
+    def decompressor():
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+class ZstdCompressor:
+    extension = "tar.zst"
+
+    def __init__(self, level=0, threads=0):
+        zstandard = import_zstandard()
+        if not level or level < 1:
+            level = 3
+        self._compressor = zstandard.ZstdCompressor(level=level, threads=threads).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    @staticmethod
+    def decompressor():
+        return import_zstandard().ZstdDecompressor().decompressobj()
+
+
+compressors = {
+    'none': NoneCompressor,
+    'gzip': GzipCompressor,
+    'zstd': ZstdCompressor
+}
+
+
+def get_compressor(method, level=0, threads=0):
+    if method not in compressors:
+        raise OperationError("Unsupported native archive compression method: %s!" % method)
+    return compressors[method](level, threads)
+
+
+def get_decompressor(method):
+    if method not in compressors:
+        raise OperationError("Unsupported native archive compression method: %s!" % method)
+    return compressors[method].decompressor()
@@ -0,0 +1,201 @@
+import json
+import os
+import re
+import struct
+import zlib
+
+from hashlib import sha256
+
+from Compressors import NoneCompressor, get_compressor, get_decompressor
+from TarWriter import TarWriter, get_tarinfo
+
+from mongodb_consistent_backup.Errors import OperationError
+
+
+# The indexed archive format stores each file of a backup (each collection's
+# .bson and .metadata.json) as an independently compressed member, so a
+# single namespace can be read with one seek or one byte-range GET:
+#
+#   header:  8 bytes magic 'MCBARCHV', 4 bytes version
+#   members: the compressed data of each file
+#   index:   gzip-compressed JSON of the members by path, with their
+#            namespace, offset, length, codec, size and sha256
+#   trailer: 8 bytes magic 'MCBINDEX', 8 bytes index offset, 8 bytes index
+#            length, 4 bytes index crc32, 4 bytes version
+#
+# All numbers are big-endian unsigned integers.
+ARCHIVE_VERSION = 1
+HEADER_MAGIC    = "MCBARCHV"
+HEADER_FORMAT   = ">8sI"
+TRAILER_MAGIC   = "MCBINDEX"
+TRAILER_FORMAT  = ">8sQQII"
+TRAILER_BYTES   = struct.calcsize(TRAILER_FORMAT)
+EXTENSION       = "mcba"
+
+# mongodump files: '<db>/<collection>.bson' and '<db>/<collection>.metadata.json', gzipped by 'mongodump --gzip'
+_namespace_regex = re.compile(r"(?:^|/)dump/([^/]+)/(.+?)\.(?:bson|metadata\.json)(?:\.gz)?$")
+
+
+def get_namespace(path):
+    match = _namespace_regex.search(path)
+    if match:
+        return "%s.%s" % match.groups()
+
+
+class IndexedArchiveWriter(TarWriter):
+    def __init__(self, write, codec="gzip", level=0, threads=0, buffer_bytes=4 * 1024 * 1024, use_fadvise=False,
+                 remove_files=False, progress=None):
+        TarWriter.__init__(self, write, NoneCompressor(), buffer_bytes, use_fadvise, remove_files, progress)
+        self.codec   = codec
+        self.level   = level
+        self.threads = threads
+
+        self.index = {}
+        self.write_raw(struct.pack(HEADER_FORMAT, HEADER_MAGIC, ARCHIVE_VERSION))
+
+    def add(self, path, arcname):
+        # directories are implied by the member paths, only files are stored
+        info = get_tarinfo(path, arcname)
+        if not info or not info.isreg():
+            return
+        codec = self.codec
+        if path.endswith(".gz"):
+            codec = "none"
+        compressor = get_compressor(codec, self.level, self.threads)
+        checksum   = sha256()
+        offset     = self._offset
+        for data in self.read_file(path, info.size):
+            checksum.update(data)
+            self.write_raw(compressor.compress(data))
+        self.write_raw(compressor.flush())
+        self.index[arcname] = {
+            'namespace': get_namespace(arcname),
+            'offset':    offset,
+            'length':    self._offset - offset,
+            'codec':     codec,
+            'size':      info.size,
+            'sha256':    checksum.hexdigest(),
+            'mode':      info.mode,
+            'mtime':     info.mtime
+        }
+        self.members[arcname] = {
+            'size':   info.size,
+            'sha256': self.index[arcname]['sha256']
+        }
+        if self.remove_files:
+            os.remove(path)
+
+    def close(self):
+        compressor = get_compressor("gzip")
+        index      = compressor.compress(json.dumps({'version': ARCHIVE_VERSION, 'members': self.index}, sort_keys=True))
+        index     += compressor.flush()
+        offset     = self._offset
+        self.write_raw(index)
+        self.write_raw(struct.pack(TRAILER_FORMAT, TRAILER_MAGIC, offset, len(index), zlib.crc32(index) & 0xffffffff, ARCHIVE_VERSION))
+        self.flush(True)
+
+
+# Reads from an archive file
+class FileSource:
+    def __init__(self, path):
+        self.path = path
+
+    def size(self):
+        return os.path.getsize(self.path)
+
+    def read(self, offset, length):
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+
+# Reads from an uploaded archive with byte-range GETs, 'key' is a boto S3 or Google Cloud Storage key
+class KeySource:
+    def __init__(self, key):
+        self.key = key
+
+    def size(self):
+        if self.key.size is None:
+            self.key = self.key.bucket.get_key(self.key.name)
+        return self.key.size
+
+    def read(self, offset, length):
+        return self.key.get_contents_as_string(headers={'Range': 'bytes=%i-%i' % (offset, offset + length - 1)})
+
+
+class IndexedArchiveReader:
+    def __init__(self, source, read_bytes=8 * 1024 * 1024):
+        self.source     = source
+        self.read_bytes = read_bytes
+
+        self._index = None
+
+    def index(self):
+        # the members by path, read with two reads from the end of the archive
+        if self._index is None:
+            size = self.source.size()
+            if size < TRAILER_BYTES:
+                raise OperationError("Archive is too small to be an indexed archive!")
+            magic, offset, length, crc, version = struct.unpack(TRAILER_FORMAT, self.source.read(size - TRAILER_BYTES, TRAILER_BYTES))
+            if magic != TRAILER_MAGIC:
+                raise OperationError("Archive has no index trailer, it is not an indexed archive!")
+            elif version > ARCHIVE_VERSION:
+                raise OperationError("Unsupported indexed archive version: %i!" % version)
+            index = self.source.read(offset, length)
+            if zlib.crc32(index) & 0xffffffff != crc:
+                raise OperationError("Checksum of the archive index does not match, the archive is corrupt!")
+            decompressor = get_decompressor("gzip")
+            self._index  = json.loads(decompressor.decompress(index) + decompressor.flush())['members']
+        return self._index
+
+    def namespaces(self):
+        return sorted(set(filter(None, [member['namespace'] for member in self.index().itervalues()])))
+
+    def members(self, namespace=None):
+        # the member paths, of one namespace when given
+        return sorted([path for path, member in self.index().iteritems() if namespace is None or member['namespace'] == namespace])
+
+    def read_member(self, path, write):
+        # passes the data of a member to 'write', in 'read_bytes' reads of the archive
+        if path not in self.index():
+            raise OperationError("Member %s is not in the archive!" % path)
+        member       = self.index()[path]
+        decompressor = get_decompressor(member['codec'])
+        checksum     = sha256()
+        size         = 0
+        offset       = member['offset']
+        end          = offset + member['length']
+        while offset < end:
+            data = decompressor.decompress(self.source.read(offset, min(self.read_bytes, end - offset)))
+            offset += self.read_bytes
+            checksum.update(data)
+            size += len(data)
+            write(data)
+        data = decompressor.flush()
+        if data:
+            checksum.update(data)
+            size += len(data)
+            write(data)
+        if size != member['size'] or checksum.hexdigest() != member['sha256']:
+            raise OperationError("Checksum of member %s does not match the archive index!" % path)
+
+    def extract(self, path, dest_dir):
+        # extracts a member to its path under 'dest_dir'
+        if os.path.isabs(path) or ".." in path.split("/"):
+            raise OperationError("Refusing to extract member %s outside of %s!" % (path, dest_dir))
+        dest_path = os.path.join(dest_dir, path)
+        if not os.path.isdir(os.path.dirname(dest_path)):
+            os.makedirs(os.path.dirname(dest_path))
+        with open(dest_path, "wb") as f:
+            self.read_member(path, f.write)
+        member = self.index()[path]
+        os.chmod(dest_path, member['mode'])
+        os.utime(dest_path, (member['mtime'], member['mtime']))
+        return dest_path
+
+    def extract_namespace(self, namespace, dest_dir):
+        # the .bson and .metadata.json of one collection, for 'mongorestore'
+        paths = self.members(namespace)
+        if len(paths) == 0:
+            raise OperationError("Namespace %s is not in the archive!" % namespace)
+        return [self.extract(path, dest_dir) for path in paths]
@@ -0,0 +1,75 @@
+import os
+import logging
+
+from Compressors import compressors
+from IndexedArchive import EXTENSION as INDEXED_EXTENSION
+from NativeTarThread import NativeTarThread
+
+from mongodb_consistent_backup.Archive.Tar import Tar
+from mongodb_consistent_backup.Common import parse_config_bool
+from mongodb_consistent_backup.Errors import OperationError
+
+
+# Archives backup directories like the 'tar' method, with archives written
+# in-process by NativeTarThread instead of the 'tar' binary.
+class Native(Tar):
+    def __init__(self, manager, config, timer, base_dir, backup_dir, **kwargs):
+        super(Native, self).__init__(manager, config, timer, base_dir, backup_dir, **kwargs)
+        self.compression_method    = self.config.archive.native.compression
+        self.compression_supported = sorted(compressors.keys())
+        self.compress_programs     = {}
+        self.split_bytes           = self.config.archive.native.split_mb * 1024 * 1024
+        self.compression_level     = self.config.archive.native.compression_level
+        self.compression_threads   = self.config.archive.native.compression_threads
+        self.stream_to_upload      = parse_config_bool(self.config.archive.native.stream_to_upload)
+        self.buffer_bytes          = self.config.archive.native.buffer_mb * 1024 * 1024
+        self.use_fadvise           = parse_config_bool(self.config.archive.native.fadvise)
+        self.progress_secs         = self.config.archive.native.progress_secs
+        self.archive_format        = self.config.archive.native.format
+
+        self.threads(self.config.archive.native.threads)
+
+        if self.buffer_bytes < 1:
+            raise OperationError("Native archive buffer size must be at least 1mb!")
+        elif self.stream_to_upload and self.config.upload.method != "s3":
+            raise OperationError("Streaming native archives to the upload is only supported by the 's3' upload method!")
+
+    def output_file(self, subdir_name, part=None):
+        output_file = subdir_name
+        if part is not None:
+            output_file = "%s.part%03d" % (subdir_name, part)
+        if self.archive_format == "indexed":
+            return "%s.%s" % (output_file, INDEXED_EXTENSION)
+        return "%s.%s" % (output_file, compressors[self.compression()].extension)
+
+    def record_checksum(self, result):
+        super(Native, self).record_checksum(result)
+        if self._checksums and result["members"]:
+            self._checksums.add_members(os.path.relpath(result["output_file"], self.backup_dir), result["members"])
+
+    def get_thread(self, job, compress_program, chunk_bytes):
+        threads = self.compression_threads
+        if not threads or threads < 1:
+            threads = max(1, self.cpu_count / max(1, self.threads()))
+        return NativeTarThread(
+            job['directory'],
+            job['output_file'],
+            self.compression(),
+            self.verbose,
+            job['files'],
+            job['bytes'],
+            self.stream_upload(job['output_file']),
+            chunk_bytes,
+            self.compression_level,
+            threads,
+            self.buffer_bytes,
+            self.use_fadvise,
+            self.progress_secs,
+            self.archive_format
+        )
+
+    def run(self):
+        logging.info("Archiving with the native archive writer (format: %s, compression: %s, buffer: %imb, fadvise: %s)" % (
+            self.archive_format, self.compression(), self.buffer_bytes / 1024 / 1024, self.use_fadvise
+        ))
+        super(Native, self).run()
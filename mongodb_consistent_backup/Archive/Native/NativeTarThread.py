@@ -0,0 +1,153 @@
+import os
+import logging
+
+from time import time
+
+from Compressors import get_compressor
+from IndexedArchive import IndexedArchiveWriter
+from TarWriter import TarWriter
+
+from mongodb_consistent_backup.Archive.Tar.TarThread import TarThread
+from mongodb_consistent_backup.Common import Checksum
+from mongodb_consistent_backup.Errors import OperationError
+from mongodb_consistent_backup.Upload.S3.S3StreamUpload import S3StreamUpload
+
+
+class NativeTarThread(TarThread):
+    def __init__(self, backup_dir, output_file, compression='none', verbose=False, files=None, byte_count=0, stream_upload=None,
+                 checksum_chunk_bytes=0, compression_level=0, compression_threads=0, buffer_bytes=4 * 1024 * 1024,
+                 use_fadvise=False, progress_secs=30, archive_format="tar"):
+        super(NativeTarThread, self).__init__(backup_dir, output_file, compression, verbose, None, files, byte_count,
+                                              stream_upload=stream_upload, checksum_chunk_bytes=checksum_chunk_bytes)
+        self.compression_level   = compression_level
+        self.compression_threads = compression_threads
+        self.buffer_bytes        = buffer_bytes
+        self.use_fadvise         = use_fadvise
+        self.progress_secs       = progress_secs
+        self.archive_format      = archive_format
+
+        self.members        = None
+        self._last_progress = None
+
+    def close(self, exit_code=None, frame=None):
+        # stops the writer at its next read
+        self.stopped = True
+
+    def progress(self, bytes_in):
+        if self.stopped:
+            raise OperationError("Archiving of %s was stopped!" % self.output_file)
+        now = time()
+        if now - self._last_progress >= self.progress_secs:
+            self._last_progress = now
+            duration = max(now - self.start_time, 0.001)
+            logging.info("Archiving %s: %.2fmb of %.2fmb (%.1f%%, %.2f MB/sec)" % (
+                self.output_file,
+                float(bytes_in / 1024.00 / 1024.00),
+                float(self.byte_count / 1024.00 / 1024.00),
+                bytes_in * 100.0 / max(self.byte_count, 1),
+                bytes_in / duration / 1024 / 1024
+            ))
+
+    def get_writer(self, write, remove_files):
+        if self.archive_format == "indexed":
+            return IndexedArchiveWriter(
+                write,
+                self.compression(),
+                self.compression_level,
+                self.compression_threads,
+                self.buffer_bytes,
+                self.use_fadvise,
+                remove_files,
+                self.progress
+            )
+        return TarWriter(
+            write,
+            get_compressor(self.compression(), self.compression_level, self.compression_threads),
+            self.buffer_bytes,
+            self.use_fadvise,
+            remove_files,
+            self.progress
+        )
+
+    def write_archive(self, write, remove_files):
+        writer   = self.get_writer(write, remove_files)
+        base_dir = os.path.dirname(self.backup_dir)
+        if self.files is not None:
+            for file_name in self.files:
+                writer.add(os.path.join(base_dir, file_name), file_name)
+        else:
+            writer.add_tree(base_dir, os.path.basename(self.backup_dir))
+        writer.close()
+        self.members = writer.members
+        logging.debug("Archived %i file(s) of %s, %i bytes in and %i bytes out" % (
+            len(writer.members), self.output_file, writer.bytes_in, writer.bytes_out
+        ))
+
+    def run_file(self):
+        f = open(self.output_file, "wb")
+
+        def write(data):
+            self.checksum.update(data)
+            f.write(data)
+
+        try:
+            self.write_archive(write, True)
+        except Exception, e:
+            f.close()
+            os.remove(self.output_file)
+            raise e
+        finally:
+            f.close()
+
+    def run_stream(self):
+        uploader = S3StreamUpload(byte_count=self.byte_count, **self.stream_upload)
+
+        def write(data):
+            self.checksum.update(data)
+            uploader.write(data)
+
+        try:
+            uploader.start()
+            self.write_archive(write, False)
+            uploader.complete()
+        except Exception, e:
+            uploader.cancel()
+            raise e
+        self.remove_source()
+
+    def run(self):
+        if os.path.isdir(self.backup_dir):
+            if not os.path.isfile(self.output_file):
+                try:
+                    log_msg = "Archiving directory: %s" % self.backup_dir
+                    if self.compression() != 'none':
+                        log_msg = "Archiving and compressing (%s) directory: %s" % (self.compression(), self.backup_dir)
+                    if self.files is not None:
+                        log_msg = "%s (part: %s, %i files)" % (log_msg, os.path.basename(self.output_file), len(self.files))
+                    if self.stream_upload:
+                        log_msg = "%s, streaming to s3://%s%s" % (log_msg, self.stream_upload['bucket_name'], self.stream_upload['key_name'])
+                    logging.info(log_msg)
+                    self.running        = True
+                    self.start_time     = time()
+                    self._last_progress = self.start_time
+                    self.checksum       = Checksum(self.checksum_chunk_bytes)
+                    if self.stream_upload:
+                        self.run_stream()
+                    else:
+                        self.run_file()
+                    self.end_time  = time()
+                    self.exit_code = 0
+                except Exception, e:
+                    return self.result(False, "Failed archiving file: %s!" % self.output_file, e)
+                finally:
+                    self.running   = False
+                    self.stopped   = True
+                    self.completed = True
+            else:
+                return self.result(False, "Output file: %s already exists!" % self.output_file, None)
+            return self.result(True, "Archiving successful.", None)
+
+    def result(self, success, message, error):
+        result = super(NativeTarThread, self).result(success, message, error)
+        result["members"] = self.members
+        return result
@@ -0,0 +1,153 @@
+import grp
+import os
+import pwd
+import stat
+import tarfile
+
+from hashlib import sha256
+
+from mongodb_consistent_backup.Common import POSIX_FADV_DONTNEED, POSIX_FADV_SEQUENTIAL, fadvise
+
+
+def get_tarinfo(path, arcname):
+    # the tar header of a file, directory or symlink, None for other file types
+    st   = os.lstat(path)
+    info = tarfile.TarInfo(arcname)
+    info.mode  = stat.S_IMODE(st.st_mode)
+    info.mtime = int(st.st_mtime)
+    info.uid   = st.st_uid
+    info.gid   = st.st_gid
+    if stat.S_ISREG(st.st_mode):
+        info.type = tarfile.REGTYPE
+        info.size = st.st_size
+    elif stat.S_ISDIR(st.st_mode):
+        info.type = tarfile.DIRTYPE
+    elif stat.S_ISLNK(st.st_mode):
+        info.type     = tarfile.SYMTYPE
+        info.linkname = os.readlink(path)
+    else:
+        return None
+    try:
+        info.uname = pwd.getpwuid(st.st_uid).pw_name
+    except KeyError:
+        pass
+    try:
+        info.gname = grp.getgrgid(st.st_gid).gr_name
+    except KeyError:
+        pass
+    return info
+
+
+# Writes a GNU tar archive in-process, readable by 'tar'. Member data is
+# read in 'buffer_bytes' reads, hashed, compressed and passed to 'write' in
+# blocks of whole 'buffer_bytes'. Like 'tar --remove-files', files can be
+# removed as soon as they are in the archive.
+class TarWriter:
+    def __init__(self, write, compressor, buffer_bytes=4 * 1024 * 1024, use_fadvise=False, remove_files=False, progress=None):
+        self.write        = write
+        self.compressor   = compressor
+        self.buffer_bytes = buffer_bytes
+        self.use_fadvise  = use_fadvise
+        self.remove_files = remove_files
+        self.progress     = progress
+
+        self.members   = {}
+        self.bytes_in  = 0
+        self.bytes_out = 0
+        self._offset   = 0
+        self._buffer   = []
+        self._buffered = 0
+
+    def flush(self, final=False):
+        # writes the buffered output in whole blocks, all of it when 'final'
+        if self._buffered < self.buffer_bytes and not final:
+            return
+        data = "".join(self._buffer)
+        end  = len(data)
+        if not final:
+            end -= end % self.buffer_bytes
+        if end > 0:
+            self.write(data[:end])
+            self.bytes_out += end
+        self._buffer   = [data[end:]]
+        self._buffered = len(data) - end
+
+    def write_raw(self, data):
+        self._offset += len(data)
+        data = self.compressor.compress(data)
+        if data:
+            self._buffer.append(data)
+            self._buffered += len(data)
+            self.flush()
+
+    def write_padding(self, block_bytes):
+        remainder = self._offset % block_bytes
+        if remainder > 0:
+            self.write_raw(tarfile.NUL * (block_bytes - remainder))
+
+    def read_file(self, path, byte_count):
+        # yields the first 'byte_count' bytes of a file in 'buffer_bytes' reads
+        with open(path, "rb") as f:
+            if self.use_fadvise:
+                fadvise(f.fileno(), 0, 0, POSIX_FADV_SEQUENTIAL)
+            remaining = byte_count
+            while remaining > 0:
+                data = f.read(min(self.buffer_bytes, remaining))
+                if not data:
+                    raise IOError("File %s was truncated while archiving it!" % path)
+                remaining     -= len(data)
+                self.bytes_in += len(data)
+                yield data
+                if self.progress:
+                    self.progress(self.bytes_in)
+            if self.use_fadvise:
+                # the data is in the archive, its pages are not needed in the cache anymore
+                fadvise(f.fileno(), 0, 0, POSIX_FADV_DONTNEED)
+
+    def write_file_data(self, path, info):
+        checksum = sha256()
+        for data in self.read_file(path, info.size):
+            checksum.update(data)
+            self.write_raw(data)
+        self.write_padding(tarfile.BLOCKSIZE)
+        return checksum.hexdigest()
+
+    def add(self, path, arcname):
+        info = get_tarinfo(path, arcname)
+        if not info:
+            return
+        self.write_raw(info.tobuf(tarfile.GNU_FORMAT))
+        if info.isreg():
+            self.members[arcname] = {
+                'size':   info.size,
+                'sha256': self.write_file_data(path, info)
+            }
+        if self.remove_files and not info.isdir():
+            os.remove(path)
+
+    def add_tree(self, base_dir, name):
+        # adds a directory and its contents, like 'tar -C base_dir -c name'
+        dirs = []
+        for root, dir_names, file_names in os.walk(os.path.join(base_dir, name)):
+            dir_names.sort()
+            dirs.append(root)
+            self.add(root, os.path.relpath(root, base_dir))
+            # symlinks to directories are not walked, they are archived as links
+            for dir_name in filter(lambda d: os.path.islink(os.path.join(root, d)), dir_names):
+                file_names.append(dir_name)
+            for file_name in sorted(file_names):
+                file_path = os.path.join(root, file_name)
+                self.add(file_path, os.path.relpath(file_path, base_dir))
+        if self.remove_files:
+            for path in reversed(dirs):
+                os.rmdir(path)
+
+    def close(self):
+        # two empty blocks end the archive, padded to a whole tar record
+        self.write_raw(tarfile.NUL * tarfile.BLOCKSIZE * 2)
+        self.write_padding(tarfile.RECORDSIZE)
+        data = self.compressor.flush()
+        if data:
+            self._buffer.append(data)
+            self._buffered += len(data)
+        self.flush(True)
@@ -0,0 +1,31 @@
+from Native import Native  # NOQA
+
+
+def config(parser):
+    parser.add_argument("--archive.native.compression", dest="archive.native.compression", default='gzip',
+                        choices=['gzip', 'none', 'zstd'],
+                        help="Native archiver compression method, 'zstd' requires the 'zstandard' python module (default: gzip)")
+    parser.add_argument("--archive.native.format", dest="archive.native.format", default='tar', choices=['indexed', 'tar'],
+                        help="Native archive format, 'indexed' compresses each file separately and ends with an index of "
+                             "the files by namespace, to read one collection without the whole archive (default: tar)")
+    parser.add_argument("--archive.native.compression_level", dest="archive.native.compression_level", default=0, type=int,
+                        help="Native archiver compression level, 0 uses the compressor default (default: 0)")
+    parser.add_argument("--archive.native.compression_threads", dest="archive.native.compression_threads", default=0, type=int,
+                        help="Number of threads per 'zstd' compressor (default: CPUs/archive threads)")
+    parser.add_argument("--archive.native.buffer_mb", dest="archive.native.buffer_mb", default=4, type=int,
+                        help="Native archiver read and write size, in megabytes (default: 4)")
+    parser.add_argument("--archive.native.fadvise", dest="archive.native.fadvise", default=False, action="store_true",
+                        help="Hint sequential reads of archived files to the kernel and drop them from the page cache "
+                             "once archived (default: false)")
+    parser.add_argument("--archive.native.progress_secs", dest="archive.native.progress_secs", default=30, type=int,
+                        help="Seconds between progress reports of each archive (default: 30)")
+    parser.add_argument("--archive.native.split_mb", dest="archive.native.split_mb", default=0, type=int,
+                        help="Split archives of backup directories larger than this size into parts archived in parallel, "
+                             "0 disables splitting (default: 0)")
+    parser.add_argument("--archive.native.stream_to_upload", dest="archive.native.stream_to_upload", default=False,
+                        action="store_true",
+                        help="Stream archives directly to the upload as multipart chunks instead of writing them to "
+                             "disk, only supported by the 's3' upload method (default: false)")
+    parser.add_argument("--archive.native.threads", dest="archive.native.threads", default=0, type=int,
+                        help="Number of native archiver threads to use (default: 1-per-CPU)")
+    return parser
@@ -2,13 +2,18 @@ import os
 import logging
 
 from copy_reg import pickle
+from distutils.spawn import find_executable
+from math import ceil
 from multiprocessing import Pool
 from time import sleep
 from types import MethodType
 
 from TarThread import TarThread
-from mongodb_consistent_backup.Errors import Error
+from mongodb_consistent_backup.Common import get_checksum_chunk_bytes, parse_config_bool
+from mongodb_consistent_backup.Errors import Error, OperationError
 from mongodb_consistent_backup.Pipeline import Task
+from mongodb_consistent_backup.State import StateChecksums
+from mongodb_consistent_backup.Upload.Util import get_s3_key_name
 
 
 # Allows pooled .apply_async()s to work on Class-methods:
@@ -25,25 +30,46 @@ pickle(MethodType, _reduce_method)
 class Tar(Task):
     def __init__(self, manager, config, timer, base_dir, backup_dir, **kwargs):
         super(Tar, self).__init__(self.__class__.__name__, manager, config, timer, base_dir, backup_dir, **kwargs)
-        self.compression_method = self.config.archive.tar.compression
-        self.binary             = self.config.archive.tar.binary
+        self.compression_method  = self.config.archive.tar.compression
+        self.binary              = self.config.archive.tar.binary
+        self.split_bytes         = self.config.archive.tar.split_mb * 1024 * 1024
+        self.compression_level   = self.config.archive.tar.compression_level
+        self.compression_threads = self.config.archive.tar.compression_threads
+        self.stream_to_upload    = parse_config_bool(self.config.archive.tar.stream_to_upload)
 
-        self._pool   = None
-        self._pooled = []
+        # multi-threaded compressors, streamed from tar via --use-compress-program
+        self.compression_supported = ['none', 'gzip', 'pigz', 'zstd']
+        self.compress_programs     = {
+            'pigz': {'binary': 'pigz', 'threads_flag': '-p %i', 'extension': 'tar.gz'},
+            'zstd': {'binary': 'zstd', 'threads_flag': '-T%i', 'extension': 'tar.zst'}
+        }
+
+        self._pool      = None
+        self._pooled    = []
+        self._parts     = {}
+        self._checksums = None
+
+        self.unit_support = True
 
         self.threads(self.config.archive.tar.threads)
         self._all_threads_successful = True
 
+        if self.stream_to_upload and self.config.upload.method != "s3":
+            raise OperationError("Streaming tar archives to the upload is only supported by the 's3' upload method!")
+
     def done(self, result):
-        success   = result["success"]
-        message   = result["message"]
-        error     = result["error"]
-        directory = result["directory"]
-        exit_code = result["exit_code"]
+        success     = result["success"]
+        message     = result["message"]
+        error       = result["error"]
+        directory   = result["directory"]
+        output_file = result["output_file"]
+        exit_code   = result["exit_code"]
 
         if success:
-            if directory in self._pooled:
-                logging.debug("Archiving completed for: %s" % directory)
+            if output_file in self._pooled:
+                logging.debug("Archiving completed for: %s" % output_file)
+                self.record(result)
+                self.record_checksum(result)
             else:
                 logging.warning("Tar thread claimed success, but delivered unexpected response %s for directory %s. "
                                 "Assuming failure anyway." % (message, directory))
@@ -52,7 +78,156 @@ class Tar(Task):
             self._all_threads_successful = False
             logging.error("Tar thread failed for directory %s: %s; Exit code %s; Error %s)" %
                           (directory, message, exit_code, error))
-        self._pooled.remove(directory)
+        self._pooled.remove(output_file)
+        if directory in self._parts:
+            self._parts[directory] -= 1
+            if self._parts[directory] == 0 and self._all_threads_successful:
+                self.remove_empty_dirs(directory)
+
+    def record(self, result):
+        if result["start"] and result["end"]:
+            timer_name = "TarThread-%s" % os.path.basename(result["output_file"])
+            self.timer.record(timer_name, result["start"], result["end"], result["bytes"])
+            duration = result["end"] - result["start"]
+            if duration > 0:
+                logging.info("Archived %s: %i bytes in %.2f secs (%.2f MB/sec)" % (
+                    result["output_file"],
+                    result["bytes"],
+                    duration,
+                    result["bytes"] / duration / 1024 / 1024
+                ))
+
+    def record_checksum(self, result):
+        if self._checksums and result["checksum"]:
+            rel_path = os.path.relpath(result["output_file"], self.backup_dir)
+            if self.stream_to_upload:
+                self._checksums.add_stream(rel_path, result["checksum"])
+            else:
+                self._checksums.add_file(rel_path, result["checksum"])
+
+    def get_dir_files(self, backup_dir):
+        # returns (path relative to the archive base dir, size) for all files in a backup dir
+        files    = []
+        base_dir = os.path.dirname(backup_dir)
+        for root, dirs, file_names in os.walk(backup_dir):
+            for file_name in file_names:
+                file_path = os.path.join(root, file_name)
+                files.append((os.path.relpath(file_path, base_dir), os.path.getsize(file_path)))
+        return files
+
+    def remove_empty_dirs(self, backup_dir):
+        # part archives remove their files, but not the directories they were in
+        for root, dirs, file_names in os.walk(backup_dir, topdown=False):
+            if len(os.listdir(root)) == 0:
+                os.rmdir(root)
+
+    def split_files(self, files, byte_count):
+        # bin-packs files into parts of about 'split_mb', largest file to the smallest part
+        part_count = int(ceil(float(byte_count) / self.split_bytes))
+        parts      = [{'bytes': 0, 'files': []} for i in range(part_count)]
+        for file_name, size in sorted(files, key=lambda f: f[1], reverse=True):
+            part = min(parts, key=lambda p: p['bytes'])
+            part['files'].append(file_name)
+            part['bytes'] += size
+        return filter(lambda p: len(p['files']) > 0, parts)
+
+    def output_file(self, subdir_name, part=None):
+        output_file = subdir_name
+        if part is not None:
+            output_file = "%s.part%03d" % (subdir_name, part)
+        if self.compression() in self.compress_programs:
+            return "%s.%s" % (output_file, self.compress_programs[self.compression()]['extension'])
+        elif self.do_gzip():
+            if part is not None:
+                return "%s.tar.gz" % output_file
+            return "%s.tgz" % output_file
+        return "%s.tar" % output_file
+
+    def compress_program(self, concurrent_jobs):
+        # returns the compressor command for tar, sharing the CPUs between concurrent jobs
+        if self.compression() not in self.compress_programs:
+            return None
+        program = self.compress_programs[self.compression()]
+        binary  = find_executable(program['binary'])
+        if not binary:
+            raise OperationError("Cannot find '%s' binary for %s compression!" % (program['binary'], self.compression()))
+        threads = self.compression_threads
+        if not threads or threads < 1:
+            threads = max(1, self.cpu_count / max(1, concurrent_jobs))
+        command = [binary, program['threads_flag'] % threads]
+        if self.compression_level and self.compression_level > 0:
+            command.append("-%i" % self.compression_level)
+        return " ".join(command)
+
+    def stream_upload(self, output_file):
+        # S3 upload options for an archive streamed to the key it would be uploaded to as a file
+        if not self.stream_to_upload:
+            return None
+        s3              = self.config.upload.s3
+        validate_bucket = not s3.skip_bucket_validation
+        return {
+            'bucket_name':        s3.bucket_name,
+            'region':             s3.region,
+            'access_key':         getattr(s3, 'access_key', None),
+            'secret_key':         getattr(s3, 'secret_key', None),
+            'key_name':           get_s3_key_name(
+                getattr(s3, 'bucket_prefix', None),
+                self.base_dir,
+                os.path.relpath(output_file, self.backup_dir),
+                getattr(s3, 'bucket_explicit_key', None)
+            ),
+            'chunk_bytes':        s3.chunk_size_mb * 1024 * 1024,
+            'threads':            self.config.upload.threads,
+            'max_inflight_parts': s3.max_inflight_parts,
+            'key_acl':            s3.acl,
+            'retries':            self.config.upload.retries,
+            'secure':             s3.secure,
+            'validate_bucket':    validate_bucket
+        }
+
+    def get_jobs(self):
+        # one job per backup subdir, or one per part for subdirs over 'split_mb'
+        jobs = []
+        for backup_dir in os.listdir(self.backup_dir):
+            subdir_name = os.path.join(self.backup_dir, backup_dir)
+            if not os.path.isdir(os.path.join(subdir_name, "dump")) or not self.is_unit_path(subdir_name):
+                continue
+            files      = self.get_dir_files(subdir_name)
+            byte_count = sum([size for file_name, size in files])
+            if self.split_bytes > 0 and byte_count > self.split_bytes:
+                parts = self.split_files(files, byte_count)
+                logging.info("Splitting archive of %s (%i bytes) into %i parts" % (subdir_name, byte_count, len(parts)))
+                self._parts[subdir_name] = len(parts)
+                for num, part in enumerate(parts):
+                    jobs.append({
+                        'directory':   subdir_name,
+                        'output_file': self.output_file(subdir_name, num),
+                        'files':       part['files'],
+                        'bytes':       part['bytes']
+                    })
+            else:
+                jobs.append({
+                    'directory':   subdir_name,
+                    'output_file': self.output_file(subdir_name),
+                    'files':       None,
+                    'bytes':       byte_count
+                })
+        # longest-processing-time first, so the largest archive does not start last
+        return sorted(jobs, key=lambda job: job['bytes'], reverse=True)
+
+    def get_thread(self, job, compress_program, chunk_bytes):
+        return TarThread(
+            job['directory'],
+            job['output_file'],
+            self.compression(),
+            self.verbose,
+            self.binary,
+            job['files'],
+            job['bytes'],
+            compress_program,
+            self.stream_upload(job['output_file']),
+            checksum_chunk_bytes=chunk_bytes
+        )
 
     def wait(self):
         if len(self._pooled) > 0:
@@ -75,18 +250,16 @@ class Tar(Task):
 
         if os.path.isdir(self.backup_dir):
             try:
-                self.running = True
-                for backup_dir in os.listdir(self.backup_dir):
-                    subdir_name = os.path.join(self.backup_dir, backup_dir)
-                    if not os.path.isdir(os.path.join(subdir_name, "dump")):
-                        continue
-                    output_file = "%s.tar" % subdir_name
-                    if self.do_gzip():
-                        output_file = "%s.tgz" % subdir_name
-                    self._pool.apply_async(
-                        TarThread(subdir_name, output_file, self.compression(), self.verbose, self.binary).run,
-                        callback=self.done)
-                    self._pooled.append(subdir_name)
+                self.running     = True
+                self._checksums  = StateChecksums(self.backup_dir, self.config, self.unit)
+                chunk_bytes      = get_checksum_chunk_bytes(self.config)
+                jobs             = self.get_jobs()
+                compress_program = self.compress_program(min(self.threads(), len(jobs)))
+                if compress_program:
+                    logging.info("Compressing tar archives with: %s" % compress_program)
+                for job in jobs:
+                    self._pooled.append(job['output_file'])
+                    self._pool.apply_async(self.get_thread(job, compress_program, chunk_bytes).run, callback=self.done)
             except Exception, e:
                 self._pool.terminate()
                 logging.fatal("Could not create tar archiving thread! Error: %s" % e)
@@ -94,6 +267,8 @@ class Tar(Task):
             finally:
                 self.wait()
                 self.completed = self._all_threads_successful
+                if self._checksums:
+                    self._checksums.write()
 
     def close(self, code=None, frame=None):
         if not self.stopped and self._pool is not None:
@@ -1,29 +1,116 @@
 import os
 import logging
 
-from mongodb_consistent_backup.Common import LocalCommand
+from shutil import rmtree
+from subprocess import Popen, PIPE
+from tempfile import TemporaryFile
+from time import time
+
+from mongodb_consistent_backup.Common import Checksum
+from mongodb_consistent_backup.Errors import OperationError
 from mongodb_consistent_backup.Pipeline import PoolThread
+from mongodb_consistent_backup.Upload.S3.S3StreamUpload import S3StreamUpload
 
 
 class TarThread(PoolThread):
-    def __init__(self, backup_dir, output_file, compression='none', verbose=False, binary="tar"):
+    def __init__(self, backup_dir, output_file, compression='none', verbose=False, binary="tar", files=None, byte_count=0,
+                 compress_program=None, stream_upload=None, stream_read_bytes=1024 * 1024, checksum_chunk_bytes=0):
         super(TarThread, self).__init__(self.__class__.__name__, compression)
         self.compression_method = compression
         self.backup_dir         = backup_dir
         self.output_file        = output_file
         self.verbose            = verbose
         self.binary             = binary
+        self.files              = files
+        self.byte_count         = byte_count
+        self.compress_program   = compress_program
+        self.stream_upload      = stream_upload
+        self.stream_read_bytes  = stream_read_bytes
 
-        self._command = None
+        # the archive is hashed as tar writes it, instead of reading it again for the upload. Hash
+        # objects cannot be pickled to the pool process, the checksum is created by .run()
+        self.checksum_chunk_bytes = checksum_chunk_bytes
+        self.checksum             = None
+        self.files_from = "%s.files" % self.output_file
+        self.start_time = None
+        self.end_time   = None
+        self._process   = None
 
     def close(self, exit_code=None, frame=None):
-        if self._command and not self.stopped:
-            logging.debug("Stopping running tar command: %s" % self._command.command)
+        if self._process and not self.stopped:
+            logging.debug("Stopping running tar command")
             del exit_code
             del frame
-            self._command.close()
+            if self._process.poll() is None:
+                self._process.kill()
             self.stopped = True
 
+    def write_files_from(self):
+        f = open(self.files_from, "w")
+        try:
+            for file_name in self.files:
+                f.write("%s\n" % file_name)
+        finally:
+            f.close()
+
+    def remove_source(self):
+        # streamed archives cannot use tar --remove-files, the upload may still fail
+        if self.files is not None:
+            base_dir = os.path.dirname(self.backup_dir)
+            for file_name in self.files:
+                os.remove(os.path.join(base_dir, file_name))
+        else:
+            rmtree(self.backup_dir)
+
+    def run_pipe(self, cmd_flags, write):
+        # passes the tar output to 'write', hashing it on the way
+        stderr = TemporaryFile()
+        try:
+            logging.debug("Running tar cmd: %s" % " ".join([self.binary] + cmd_flags))
+            self._process = Popen([self.binary] + cmd_flags, stdout=PIPE, stderr=stderr)
+            while True:
+                data = self._process.stdout.read(self.stream_read_bytes)
+                if not data:
+                    break
+                self.checksum.update(data)
+                write(data)
+            self.exit_code = self._process.wait()
+            if self.exit_code != 0:
+                stderr.seek(0)
+                raise OperationError("%s command failed with exit code %i! Stderr output:\n%s" % (
+                    self.binary,
+                    self.exit_code,
+                    stderr.read().strip()
+                ))
+        except Exception, e:
+            if self._process and self._process.poll() is None:
+                self._process.kill()
+            raise e
+        finally:
+            stderr.close()
+
+    def run_file(self, cmd_flags):
+        f = open(self.output_file, "wb")
+        try:
+            self.run_pipe(cmd_flags, f.write)
+        except Exception, e:
+            f.close()
+            os.remove(self.output_file)
+            raise e
+        finally:
+            f.close()
+
+    def run_stream(self, cmd_flags):
+        uploader = S3StreamUpload(byte_count=self.byte_count, **self.stream_upload)
+        try:
+            uploader.start()
+            self.run_pipe(cmd_flags, uploader.write)
+            uploader.complete()
+        except Exception, e:
+            uploader.cancel()
+            raise e
+        self.remove_source()
+
     def run(self):
         if os.path.isdir(self.backup_dir):
             if not os.path.isfile(self.output_file):
@@ -32,20 +119,40 @@ class TarThread(PoolThread):
                     backup_base_name = os.path.basename(self.backup_dir)
 
                     log_msg   = "Archiving directory: %s" % self.backup_dir
-                    cmd_flags = ["-C", backup_base_dir, "-c", "-f", self.output_file, "--remove-files"]
+                    cmd_flags = ["-C", backup_base_dir, "-c", "-f", "-", "--remove-files"]
+                    if self.stream_upload:
+                        cmd_flags = ["-C", backup_base_dir, "-c", "-f", "-"]
 
-                    if self.do_gzip():
+                    if self.compress_program:
+                        log_msg = "Archiving and compressing (%s) directory: %s" % (self.compression(), self.backup_dir)
+                        cmd_flags.append("--use-compress-program=%s" % self.compress_program)
+                    elif self.do_gzip():
                         log_msg = "Archiving and compressing directory: %s" % self.backup_dir
                         cmd_flags.append("-z")
 
-                    cmd_flags.append(backup_base_name)
+                    # part archives only contain the listed files
+                    if self.files is not None:
+                        log_msg = "%s (part: %s, %i files)" % (log_msg, os.path.basename(self.output_file), len(self.files))
+                        self.write_files_from()
+                        cmd_flags.append("--files-from=%s" % self.files_from)
+                    else:
+                        cmd_flags.append(backup_base_name)
+                    if self.stream_upload:
+                        log_msg = "%s, streaming to s3://%s%s" % (log_msg, self.stream_upload['bucket_name'], self.stream_upload['key_name'])
                     logging.info(log_msg)
-                    self.running  = True
-                    self._command = LocalCommand(self.binary, cmd_flags, self.verbose)
-                    self.exit_code = self._command.run()
+                    self.running    = True
+                    self.start_time = time()
+                    self.checksum   = Checksum(self.checksum_chunk_bytes)
+                    if self.stream_upload:
+                        self.run_stream(cmd_flags)
+                    else:
+                        self.run_file(cmd_flags)
+                    self.end_time = time()
                 except Exception, e:
                     return self.result(False, "Failed archiving file: %s!" % self.output_file, e)
                 finally:
+                    if os.path.isfile(self.files_from):
+                        os.remove(self.files_from)
                     self.running   = False
                     self.stopped   = True
                     self.completed = True
@@ -55,9 +162,21 @@ class TarThread(PoolThread):
 
     def result(self, success, message, error):
         return {
-            "success":   success,
-            "message":   message,
-            "error":     error,
-            "directory": self.backup_dir,
-            "exit_code": self.exit_code
+            "success":     success,
+            "message":     message,
+            "error":       error,
+            "directory":   self.backup_dir,
+            "output_file": self.output_file,
+            "exit_code":   self.exit_code,
+            "start":       self.start_time,
+            "end":         self.end_time,
+            "bytes":       self.byte_count,
+            "checksum":    self.checksum_summary(success)
         }
+
+    def checksum_summary(self, success):
+        if not success or not self.checksum:
+            return None
+        elif self.stream_upload:
+            return self.checksum.summary()
+        return self.checksum.summary(self.output_file)
@@ -5,7 +5,20 @@ def config(parser):
     parser.add_argument("--archive.tar.binary", dest="archive.tar.binary", default='tar', type=str,
                         help="Path to tar binary (default: tar)")
     parser.add_argument("--archive.tar.compression", dest="archive.tar.compression",
-                        help="Tar archiver compression method (default: gzip)", default='gzip', choices=['gzip', 'none'])
+                        help="Tar archiver compression method, 'pigz' (gzip-compatible) and 'zstd' compress with multiple "
+                             "threads (default: gzip)", default='gzip', choices=['gzip', 'none', 'pigz', 'zstd'])
+    parser.add_argument("--archive.tar.compression_level", dest="archive.tar.compression_level",
+                        help="Compression level for 'pigz' or 'zstd' compression, 0 uses the compressor default (default: 0)",
+                        default=0, type=int)
+    parser.add_argument("--archive.tar.compression_threads", dest="archive.tar.compression_threads",
+                        help="Number of threads per 'pigz' or 'zstd' compressor (default: CPUs/concurrent archives)",
+                        default=0, type=int)
+    parser.add_argument("--archive.tar.split_mb", dest="archive.tar.split_mb",
+                        help="Split archives of backup directories larger than this size into parts archived in parallel, "
+                             "0 disables splitting (default: 0)", default=0, type=int)
+    parser.add_argument("--archive.tar.stream_to_upload", dest="archive.tar.stream_to_upload", default=False, action="store_true",
+                        help="Stream tar archives directly to the upload as multipart chunks instead of writing them to "
+                             "disk, only supported by the 's3' upload method (default: false)")
     parser.add_argument("--archive.tar.threads", dest="archive.tar.threads",
                         help="Number of Tar archiver threads to use (default: 1-per-CPU)", default=0, type=int)
     return parser
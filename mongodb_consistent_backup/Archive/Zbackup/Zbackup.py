@@ -1,12 +1,20 @@
 import os
 import logging
 
-from select import select
+from multiprocessing.pool import ThreadPool
 from subprocess import Popen, PIPE, call
+from time import time
+
+from ZbackupThread import ZbackupThread
 
 from mongodb_consistent_backup.Common import Lock
 from mongodb_consistent_backup.Errors import OperationError
 from mongodb_consistent_backup.Pipeline import Task
+from mongodb_consistent_backup.State import StateChecksums
+
+
+def _run_ingest(ingest):
+    return ingest.run()
 
 
 class Zbackup(Task):
@@ -16,6 +24,7 @@ class Zbackup(Task):
         self.backup_time         = os.path.basename(self.backup_dir)
         self.zbackup_binary      = self.config.archive.zbackup.binary
         self.zbackup_cache_mb    = self.config.archive.zbackup.cache_mb
+        self.zbackup_concurrency = self.config.archive.zbackup.concurrency
         self.zbackup_passwd_file = self.config.archive.zbackup.password_file
 
         self.threads(self.config.archive.zbackup.threads)
@@ -33,10 +42,11 @@ class Zbackup(Task):
         self.zbackup_info        = os.path.join(self.zbackup_dir, "info")
         self.backup_meta_dir     = "mongodb-consistent-backup_META"
 
-        self.encrypted = False
-        self._zbackup  = None
-        self._tar      = None
-        self._version  = None
+        self.encrypted   = False
+        self.relay_bytes = 1024 * 1024
+        self._ingests    = []
+        self._pool       = None
+        self._version    = None
 
         self.init()
 
@@ -104,49 +114,35 @@ class Zbackup(Task):
         del exit_code
         del frame
         if not self.stopped:
-            if self._zbackup and self._zbackup.poll() is None:
-                logging.debug("Stopping running ZBackup command")
-                self._zbackup.terminate()
-            if self._tar and self._tar.poll() is None:
-                logging.debug("Stopping running ZBackup tar command")
-                self._tar.terminate()
+            for ingest in self._ingests:
+                ingest.close()
+            if self._pool:
+                self._pool.terminate()
             self.stopped = True
 
-    def poll(self, timeout=1):
-        try:
-            poll = select([self._zbackup.stderr.fileno()], [], [], timeout)
-        except ValueError:
-            return
-        if len(poll) >= 1:
-            for fd in poll[0]:
-                line = self._zbackup.stderr.readline()
-                if line:
-                    logging.info(line.rstrip())
-
-    def wait(self):
-        try:
-            tar_done = False
-            while self._zbackup.stderr and self._tar.stderr:
-                self.poll()
-                if tar_done:
-                    self._zbackup.communicate()
-                    if self._zbackup.poll() is not None:
-                        logging.info("ZBackup completed successfully with exit code: %i" % self._zbackup.returncode)
-                        if self._zbackup.returncode != 0:
-                            raise OperationError("ZBackup exited with code: %i!" % self._zbackup.returncode)
-                        break
-                elif self._tar.poll() is not None:
-                    if self._tar.returncode == 0:
-                        logging.debug("ZBackup tar command completed successfully with exit code: %i" % self._tar.returncode)
-                        tar_done = True
-                    else:
-                        raise OperationError("ZBackup archiving failed on tar command with exit code: %i" % self._tar.returncode)
-        except Exception, e:
-            raise OperationError("Error reading ZBackup output: %s" % e)
-
-    def get_commands(self, base_dir, sub_dir):
+    def get_dir_size(self, path):
+        size = 0
+        for root, dirs, files in os.walk(path):
+            for file_name in files:
+                size += os.path.getsize(os.path.join(root, file_name))
+        return size
+
+    def get_concurrency(self, sub_dirs):
+        # concurrent ingests, sharing the thread budget
+        return max(1, min(self.zbackup_concurrency, len(sub_dirs), self.threads()))
+
+    def get_cache_mb(self, byte_count, concurrency):
+        # the cache of each ingest, the cache size (set or sized from the backup data) is split across them
+        cache_mb = self.zbackup_cache_mb
+        if cache_mb < 1:
+            cache_mb = min(max(byte_count / 1024 / 1024 / 256, 128), 1024)
+        if concurrency > 1:
+            cache_mb = max(cache_mb / concurrency, 40)
+        return cache_mb
+
+    def get_commands(self, base_dir, sub_dir, threads, cache_mb):
         tar          = ["tar", "--remove-files", "-C", base_dir, "-c", sub_dir]
-        zbackup      = [self.zbackup_binary, "--cache-size", "%imb" % self.zbackup_cache_mb, "--compression", self.compression()]
+        zbackup      = [self.zbackup_binary, "--threads", str(threads), "--cache-size", "%imb" % cache_mb, "--compression", self.compression()]
         zbackup_path = os.path.join(self.zbackup_backups, "%s.%s.tar" % (self.backup_time, sub_dir))
         if self.encrypted:
             zbackup.extend(["--password-file", self.zbackup_passwd_file, "backup", zbackup_path])
@@ -159,24 +155,57 @@ class Zbackup(Task):
             lock = Lock(self.zbackup_lock)
             lock.acquire()
             try:
-                logging.info("Starting ZBackup version: %s (options: compression=%s, encryption=%s, threads=%i, cache_mb=%i)" % (
-                    self.version(), self.compression(), self.encrypted, self.threads(), self.zbackup_cache_mb
+                sub_dirs = []
+                for sub_dir in os.listdir(self.backup_dir):
+                    if sub_dir != self.backup_meta_dir and os.path.isdir(os.path.join(self.backup_dir, sub_dir)):
+                        sub_dirs.append((sub_dir, self.get_dir_size(os.path.join(self.backup_dir, sub_dir))))
+                total_bytes = sum([size for sub_dir, size in sub_dirs])
+                concurrency = self.get_concurrency(sub_dirs)
+                threads     = max(1, self.threads() / concurrency)
+                cache_mb    = self.get_cache_mb(total_bytes, concurrency)
+                logging.info("Starting ZBackup version: %s (options: compression=%s, encryption=%s, concurrency=%i, threads=%i, cache_mb=%i)" % (
+                    self.version(), self.compression(), self.encrypted, concurrency, threads, cache_mb
                 ))
-                self.running = True
+                if concurrency > 1:
+                    # zbackup writes new bundles and index files under random ids, so concurrent 'zbackup backup'
+                    # processes add files to the repository without replacing each other's. A process only loads
+                    # the index at start: data the concurrent ingests have in common (eg: collections on every
+                    # shard) is stored by each of them, data of earlier backups is still deduplicated
+                    logging.info("Running %i concurrent ZBackup ingests, they do not dedup against each other" % concurrency)
+                    # largest first, so the largest ingest does not start last
+                    sub_dirs.sort(key=lambda sub_dir: sub_dir[1], reverse=True)
+                self.running  = True
+                checksums     = StateChecksums(self.backup_dir, self.config)
+                bundles_bytes = self.get_dir_size(self.zbackup_bundles)
+                start         = time()
+                for sub_dir, size in sub_dirs:
+                    tar_cmd, zbkp_cmd = self.get_commands(self.backup_dir, sub_dir, threads, cache_mb)
+                    self._ingests.append(ZbackupThread(self.backup_dir, sub_dir, tar_cmd, zbkp_cmd, self.relay_bytes))
                 try:
-                    for sub_dir in os.listdir(self.backup_dir):
-                        if sub_dir == self.backup_meta_dir:
-                            continue
-                        logging.info("Running ZBackup for path: %s" % os.path.join(self.backup_dir, sub_dir))
-                        tar_cmd, zbkp_cmd = self.get_commands(self.backup_dir, sub_dir)
-                        logging.debug("Running ZBackup tar command: %s" % tar_cmd)
-                        logging.debug("Running ZBackup command: %s" % zbkp_cmd)
-                        self._zbackup = Popen(zbkp_cmd, stdin=PIPE, stderr=PIPE)
-                        self._tar     = Popen(tar_cmd, stdout=self._zbackup.stdin, stderr=PIPE)
-                        self.wait()
+                    self._pool = ThreadPool(processes=concurrency)
+                    for summary in self._pool.imap_unordered(_run_ingest, self._ingests):
+                        if not summary:
+                            raise OperationError("ZBackup ingest was stopped")
+                        # the checksum of the tar stream restored by 'zbackup restore'
+                        checksums.add_stream(os.path.relpath(summary['zbackup_path'], self.zbackup_dir), summary['checksum'])
+                    self._pool.close()
+                    self._pool.join()
                 except Exception, e:
+                    for ingest in self._ingests:
+                        ingest.close()
+                    self._pool.terminate()
                     raise OperationError("Could not execute ZBackup: %s" % e)
-                logging.info("Completed running all ZBackups")
+                finally:
+                    checksums.write()
+                duration      = max(time() - start, 0.001)
+                bundles_bytes = self.get_dir_size(self.zbackup_bundles) - bundles_bytes
+                logging.info("Completed running all ZBackups: %.2fmb in %.2f secs (%.2f MB/sec), added %.2fmb of bundles (dedup+compression ratio: %.2fx)" % (
+                    float(total_bytes / 1024.00 / 1024.00),
+                    duration,
+                    total_bytes / duration / 1024 / 1024,
+                    float(bundles_bytes / 1024.00 / 1024.00),
+                    float(total_bytes) / max(bundles_bytes, 1)
+                ))
                 self.completed = True
             finally:
                 self.running = False
@@ -0,0 +1,153 @@
+import logging
+import os
+
+from Queue import Queue
+from select import select
+from subprocess import Popen, PIPE
+from threading import Thread
+from time import sleep, time
+
+from mongodb_consistent_backup.Common import Checksum
+from mongodb_consistent_backup.Errors import OperationError
+
+
+def get_written_bytes(pid):
+    # bytes written by a process so far (linux only), the storage a zbackup process added to the repository
+    try:
+        with open("/proc/%i/io" % pid, "r") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split(":")[1])
+    except (IOError, ValueError):
+        pass
+
+
+# Ingests one backup subdirectory: 'tar' of the subdirectory piped into a
+# 'zbackup backup' process. The tar stream is hashed by its own thread while
+# it is relayed, so hashing does not hold up the input of zbackup.
+class ZbackupThread:
+    def __init__(self, base_dir, sub_dir, tar_cmd, zbackup_cmd, relay_bytes=1024 * 1024, hash_queue_blocks=16):
+        self.base_dir    = base_dir
+        self.sub_dir     = sub_dir
+        self.tar_cmd     = tar_cmd
+        self.zbackup_cmd = zbackup_cmd
+        self.relay_bytes = relay_bytes
+
+        self.checksum      = Checksum()
+        self.written_bytes = None
+        self.stopped       = False
+        self._zbackup      = None
+        self._tar          = None
+        self._relay        = None
+        self._relay_err    = None
+        self._hash_queue   = Queue(maxsize=hash_queue_blocks)
+
+    def poll(self, timeout=1):
+        try:
+            poll = select([self._zbackup.stderr.fileno()], [], [], timeout)
+        except ValueError:
+            return
+        if len(poll) >= 1:
+            for fd in poll[0]:
+                line = self._zbackup.stderr.readline()
+                if line:
+                    logging.info("%s: %s" % (self.sub_dir, line.rstrip()))
+                else:
+                    # zbackup closes stderr when exiting, its io counters are read before it is reaped
+                    self.written_bytes = get_written_bytes(self._zbackup.pid)
+                    self._zbackup.stderr.close()
+
+    def hash(self):
+        # hashlib releases the GIL on large updates, hashing runs alongside the relay writes
+        while True:
+            data = self._hash_queue.get()
+            if data is None:
+                break
+            self.checksum.update(data)
+
+    def relay(self):
+        # passes the tar output to zbackup and the hash thread
+        hasher = Thread(target=self.hash)
+        hasher.start()
+        try:
+            while True:
+                data = self._tar.stdout.read(self.relay_bytes)
+                if not data:
+                    break
+                self._hash_queue.put(data)
+                self._zbackup.stdin.write(data)
+        except Exception, e:
+            self._relay_err = e
+        finally:
+            self._hash_queue.put(None)
+            hasher.join()
+            self._zbackup.stdin.close()
+
+    def wait(self):
+        try:
+            tar_done = False
+            while True:
+                if not self._zbackup.stderr.closed:
+                    self.poll()
+                else:
+                    sleep(0.1)
+                # zbackup can exit before reading all of the tar output
+                if self._zbackup.stderr.closed and self._zbackup.poll() is not None and self._zbackup.returncode != 0:
+                    raise OperationError("ZBackup exited with code: %i!" % self._zbackup.returncode)
+                if tar_done:
+                    self._relay.join()
+                    if self._relay_err:
+                        raise OperationError("Error passing tar output to ZBackup: %s" % self._relay_err)
+                    if self._zbackup.stderr.closed and self._zbackup.poll() is not None:
+                        logging.debug("ZBackup of %s completed with exit code: %i" % (self.sub_dir, self._zbackup.returncode))
+                        break
+                elif self._tar.poll() is not None:
+                    if self._tar.returncode == 0:
+                        logging.debug("ZBackup tar command completed successfully with exit code: %i" % self._tar.returncode)
+                        tar_done = True
+                    else:
+                        raise OperationError("ZBackup archiving failed on tar command with exit code: %i" % self._tar.returncode)
+        except Exception, e:
+            raise OperationError("Error reading ZBackup output of %s: %s" % (self.sub_dir, e))
+
+    def run(self):
+        if self.stopped:
+            return
+        logging.info("Running ZBackup for path: %s" % os.path.join(self.base_dir, self.sub_dir))
+        logging.debug("Running ZBackup tar command: %s" % self.tar_cmd)
+        logging.debug("Running ZBackup command: %s" % self.zbackup_cmd)
+        start         = time()
+        self._zbackup = Popen(self.zbackup_cmd, stdin=PIPE, stderr=PIPE, close_fds=True)
+        self._tar     = Popen(self.tar_cmd, stdout=PIPE, stderr=PIPE, close_fds=True)
+        self._relay   = Thread(target=self.relay)
+        self._relay.start()
+        self.wait()
+        duration = max(time() - start, 0.001)
+        summary  = {
+            'sub_dir':       self.sub_dir,
+            'zbackup_path':  self.zbackup_cmd[-1],
+            'bytes':         self.checksum.byte_count,
+            'written_bytes': self.written_bytes,
+            'duration':      duration,
+            'checksum':      self.checksum.summary()
+        }
+        ratio = "unknown"
+        if self.written_bytes:
+            ratio = "%.2fx" % (float(self.checksum.byte_count) / self.written_bytes)
+        logging.info("Completed ZBackup of %s: %.2fmb in %.2f secs (%.2f MB/sec, dedup+compression ratio: %s)" % (
+            self.sub_dir,
+            float(self.checksum.byte_count / 1024.00 / 1024.00),
+            duration,
+            self.checksum.byte_count / duration / 1024 / 1024,
+            ratio
+        ))
+        return summary
+
+    def close(self):
+        self.stopped = True
+        if self._zbackup and self._zbackup.poll() is None:
+            logging.debug("Stopping running ZBackup command of %s" % self.sub_dir)
+            self._zbackup.terminate()
+        if self._tar and self._tar.poll() is None:
+            logging.debug("Stopping running ZBackup tar command of %s" % self.sub_dir)
+            self._tar.terminate()
@@ -2,6 +2,6 @@ from Archive import Archive  # NOQA
 
 
 def config(parser):
-    parser.add_argument("--archive.method", dest="archive.method", default='tar', choices=['tar', 'zbackup', 'none'],
+    parser.add_argument("--archive.method", dest="archive.method", default='tar', choices=['native', 'tar', 'zbackup', 'none'],
                         help="Archiver method (default: tar)")
     return parser
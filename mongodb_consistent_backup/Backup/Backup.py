@@ -1,10 +1,16 @@
+from mongodb_consistent_backup.Backup.Incremental import Incremental  # NOQA
 from mongodb_consistent_backup.Backup.Mongodump import Mongodump  # NOQA
 from mongodb_consistent_backup.Pipeline import Stage
 
 
 class Backup(Stage):
-    def __init__(self, manager, config, timer, base_dir, backup_dir, replsets, backup_stop=None, sharding=None):
-        super(Backup, self).__init__(self.__class__.__name__, manager, config, timer, base_dir, backup_dir,
-                                     replsets=replsets, backup_stop=backup_stop, sharding=sharding)
+    def __init__(self, manager, config, timer, base_dir, backup_dir, replsets, backup_stop=None, sharding=None, parent=None):
+        args = {'replsets': replsets, 'backup_stop': backup_stop, 'sharding': sharding}
+        if parent:
+            args['parent'] = parent
+        super(Backup, self).__init__(self.__class__.__name__, manager, config, timer, base_dir, backup_dir, **args)
         self.task = self.config.backup.method
+        if parent:
+            # incremental backups only capture the oplog since their parent backup
+            self.task = "incremental"
         self.init()
@@ -0,0 +1,134 @@
+import logging
+
+from time import sleep
+
+from mongodb_consistent_backup.Common import DB
+from mongodb_consistent_backup.Errors import OperationError
+from mongodb_consistent_backup.Oplog import OplogState
+from mongodb_consistent_backup.Pipeline import Task
+
+from IncrementalThread import IncrementalThread
+
+
+# Backs up the oplog changes of each replset since the end of the parent
+# backup, up to a consistent end ts: the oldest oplog tail of the replsets.
+# Restoring applies the oplog of each backup of the chain in order on top of
+# the full backup the chain starts with.
+class Incremental(Task):
+    def __init__(self, manager, config, timer, base_dir, backup_dir, replsets, backup_stop=None, sharding=None, parent=None):
+        super(Incremental, self).__init__(self.__class__.__name__, manager, config, timer, base_dir, backup_dir)
+        self.replsets    = replsets
+        self.backup_stop = backup_stop
+        self.sharding    = sharding
+        self.parent      = parent
+
+        self.end_ts         = None
+        self.backup_threads = []
+        self.states         = {}
+        self._summary       = {}
+
+        if not self.parent:
+            raise OperationError("Incremental backups require a parent backup!")
+
+    def summary(self):
+        return self._summary
+
+    def get_summaries(self):
+        for shard in self.states:
+            self._summary[shard] = self.states[shard].get().copy()
+            self._summary[shard]['parent_ts']     = self.parent['end_ts'][shard]
+            self._summary[shard]['consistent_ts'] = self.end_ts
+
+    def get_end_ts(self, uris):
+        # changes after the oldest tail are not in the oplog of every replset yet
+        end_ts = None
+        for shard in uris:
+            db = DB(uris[shard], self.config, False, 'secondary')
+            try:
+                tail_ts = db.get_oplog_tail_ts()
+            finally:
+                db.close()
+            if end_ts is None or tail_ts < end_ts:
+                end_ts = tail_ts
+        for shard in uris:
+            if self.parent['end_ts'][shard] > end_ts:
+                raise OperationError("Oplog tails of the replsets are behind the end of parent backup %s on %s, cannot reach a consistent state!" % (
+                    self.parent['name'],
+                    shard
+                ))
+        return end_ts
+
+    def wait(self):
+        completed = 0
+        start_threads = len(self.backup_threads)
+        while len(self.backup_threads) > 0:
+            if self.backup_stop and self.backup_stop.is_set():
+                logging.error("Received backup stop event due to error(s), stopping backup!")
+                raise OperationError("Received backup stop event due to error(s)")
+            for thread in self.backup_threads:
+                if not thread.is_alive():
+                    if thread.exitcode == 0:
+                        completed += 1
+                    self.backup_threads.remove(thread)
+            sleep(0.5)
+        self.get_summaries()
+
+        if completed == start_threads:
+            logging.info("All incremental oplog backups completed successfully")
+            self.timer.stop(self.timer_name)
+        else:
+            raise OperationError("Not all incremental oplog backup threads completed successfully!")
+
+    def run(self):
+        self.timer.start(self.timer_name)
+
+        uris = {}
+        for shard in self.replsets:
+            try:
+                uris[shard] = self.replsets[shard].find_secondary()['uri']
+            except Exception, e:
+                logging.error("Failed to get secondary for shard %s: %s" % (shard, e))
+                raise e
+        if sorted(self.parent['end_ts'].keys()) != sorted(uris.keys()):
+            raise OperationError("Replsets of parent backup %s (%s) differ from the current replsets (%s), a full backup is required!" % (
+                self.parent['name'],
+                ", ".join(sorted(self.parent['end_ts'].keys())),
+                ", ".join(sorted(uris.keys()))
+            ))
+        self.end_ts = self.get_end_ts(uris)
+
+        logging.info("Starting incremental backup chained to %s (chain: %i backup(s) since full backup %s), consistent end ts: %s" % (
+            self.parent['name'],
+            len(self.parent['chain']),
+            self.parent['chain'][0],
+            self.end_ts
+        ))
+        for shard in uris:
+            self.states[shard] = OplogState(self.manager, uris[shard])
+            self.backup_threads.append(IncrementalThread(
+                self.states[shard],
+                uris[shard],
+                self.timer,
+                self.config,
+                self.backup_dir,
+                self.parent['end_ts'][shard],
+                self.end_ts
+            ))
+        for thread in self.backup_threads:
+            thread.start()
+        self.wait()
+
+        self.completed = True
+        self.stopped   = True
+        return self._summary
+
+    def close(self):
+        if not self.stopped:
+            logging.info("Stopping all incremental oplog backup threads")
+            for thread in self.backup_threads:
+                thread.terminate()
+            try:
+                self.timer.stop(self.timer_name)
+            except Exception:
+                pass
+            self.stopped = True
@@ -0,0 +1,122 @@
+import os
+import logging
+import sys
+
+from multiprocessing import Process
+from signal import signal, SIGINT, SIGTERM, SIG_IGN
+
+from mongodb_consistent_backup.Common import DB
+from mongodb_consistent_backup.Errors import OperationError
+from mongodb_consistent_backup.Oplog import Oplog
+
+
+class IncrementalThread(Process):
+    def __init__(self, state, uri, timer, config, base_dir, start_ts, end_ts):
+        Process.__init__(self)
+        self.state    = state
+        self.uri      = uri
+        self.timer    = timer
+        self.config   = config
+        self.base_dir = base_dir
+        self.start_ts = start_ts
+        self.end_ts   = end_ts
+
+        self.timer_name       = "%s-%s" % (self.__class__.__name__, self.uri.replset)
+        self.exit_code        = 1
+        self.oplog_batch_docs = 1000
+
+        self.backup_dir = os.path.join(self.base_dir, self.uri.replset)
+        self.dump_dir   = os.path.join(self.backup_dir, "dump")
+        self.oplog_file = os.path.join(self.dump_dir, "oplog.bson")
+
+        signal(SIGINT, SIG_IGN)
+        signal(SIGTERM, self.close)
+
+    def close(self, exit_code=None, frame=None):
+        del exit_code
+        del frame
+        sys.exit(self.exit_code)
+
+    def capture_oplog(self, db):
+        # all changes after the last change of the parent backup. That change must still be in
+        # the oplog, or changes were lost to an oplog roll over (or a rollback) since the parent
+        if not db.is_ts_covered_by_oplog(self.start_ts):
+            raise OperationError("Oplog of %s no longer covers the end of the parent backup (ts: %s), a full backup is required!" % (
+                self.uri,
+                self.start_ts
+            ))
+        if not os.path.isdir(self.dump_dir):
+            os.makedirs(self.dump_dir)
+        oplog = Oplog(
+            self.oplog_file,
+            False,
+            'w+',
+            self.config.oplog.flush.max_docs,
+            self.config.oplog.flush.max_secs,
+            self.config.oplog.index.interval
+        )
+        cursor = None
+        found  = False
+        try:
+            cursor = db.get_simple_oplog_cursor_from_to(self.__class__, self.start_ts, self.end_ts)
+            batch  = []
+            for doc in cursor:
+                if not found:
+                    if doc['ts'] != self.start_ts:
+                        break
+                    # the last change of the parent is already in the parent backup
+                    found = True
+                    continue
+                batch.append(doc)
+                if len(batch) >= self.oplog_batch_docs:
+                    oplog.add_batch(batch)
+                    batch = []
+            oplog.add_batch(batch)
+        finally:
+            if cursor:
+                cursor.close()
+            oplog.close()
+        if not found:
+            raise OperationError("Oplog of %s has no change at the end of the parent backup (ts: %s), a full backup is required!" % (
+                self.uri,
+                self.start_ts
+            ))
+        return oplog
+
+    def run(self):
+        logging.info("Starting incremental oplog backup of %s, changes after ts: %s until ts: %s" % (self.uri, self.start_ts, self.end_ts))
+
+        self.timer.start(self.timer_name)
+        self.state.set('running', True)
+        self.state.set('file', self.oplog_file)
+
+        db = None
+        try:
+            db    = DB(self.uri, self.config, False, 'secondary')
+            oplog = self.capture_oplog(db)
+        except Exception, e:
+            logging.exception("Error performing incremental oplog backup of %s: %s" % (self.uri, e))
+            self.exit_code = 1
+            sys.exit(self.exit_code)
+        finally:
+            if db:
+                db.close()
+
+        # without new changes the backup ends at the same change as its parent
+        last_ts = oplog.last_ts()
+        if not last_ts:
+            last_ts = self.start_ts
+        self.state.set('running', False)
+        self.state.set('completed', True)
+        self.state.set('count', oplog.count())
+        self.state.set('first_ts', oplog.first_ts())
+        self.state.set('last_ts', last_ts)
+        self.timer.stop(self.timer_name)
+        self.exit_code = 0
+
+        logging.info("Incremental backup %s completed in %.2f seconds, %i oplog changes, end ts: %s" % (
+            self.uri,
+            self.timer.duration(self.timer_name),
+            oplog.count(),
+            last_ts
+        ))
@@ -0,0 +1,9 @@
+from Incremental import Incremental  # NOQA
+
+
+def config(parser):
+    parser.add_argument("--backup.incremental.max_chain", dest="backup.incremental.max_chain",
+                        help="Number of incremental backups chained to a full backup before the next backup is a full "
+                             "backup again. 0 chains all backups to the last full backup (default: 24)",
+                        default=24, type=int)
+    return parser
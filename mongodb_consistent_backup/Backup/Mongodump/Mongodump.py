@@ -21,6 +21,7 @@ class Mongodump(Task):
         self.authdb             = self.config.authdb
         self.compression_method = self.config.backup.mongodump.compression
         self.binary             = self.config.backup.mongodump.binary
+        self.fanout_workers     = self.config.backup.mongodump.fanout_workers
         self.replsets           = replsets
         self.backup_stop        = backup_stop
         self.sharding           = sharding
@@ -113,8 +114,11 @@ class Mongodump(Task):
         elif not self.thread_count and self.version != 'unknown':
             if tuple(self.version.split(".")) >= tuple("3.2.0".split(".")):
                 self.thread_count = 1
-                if self.cpu_count > len(self.replsets):
-                    self.thread_count = int(floor(self.cpu_count / len(self.replsets)))
+                dumps = len(self.replsets)
+                if self.fanout_workers > 1:
+                    dumps = dumps * self.fanout_workers
+                if self.cpu_count > dumps:
+                    self.thread_count = int(floor(self.cpu_count / dumps))
                     if self.thread_count > self.threads_max:
                         self.thread_count = self.threads_max
             else:
@@ -138,7 +142,8 @@ class Mongodump(Task):
                     self.backup_dir,
                     self.version,
                     self.threads(),
-                    self.do_gzip()
+                    self.do_gzip(),
+                    self.fanout_workers
                 )
                 self.dump_threads.append(thread)
             except Exception, e:
@@ -150,7 +155,9 @@ class Mongodump(Task):
 
         options = {
             'compression':      self.compression(),
-            'threads_per_dump': self.threads()
+            'threads_per_dump': self.threads(),
+            'fanout_workers':   self.fanout_workers,
+            'reuse':            self.config.backup.mongodump.reuse_collections
         }
         options.update(self.version_extra)
         logging.info(
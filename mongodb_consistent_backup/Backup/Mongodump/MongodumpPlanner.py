@@ -0,0 +1,72 @@
+import logging
+
+from pymongo.errors import OperationFailure
+
+from mongodb_consistent_backup.Errors import DBOperationError
+
+
+# Plans a replset dump as per-collection mongodump jobs, bin-packed by data
+# size into lanes of jobs that are dumped concurrently. Each database also
+# gets a job for everything not dumped per-collection (views, system
+# collections), the 'admin' database is always dumped as a whole.
+class MongodumpPlanner:
+    def __init__(self, db, lanes=2):
+        self.db    = db
+        self.lanes = lanes
+
+        self.skip_dbs  = ['local']
+        self.whole_dbs = ['admin']
+
+    def databases(self):
+        dbs = []
+        for database in self.db.admin_command({'listDatabases': 1})['databases']:
+            if database['name'] not in self.skip_dbs:
+                dbs.append(database['name'])
+        return dbs
+
+    def collections(self, db_name):
+        collections = []
+        database    = self.db.connection()[db_name]
+        try:
+            for collection in database.list_collections():
+                name = collection['name']
+                # 'type' is only returned by 3.4+, where views exist
+                if collection.get('type', 'collection') != 'collection':
+                    continue
+                elif name.startswith('system.'):
+                    continue
+                collections.append(name)
+        except OperationFailure, e:
+            raise DBOperationError("Unable to list collections of database %s! Error: %s" % (db_name, e))
+        return collections
+
+    def collection_size(self, db_name, collection):
+        try:
+            return int(self.db.connection()[db_name].command({'collStats': collection}).get('size', 0))
+        except OperationFailure, e:
+            logging.warning("Unable to get size of collection %s.%s, assuming empty: %s" % (db_name, collection, e))
+        return 0
+
+    def jobs(self):
+        jobs = []
+        for db_name in self.databases():
+            if db_name in self.whole_dbs:
+                jobs.append({'db': db_name, 'size': 0})
+                continue
+            collections = self.collections(db_name)
+            for collection in collections:
+                jobs.append({'db': db_name, 'collection': collection, 'size': self.collection_size(db_name, collection)})
+            jobs.append({'db': db_name, 'exclude': collections, 'size': 0})
+        return jobs
+
+    def plan(self, jobs=None):
+        # longest-processing-time first: largest job to the least-loaded lane
+        if jobs is None:
+            jobs = self.jobs()
+        lanes = [{'size': 0, 'jobs': []} for i in range(self.lanes)]
+        jobs  = sorted(jobs, key=lambda job: job['size'], reverse=True)
+        for job in jobs:
+            lane = min(lanes, key=lambda candidate: candidate['size'])
+            lane['jobs'].append(job)
+            lane['size'] += job['size']
+        return filter(lambda planned: len(planned['jobs']) > 0, lanes)
@@ -0,0 +1,190 @@
+import logging
+import os
+
+from bson import json_util
+from hashlib import md5
+from pymongo import DESCENDING
+from pymongo.errors import OperationFailure
+
+from mongodb_consistent_backup.Errors import OperationError
+from mongodb_consistent_backup.State import StateCollections
+
+
+# Reuses the dump files of collections that did not change since the previous
+# backup. Before the dump each collection is fingerprinted, with the 'dbHash'
+# of the collection or with its count, size and max _id ('stats', cheaper but
+# blind to in-place updates), plus its options and indexes. A collection is
+# hardlinked from the previous backup when its fingerprint is unchanged and the
+# previous files are 'stable': they were linked themselves, or no oplog change
+# touched the collection while they were dumped. The oplog captured from the
+# start of the dump applies on top of reused files like on dumped ones, so the
+# backup remains a full, consistent point-in-time set.
+class MongodumpReuse:
+    def __init__(self, db, config, base_dir, replset, mode="dbhash", dump_gzip=False):
+        self.db        = db
+        self.config    = config
+        self.base_dir  = base_dir
+        self.replset   = replset
+        self.mode      = mode
+        self.dump_gzip = dump_gzip
+
+        self.modes       = ['dbhash', 'stats']
+        self.backups_dir = os.path.dirname(self.base_dir)
+        self.backup_name = os.path.basename(self.base_dir)
+        self.dump_dir    = os.path.join(self.replset, "dump")
+
+        self.state         = StateCollections(self.base_dir, self.config, self.replset, self.mode)
+        self.previous_name = None
+        self.previous      = {}
+        self.fingerprints  = {}
+        self.reused        = {}
+        self.touched       = set()
+        self.touched_dbs   = set()
+        self.touched_all   = False
+
+        if self.mode not in self.modes:
+            raise OperationError("Unsupported collection reuse mode: %s!" % self.mode)
+
+    def load_previous(self):
+        # the collections of the newest completed full backup before this one, with the same reuse mode
+        for name in sorted(os.listdir(self.backups_dir), reverse=True):
+            backup_dir = os.path.join(self.backups_dir, name)
+            if name >= self.backup_name or name == self.state.meta_name or os.path.islink(backup_dir):
+                continue
+            try:
+                meta = self.state.load(True, os.path.join(backup_dir, self.state.meta_name, "meta.bson"))
+                if not meta.get('completed') or meta.get('type', 'full') != 'full':
+                    continue
+                state_file = os.path.join(backup_dir, self.state.meta_name, os.path.basename(self.state.state_file))
+                if not os.path.isfile(state_file):
+                    logging.info("Previous backup %s of %s has no collections state, dumping all collections" % (name, self.replset))
+                    return
+                state = self.state.load(True, state_file)
+                if state.get('mode') == self.mode:
+                    self.previous_name = name
+                    self.previous      = state.get('collections', {})
+                    logging.info("Found %i collection(s) of %s in previous backup %s" % (len(self.previous), self.replset, name))
+                else:
+                    logging.info("Previous backup %s of %s used another reuse mode, dumping all collections" % (name, self.replset))
+                return
+            except Exception, e:
+                logging.debug("Skipping backup %s for collection reuse: %s" % (name, e))
+
+    def collection_hash(self, db_name, collection):
+        database = self.db.connection()[db_name]
+        if self.mode == "dbhash":
+            return database.command({'dbHash': 1, 'collections': [collection]})['collections'].get(collection)
+        stats  = database.command({'collStats': collection})
+        newest = list(database[collection].find({}, {'_id': 1}).sort('_id', DESCENDING).limit(1))
+        if len(newest) > 0:
+            newest = newest[0]['_id']
+        return [stats.get('count'), stats.get('size'), newest]
+
+    def fingerprint(self, db_name, collection):
+        # None when the collection cannot be fingerprinted, it is then always dumped
+        try:
+            database = self.db.connection()[db_name]
+            info     = list(database.list_collections(filter={'name': collection}))
+            indexes  = list(database[collection].list_indexes())
+            value    = json_util.dumps([self.mode, self.collection_hash(db_name, collection), info, indexes])
+            return md5(value).hexdigest()
+        except OperationFailure, e:
+            logging.warning("Unable to fingerprint collection %s.%s, dumping it: %s" % (db_name, collection, e))
+
+    def get_files(self, db_name, collection):
+        # the dump files of a collection, relative to the backup dir
+        files = []
+        for suffix in ["bson", "metadata.json"]:
+            file_name = "%s.%s" % (collection, suffix)
+            if self.dump_gzip:
+                file_name += ".gz"
+            files.append(os.path.join(self.dump_dir, db_name, file_name))
+        return files
+
+    def can_reuse(self, namespace, fingerprint, files):
+        previous = self.previous.get(namespace)
+        if not fingerprint or not previous or not previous.get('stable'):
+            return False
+        elif previous.get('fingerprint') != fingerprint or sorted(previous.get('files', [])) != sorted(files):
+            return False
+        for rel_path in files:
+            if not os.path.isfile(os.path.join(self.backups_dir, self.previous_name, rel_path)):
+                return False
+        return True
+
+    def link_files(self, files):
+        linked = []
+        try:
+            for rel_path in files:
+                path = os.path.join(self.base_dir, rel_path)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                os.link(os.path.join(self.backups_dir, self.previous_name, rel_path), path)
+                linked.append(path)
+            return True
+        except OSError, e:
+            logging.warning("Unable to link files from previous backup %s, dumping them: %s" % (self.previous_name, e))
+            for path in linked:
+                os.remove(path)
+        return False
+
+    def filter_jobs(self, jobs):
+        # the planner jobs without the collections reused from the previous backup, which stay excluded
+        # from the jobs of their databases
+        self.load_previous()
+        dump_jobs = []
+        for job in jobs:
+            if 'collection' not in job:
+                dump_jobs.append(job)
+                continue
+            namespace   = "%s.%s" % (job['db'], job['collection'])
+            fingerprint = self.fingerprint(job['db'], job['collection'])
+            files       = self.get_files(job['db'], job['collection'])
+            self.fingerprints[namespace] = fingerprint
+            if self.previous_name and self.can_reuse(namespace, fingerprint, files) and self.link_files(files):
+                logging.debug("Reusing unchanged collection %s from previous backup %s" % (namespace, self.previous_name))
+                self.reused[namespace] = job['size']
+                # the files are the fingerprinted state, uploads copy them from the previous backup
+                self.state.add_collection(namespace, fingerprint, files, True, self.previous_name)
+                continue
+            dump_jobs.append(job)
+        logging.info("Reusing %i unchanged collection(s) of %s (%.2fmb) from previous backup %s, dumping %i collection(s)" % (
+            len(self.reused),
+            self.replset,
+            float(sum(self.reused.itervalues()) / 1024.00 / 1024.00),
+            self.previous_name,
+            len(filter(lambda job: 'collection' in job, dump_jobs))
+        ))
+        return dump_jobs
+
+    def add_oplog_doc(self, doc):
+        # namespaces changed while dumping, a command changes all collections of its database
+        if self.touched_all or doc.get('op') == 'n':
+            return
+        db_name = doc.get('ns', '').split('.', 1)[0]
+        if doc.get('op') == 'c':
+            # 'admin' commands (applyOps, renameCollection) can change collections of any database
+            if db_name == 'admin':
+                self.touched_all = True
+            self.touched_dbs.add(db_name)
+        else:
+            self.touched.add(doc.get('ns'))
+
+    def is_stable(self, namespace):
+        if self.touched_all or namespace in self.touched:
+            return False
+        return namespace.split('.', 1)[0] not in self.touched_dbs
+
+    def write(self):
+        # dumped collections can be reused by the next backup if they did not change while being dumped
+        for namespace, fingerprint in self.fingerprints.iteritems():
+            if namespace in self.reused:
+                continue
+            db_name, collection = namespace.split('.', 1)
+            files = self.get_files(db_name, collection)
+            for rel_path in files:
+                if not os.path.isfile(os.path.join(self.base_dir, rel_path)):
+                    files = []
+                    break
+            self.state.add_collection(namespace, fingerprint, files, self.is_stable(namespace))
+        self.state.write()
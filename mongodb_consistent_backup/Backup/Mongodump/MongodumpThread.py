@@ -8,23 +8,29 @@ from select import select
 from shutil import rmtree
 from signal import signal, SIGINT, SIGTERM, SIG_IGN
 from subprocess import Popen, PIPE
+from threading import Event, Thread
 
-from mongodb_consistent_backup.Common import is_datetime, parse_config_bool, parse_read_pref_tags
+from mongodb_consistent_backup.Common import DB, is_datetime, parse_config_bool, parse_read_pref_tags
+from mongodb_consistent_backup.Errors import OperationError
 from mongodb_consistent_backup.Oplog import Oplog
 
+from MongodumpPlanner import MongodumpPlanner
+from MongodumpReuse import MongodumpReuse
+
 
 # noinspection PyStringFormat
 class MongodumpThread(Process):
-    def __init__(self, state, uri, timer, config, base_dir, version, threads=0, dump_gzip=False):
+    def __init__(self, state, uri, timer, config, base_dir, version, threads=0, dump_gzip=False, fanout_workers=0):
         Process.__init__(self)
-        self.state     = state
-        self.uri       = uri
-        self.timer     = timer
-        self.config    = config
-        self.base_dir  = base_dir
-        self.version   = version
-        self.threads   = threads
-        self.dump_gzip = dump_gzip
+        self.state          = state
+        self.uri            = uri
+        self.timer          = timer
+        self.config         = config
+        self.base_dir       = base_dir
+        self.version        = version
+        self.threads        = threads
+        self.dump_gzip      = dump_gzip
+        self.fanout_workers = fanout_workers
 
         self.user                 = self.config.username
         self.password             = self.config.password
@@ -34,13 +40,17 @@ class MongodumpThread(Process):
         self.ssl_client_cert_file = self.config.ssl.client_cert_file
         self.read_pref_tags       = self.config.replication.read_pref_tags
         self.binary               = self.config.backup.mongodump.binary
+        self.reuse_collections    = self.config.backup.mongodump.reuse_collections
 
         self.timer_name        = "%s-%s" % (self.__class__.__name__, self.uri.replset)
         self.exit_code         = 1
         self.error_message     = None
         self._command          = None
         self.do_stdin_passwd   = False
-        self.stdin_passwd_sent = False
+        self.oplog_batch_docs  = 1000
+        self._processes        = []
+        self._lane_failed      = None
+        self._reuse            = None
 
         self.backup_dir = os.path.join(self.base_dir, self.uri.replset)
         self.dump_dir   = os.path.join(self.backup_dir, "dump")
@@ -50,6 +60,9 @@ class MongodumpThread(Process):
         signal(SIGTERM, self.close)
 
     def close(self, exit_code=None, frame=None):
+        for process in self._processes:
+            if process.poll() is None:
+                process.terminate()
         if self._command:
             logging.debug("Stopping running subprocess/command: %s" % self._command.command)
             del exit_code
@@ -57,6 +70,13 @@ class MongodumpThread(Process):
             self._command.close()
         sys.exit(self.exit_code)
 
+    def do_fanout(self):
+        # collections are only reused by the per-collection jobs of a fan-out
+        return self.fanout_workers > 1 or self.do_reuse()
+
+    def do_reuse(self):
+        return self.reuse_collections and self.reuse_collections != "none"
+
     def do_ssl(self):
         return parse_config_bool(self.config.ssl.enabled)
 
@@ -96,12 +116,10 @@ class MongodumpThread(Process):
             return True
         return False
 
-    def handle_password_prompt(self):
-        if self.do_stdin_passwd and not self.stdin_passwd_sent:
-            logging.debug("Received password prompt from mongodump, writing password to stdin")
-            self._process.stdin.write(self.password + "\n")
-            self._process.stdin.flush()
-            self.stdin_passwd_sent = True
+    def handle_password_prompt(self, process):
+        logging.debug("Received password prompt from mongodump, writing password to stdin")
+        process.stdin.write(self.password + "\n")
+        process.stdin.flush()
 
     def is_failed_line(self, line):
         if line and line.startswith("Failed: "):
@@ -112,33 +130,45 @@ class MongodumpThread(Process):
         self.error_message = line.replace("Failed: ", "").capitalize()
         logging.error("Mongodump error: %s" % self.error_message)
         self.exit_code = 1
-        self.close()
-
-    def wait(self):
+        # fan-out lanes fail by the exit code of their mongodump process
+        if not self.do_fanout():
+            self.close()
+
+    def wait(self, process=None):
+        if not process:
+            process = self._process
+        stdin_passwd_sent = False
         try:
-            while self._process.stderr:
-                poll = select([self._process.stderr.fileno()], [], [])
+            while process.stderr:
+                poll = select([process.stderr.fileno()], [], [])
                 if len(poll) >= 1:
                     for fd in poll[0]:
-                        read = self._process.stderr.readline()
+                        read = process.stderr.readline()
                         line = self.parse_mongodump_line(read)
                         if not line:
                             continue
                         elif self.is_password_prompt(read):
-                            self.handle_password_prompt()
+                            if not stdin_passwd_sent:
+                                self.handle_password_prompt(process)
+                                stdin_passwd_sent = True
                         elif self.is_failed_line(read):
                             self.handle_failure(read)
                             break
                         else:
                             logging.info(line)
-                if self._process.poll() is not None:
+                if process.poll() is not None:
                     break
         except Exception, e:
             logging.exception("Error reading mongodump output: %s" % e)
         finally:
-            self._process.communicate()
+            process.communicate()
 
-    def mongodump_cmd(self):
+    def job_name(self, job):
+        if 'collection' in job:
+            return "%s.%s" % (job['db'], job['collection'])
+        return job['db']
+
+    def mongodump_cmd(self, job=None):
         mongodump_uri   = self.uri.get()
         mongodump_cmd   = [self.binary]
         mongodump_flags = []
@@ -155,10 +185,16 @@ class MongodumpThread(Process):
                 "--port=%s" % str(mongodump_uri.port)
             ])
 
-        mongodump_flags.extend([
-            "--oplog",
-            "--out=%s/dump" % self.backup_dir
-        ])
+        # a fan-out job dumps a single collection or database, the oplog is captured separately
+        if job:
+            mongodump_flags.append("--db=%s" % job['db'])
+            if 'collection' in job:
+                mongodump_flags.append("--collection=%s" % job['collection'])
+            for collection in job.get('exclude', []):
+                mongodump_flags.append("--excludeCollection=%s" % collection)
+        else:
+            mongodump_flags.append("--oplog")
+        mongodump_flags.append("--out=%s/dump" % self.backup_dir)
 
         # --numParallelCollections
         if self.threads > 0:
@@ -219,18 +255,109 @@ class MongodumpThread(Process):
         mongodump_cmd.extend(mongodump_flags)
         return mongodump_cmd
 
-    def run(self):
-        logging.info("Starting mongodump backup of %s" % self.uri)
-
-        self.timer.start(self.timer_name)
-        self.state.set('running', True)
-        self.state.set('file', self.oplog_file)
+    def prepare_dump_dir(self):
+        if os.path.isdir(self.dump_dir):
+            rmtree(self.dump_dir)
+        os.makedirs(self.dump_dir)
+
+    def run_lane(self, jobs):
+        for job in jobs:
+            if self._lane_failed.is_set():
+                return
+            try:
+                mongodump_cmd = self.mongodump_cmd(job)
+                logging.debug("Running mongodump cmd: %s" % " ".join(mongodump_cmd))
+                process = Popen(mongodump_cmd, stdin=PIPE, stderr=PIPE)
+                self._processes.append(process)
+                self.wait(process)
+                if process.returncode != 0:
+                    raise OperationError("mongodump exited with code %i" % process.returncode)
+            except Exception, e:
+                logging.error("Error dumping %s on %s: %s" % (self.job_name(job), self.uri, e))
+                self._lane_failed.set()
+                return
+
+    def run_lanes(self, lanes):
+        self._lane_failed = Event()
+        threads = []
+        for lane in lanes:
+            thread = Thread(target=self.run_lane, args=(lane['jobs'],))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            # join with a timeout to keep handling signals
+            while thread.is_alive():
+                thread.join(1)
+        if self._lane_failed.is_set():
+            raise OperationError("Not all mongodump fan-out jobs completed successfully on %s!" % self.uri)
+
+    def capture_oplog(self, db, start_ts, end_ts):
+        # the equivalent of mongodump --oplog: all changes from the newest change
+        # before the dump started, which must not have rolled off the oplog
+        oplog = Oplog(
+            self.oplog_file,
+            self.dump_gzip,
+            'w+',
+            self.config.oplog.flush.max_docs,
+            self.config.oplog.flush.max_secs,
+            self.config.oplog.index.interval
+        )
+        cursor = None
+        try:
+            cursor = db.get_simple_oplog_cursor_from_to(self.__class__, start_ts, end_ts)
+            batch  = []
+            for doc in cursor:
+                if oplog.count() == 0 and len(batch) == 0 and doc['ts'] != start_ts:
+                    raise OperationError("Oplog for %s has rolled over since %s, unable to reach a consistent state!" % (self.uri, start_ts))
+                batch.append(doc)
+                if self._reuse:
+                    self._reuse.add_oplog_doc(doc)
+                if len(batch) >= self.oplog_batch_docs:
+                    oplog.add_batch(batch)
+                    batch = []
+            oplog.add_batch(batch)
+        finally:
+            if cursor:
+                cursor.close()
+            oplog.close()
+        if oplog.count() == 0:
+            raise OperationError("Oplog for %s has rolled over since %s, unable to reach a consistent state!" % (self.uri, start_ts))
+        return oplog
+
+    def run_fanout(self):
+        db = None
+        try:
+            self.prepare_dump_dir()
+            db       = DB(self.uri, self.config, False, 'secondary')
+            start_ts = db.get_oplog_tail_ts()
+            planner  = MongodumpPlanner(db, max(self.fanout_workers, 1))
+            jobs     = planner.jobs()
+            if self.do_reuse():
+                # fingerprinted after the start ts, the captured oplog applies on top of reused collections
+                self._reuse = MongodumpReuse(db, self.config, self.base_dir, self.uri.replset, self.reuse_collections, self.dump_gzip)
+                jobs        = self._reuse.filter_jobs(jobs)
+            lanes = planner.plan(jobs)
+            logging.info("Starting %i concurrent mongodump lanes for %s, oplog start ts: %s" % (len(lanes), self.uri, start_ts))
+            self.run_lanes(lanes)
+            end_ts = db.get_oplog_tail_ts()
+            oplog  = self.capture_oplog(db, start_ts, end_ts)
+            if self._reuse:
+                self._reuse.write()
+            self.exit_code = 0
+            return oplog
+        except Exception, e:
+            logging.exception("Error performing mongodump fan-out: %s" % e)
+            self.exit_code = 1
+            sys.exit(self.exit_code)
+        finally:
+            if db:
+                db.close()
 
+    def run_single(self):
         mongodump_cmd = self.mongodump_cmd()
         try:
-            if os.path.isdir(self.dump_dir):
-                rmtree(self.dump_dir)
-            os.makedirs(self.dump_dir)
+            self.prepare_dump_dir()
             logging.debug("Running mongodump cmd: %s" % " ".join(mongodump_cmd))
             self._process = Popen(mongodump_cmd, stdin=PIPE, stderr=PIPE)
             self.wait()
@@ -241,10 +368,23 @@ class MongodumpThread(Process):
             logging.exception("Error performing mongodump: %s" % e)
 
         try:
-            oplog = Oplog(self.oplog_file, self.dump_gzip)
+            oplog = Oplog(self.oplog_file, self.dump_gzip, index_docs=self.config.oplog.index.interval)
             oplog.load()
         except Exception, e:
             logging.exception("Error loading oplog: %s" % e)
+        return oplog
+
+    def run(self):
+        logging.info("Starting mongodump backup of %s" % self.uri)
+
+        self.timer.start(self.timer_name)
+        self.state.set('running', True)
+        self.state.set('file', self.oplog_file)
+
+        if self.do_fanout():
+            oplog = self.run_fanout()
+        else:
+            oplog = self.run_single()
 
         self.state.set('running', False)
         self.state.set('completed', True)
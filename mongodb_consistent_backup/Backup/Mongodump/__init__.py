@@ -7,6 +7,15 @@ def config(parser):
     parser.add_argument("--backup.mongodump.compression", dest="backup.mongodump.compression",
                         help="Compression method to use on backup (default: auto)", default="auto",
                         choices=["auto", "none", "gzip"])
+    parser.add_argument("--backup.mongodump.fanout_workers", dest="backup.mongodump.fanout_workers",
+                        help="Number of concurrent per-collection mongodump processes for each shard, collections are "
+                             "bin-packed by size. 0 or 1 uses a single 'mongodump --oplog' (default: 0)",
+                        default=0, type=int)
+    parser.add_argument("--backup.mongodump.reuse_collections", dest="backup.mongodump.reuse_collections",
+                        help="Hardlink the files of collections unchanged since the previous backup instead of dumping them, "
+                             "compared by 'dbHash' or by count, size and max _id ('stats', cheaper but misses in-place updates). "
+                             "Uses per-collection mongodump jobs and needs the unarchived dump of the previous backup "
+                             "(default: none)", default="none", choices=["none", "dbhash", "stats"])
     parser.add_argument("--backup.mongodump.threads", dest="backup.mongodump.threads",
                         help="Number of threads to use for each mongodump process. There is 1 x mongodump per shard, be careful! (default: shards/CPUs)",
                         default=0, type=int)
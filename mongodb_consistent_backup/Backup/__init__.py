@@ -8,4 +8,7 @@ def config(parser):
                         help="Base path to store the backup data (default: /var/lib/mongodb-consistent-backup)")
     parser.add_argument("-m", "--backup.method", dest="backup.method", default='mongodump', choices=['mongodump'],
                         help="Method to be used for backup (default: mongodump)")
+    parser.add_argument("--backup.type", dest="backup.type", default='full', choices=['full', 'incremental'],
+                        help="Type of backup. Incremental backups only capture the oplog since the last completed backup, "
+                             "chained to a full backup (default: full)")
     return parser
@@ -0,0 +1,93 @@
+import os
+
+from hashlib import md5, sha256
+
+
+def get_checksum_chunk_bytes(config):
+    # the multipart/component size of the upload method, chunk md5s let uploads skip hashing files again
+    method = config.upload.method
+    if method in ("s3", "gs"):
+        return getattr(config.upload, method).chunk_size_mb * 1024 * 1024
+    return 0
+
+
+def file_checksum(file_path, chunk_bytes=0, read_bytes=1024 * 1024):
+    checksum = Checksum(chunk_bytes)
+    with open(file_path, "rb") as f:
+        for data in iter(lambda: f.read(read_bytes), b""):
+            checksum.update(data)
+    return checksum.summary(file_path)
+
+
+def file_checksum_job(job):
+    file_path, chunk_bytes = job
+    return file_path, file_checksum(file_path, chunk_bytes)
+
+
+def is_checksum_current(checksum, file_path):
+    # the file was not changed since it was hashed
+    if not checksum or 'mtime' not in checksum or not os.path.isfile(file_path):
+        return False
+    stat = os.stat(file_path)
+    return checksum['size'] == stat.st_size and checksum['mtime'] == int(stat.st_mtime)
+
+
+def checksum_md5hexes(checksum, file_path, chunk_bytes, multipart=False):
+    # the md5s of the upload parts of a file from its checksum
+    if not is_checksum_current(checksum, file_path):
+        return
+    elif not multipart:
+        return [checksum['md5']]
+    elif checksum['chunk_bytes'] == chunk_bytes:
+        return checksum['chunk_md5s']
+
+
+# Hashes a stream of data as it is written, giving the MD5 and SHA-256 of
+# the data and the MD5s of its 'chunk_bytes' chunks (the parts of an S3
+# multipart or GCS composite upload).
+class Checksum:
+    def __init__(self, chunk_bytes=0):
+        self.chunk_bytes = chunk_bytes
+
+        self.byte_count = 0
+        self.chunk_md5s = []
+        self._md5       = md5()
+        self._sha256    = sha256()
+        self._chunk_md5 = None
+        self._chunk_pos = 0
+
+    def update_chunks(self, data):
+        pos = 0
+        while pos < len(data):
+            if not self._chunk_md5:
+                self._chunk_md5 = md5()
+                self._chunk_pos = 0
+            end = pos + min(len(data) - pos, self.chunk_bytes - self._chunk_pos)
+            self._chunk_md5.update(data[pos:end])
+            self._chunk_pos += end - pos
+            pos = end
+            if self._chunk_pos == self.chunk_bytes:
+                self.chunk_md5s.append(self._chunk_md5.hexdigest())
+                self._chunk_md5 = None
+
+    def update(self, data):
+        self._md5.update(data)
+        self._sha256.update(data)
+        if self.chunk_bytes > 0:
+            self.update_chunks(data)
+        self.byte_count += len(data)
+
+    def summary(self, file_path=None):
+        chunk_md5s = list(self.chunk_md5s)
+        if self._chunk_md5:
+            chunk_md5s.append(self._chunk_md5.hexdigest())
+        summary = {
+            'size':        self.byte_count,
+            'md5':         self._md5.hexdigest(),
+            'sha256':      self._sha256.hexdigest(),
+            'chunk_bytes': self.chunk_bytes,
+            'chunk_md5s':  chunk_md5s
+        }
+        if file_path:
+            summary['mtime'] = int(os.stat(file_path).st_mtime)
+        return summary
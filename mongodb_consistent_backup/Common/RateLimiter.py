@@ -0,0 +1,106 @@
+from multiprocessing import Lock, RawArray
+from time import localtime, sleep, time
+
+from mongodb_consistent_backup.Errors import OperationError
+
+
+def parse_schedule_minute(hh_mm):
+    hours, minutes = hh_mm.strip().split(":")
+    if not 0 <= int(hours) <= 24 or not 0 <= int(minutes) < 60:
+        raise ValueError("Invalid time: %s" % hh_mm)
+    return int(hours) * 60 + int(minutes)
+
+
+def parse_schedule(schedule):
+    # parses 'HH:MM-HH:MM=MB[,...]' into (start minute, end minute, bytes per second) windows
+    windows = []
+    if schedule and schedule != "none":
+        for window in schedule.split(","):
+            try:
+                times, mb_per_second = window.split("=")
+                start, end = times.split("-")
+                windows.append((parse_schedule_minute(start), parse_schedule_minute(end), float(mb_per_second) * 1024 * 1024))
+            except ValueError:
+                raise OperationError("Invalid bandwidth schedule window '%s', must be 'HH:MM-HH:MM=MB'!" % window.strip())
+    return windows
+
+
+# A token bucket shared by all processes forked after it was created. Each
+# consumer takes its bytes from the bucket right away and sleeps off any
+# debt, so the combined rate of all consumers holds the target without
+# bursts. The rate can change by time of day with a schedule.
+class RateLimiter:
+    def __init__(self, bytes_per_sec=0, schedule=None, burst_secs=0.25):
+        self.bytes_per_sec = bytes_per_sec
+        self.schedule      = parse_schedule(schedule)
+        self.burst_secs    = burst_secs
+
+        # [tokens, last update time]
+        self._bucket = RawArray('d', 2)
+        self._lock   = Lock()
+
+    def rate(self, now=None):
+        # bytes per second at a time, 0 for unlimited
+        if len(self.schedule) > 0:
+            local  = localtime(now or time())
+            minute = local.tm_hour * 60 + local.tm_min
+            for start, end, bytes_per_sec in self.schedule:
+                if start <= minute < end or (start > end and (minute >= start or minute < end)):
+                    return bytes_per_sec
+        return self.bytes_per_sec
+
+    def is_limited(self):
+        return self.bytes_per_sec > 0 or len(self.schedule) > 0
+
+    def consume(self, byte_count):
+        rate = self.rate()
+        if rate <= 0 or byte_count <= 0:
+            return 0
+        with self._lock:
+            now    = time()
+            tokens = rate * self.burst_secs
+            if self._bucket[1] > 0:
+                tokens = min(tokens, self._bucket[0] + (now - self._bucket[1]) * rate)
+            tokens -= byte_count
+            self._bucket[0] = tokens
+            self._bucket[1] = now
+        if tokens < 0:
+            wait_secs = -tokens / rate
+            sleep(wait_secs)
+            return wait_secs
+        return 0
+
+
+# limiters by name, shared with the (pool) processes forked after registering them
+_rate_limiters = {}
+
+
+def register_rate_limiter(name, limiter):
+    if limiter.is_limited():
+        _rate_limiters[name] = limiter
+
+
+def get_rate_limit(*names):
+    # the lowest current limit of the named limiters, in bytes per second, 0 for unlimited
+    rates = []
+    for name in names:
+        if name in _rate_limiters and _rate_limiters[name].rate() > 0:
+            rates.append(_rate_limiters[name].rate())
+    if len(rates) > 0:
+        return min(rates)
+    return 0
+
+
+def is_rate_limited(*names):
+    for name in names:
+        if name in _rate_limiters:
+            return True
+    return False
+
+
+def consume_rate_limit(byte_count, *names):
+    waited = 0
+    for name in names:
+        if name in _rate_limiters:
+            waited += _rate_limiters[name].consume(byte_count)
+    return waited
@@ -0,0 +1,125 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+
+
+# copy_file_range(2) and sendfile(2) copy between files in the kernel,
+# without passing the data through user space. Python 2 has neither, so
+# they are called from libc with ctypes when available.
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+except OSError:
+    _libc = None
+
+_copy_file_range = getattr(_libc, "copy_file_range", None)
+if _copy_file_range:
+    _copy_file_range.argtypes = [ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_int, ctypes.POINTER(ctypes.c_int64),
+                                 ctypes.c_size_t, ctypes.c_uint]
+    _copy_file_range.restype  = ctypes.c_ssize_t
+
+_sendfile = getattr(_libc, "sendfile64", None)
+if _sendfile:
+    _sendfile.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+    _sendfile.restype  = ctypes.c_ssize_t
+
+_fadvise = getattr(_libc, "posix_fadvise64", None)
+if _fadvise:
+    _fadvise.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_int]
+    _fadvise.restype  = ctypes.c_int
+
+POSIX_FADV_SEQUENTIAL = 2
+POSIX_FADV_DONTNEED   = 4
+
+# errors of filesystems, kernels or file types that do not support the call, the next method is tried
+_unsupported_errnos = (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF)
+
+
+def copy_file_range(fd_in, fd_out, offset, byte_count):
+    # returns the bytes copied, the output is written at the same offset as the input
+    off_in  = ctypes.c_int64(offset)
+    off_out = ctypes.c_int64(offset)
+    copied  = _copy_file_range(fd_in, ctypes.byref(off_in), fd_out, ctypes.byref(off_out), byte_count, 0)
+    if copied < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return copied
+
+
+def sendfile(fd_in, fd_out, offset, byte_count):
+    # returns the bytes copied, the output is written at its current position
+    off_in = ctypes.c_int64(offset)
+    copied = _sendfile(fd_out, fd_in, ctypes.byref(off_in), byte_count)
+    if copied < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return copied
+
+
+def copy_fds(fd_in, fd_out, byte_count, chunk_bytes=8 * 1024 * 1024, callback=None):
+    # copies 'byte_count' bytes with the fastest method that works for the files, returns the method used.
+    # 'callback' is called with the bytes of each copied chunk
+    offset = 0
+    for method, func in (("copy_file_range", _copy_file_range and copy_file_range), ("sendfile", _sendfile and sendfile)):
+        if not func:
+            continue
+        try:
+            while offset < byte_count:
+                copied = func(fd_in, fd_out, offset, min(chunk_bytes, byte_count - offset))
+                if copied == 0:
+                    break
+                offset += copied
+                if callback:
+                    callback(copied)
+            return method
+        except OSError, e:
+            if e.errno not in _unsupported_errnos or offset > 0:
+                raise e
+    f_in  = os.fdopen(os.dup(fd_in), "rb")
+    f_out = os.fdopen(os.dup(fd_out), "wb")
+    try:
+        f_in.seek(offset)
+        f_out.seek(offset)
+        while True:
+            data = f_in.read(chunk_bytes)
+            if not data:
+                break
+            f_out.write(data)
+            if callback:
+                callback(len(data))
+    finally:
+        f_in.close()
+        f_out.close()
+    return "read/write"
+
+
+def copy_file(src, dst, chunk_bytes=8 * 1024 * 1024, callback=None, fsync=False):
+    fd_in  = os.open(src, os.O_RDONLY)
+    fd_out = None
+    try:
+        fd_out = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+        method = copy_fds(fd_in, fd_out, os.fstat(fd_in).st_size, chunk_bytes, callback)
+        if fsync:
+            os.fsync(fd_out)
+        return method
+    finally:
+        os.close(fd_in)
+        if fd_out is not None:
+            os.close(fd_out)
+
+
+def fadvise(fd, offset, byte_count, advice):
+    # a hint of how a file is read, only when libc supports it. A 'byte_count' of 0 is to the end of the file
+    if _fadvise:
+        err = _fadvise(fd, offset, byte_count, advice)
+        if err != 0:
+            raise OSError(err, os.strerror(err))
+
+
+def fsync_dir(path):
+    # makes a rename in the directory durable
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
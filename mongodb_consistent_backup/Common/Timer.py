@@ -24,6 +24,18 @@ class Timer:
         except IOError:
             pass
 
+    def record(self, timer_name, start, end, byte_count=None):
+        # stores a timer measured elsewhere, eg: in a pool process
+        try:
+            timer = {'start': start, 'end': end, 'stopped': True, 'duration': end - start}
+            if byte_count is not None:
+                timer['bytes'] = byte_count
+                if timer['duration'] > 0:
+                    timer['bytes_per_sec'] = byte_count / timer['duration']
+            self.timers[timer_name] = timer
+        except IOError:
+            pass
+
     def duration(self, timer_name):
         try:
             if timer_name in self.timers and 'duration' in self.timers[timer_name]:
@@ -1,7 +1,10 @@
+from Checksum import Checksum, checksum_md5hexes, file_checksum, file_checksum_job, get_checksum_chunk_bytes, is_checksum_current  # NOQA
 from Config import Config, parse_config_bool  # NOQA
 from DB import DB, parse_read_pref_tags  # NOQA
 from LocalCommand import LocalCommand  # NOQA
 from Lock import Lock  # NOQA
 from MongoUri import MongoUri  # NOQA
+from RateLimiter import RateLimiter, consume_rate_limit, get_rate_limit, is_rate_limited, register_rate_limiter  # NOQA
+from Syscalls import POSIX_FADV_DONTNEED, POSIX_FADV_SEQUENTIAL, copy_fds, copy_file, fadvise, fsync_dir  # NOQA
 from Timer import Timer  # NOQA
 from Util import config_to_string, is_datetime, parse_method, validate_hostname, wait_popen  # NOQA
@@ -12,6 +12,7 @@ from Errors import NotifyError, OperationError
 from Logger import Logger
 from Notify import Notify
 from Oplog import Tailer, Resolver, SimpleOplogGetter
+from Pipeline import Scheduler
 from Replication import Replset, ReplsetSharded
 from Rotate import Rotate
 from Sharding import Sharding
@@ -31,11 +32,13 @@ class MongodbConsistentBackup(object):
         self.oplogtailer              = None
         self.oploggetter              = None
         self.resolver                 = None
+        self.pipeline                 = None
         self.upload                   = None
         self.lock                     = None
         self.backup_time              = None
         self.backup_directory         = None
         self.backup_root_subdirectory = None
+        self.backup_parent            = None
         self.backup_stop              = Event()
         self.uri                      = None
         self.db                       = None
@@ -98,9 +101,37 @@ class MongodbConsistentBackup(object):
     def setup_state(self):
         self.state_root = StateRoot(self.backup_root_directory, self.config)
         self.state      = StateBackup(self.backup_directory, self.config, self.backup_time, self.uri, sys.argv)
+        self.backup_parent = self.get_backup_parent()
+        if self.backup_parent:
+            self.state.set_parent(self.backup_parent['name'], self.backup_parent['chain'])
         self.state_root.write(True)
         self.state.write()
 
+    def get_backup_parent(self):
+        # the backup an incremental backup is chained to, None to run a full backup
+        if self.config.backup.type != "incremental":
+            return None
+        parent = self.state_root.get_latest_completed(self.backup_time)
+        if not parent:
+            logging.warning("Found no completed backup to chain an incremental backup to, running a full backup")
+            return None
+        elif parent.get("method") != "mongodump":
+            logging.warning("Latest backup %s was not made by mongodump, running a full backup" % parent["name"])
+            return None
+        chain = [parent["name"]]
+        if parent.get("type") == "incremental":
+            chain = parent["chain"] + chain
+        max_chain = self.config.backup.incremental.max_chain
+        if max_chain > 0 and len(chain) > max_chain:
+            logging.info("Full backup %s has %i incremental backup(s) chained to it, running a full backup" % (chain[0], len(chain) - 1))
+            return None
+        end_ts = self.state_root.get_oplog_end_ts(parent["name"])
+        if len(end_ts) == 0 or None in end_ts.values():
+            logging.warning("Latest backup %s has no oplog end ts, running a full backup" % parent["name"])
+            return None
+        logging.info("Running incremental backup chained to %s (full backup: %s)" % (parent["name"], chain[0]))
+        return {'name': parent["name"], 'chain': chain, 'end_ts': end_ts}
+
     def setup_notifier(self):
         try:
             self.notify = Notify(
@@ -163,7 +194,7 @@ class MongodbConsistentBackup(object):
         logging.info("Starting cleanup procedure! Stopping running threads")
 
         # TODO Move submodules into self that populates as used?
-        submodules = ['replset', 'sharding', 'backup', 'oplogtailer', 'oploggetter', 'archive', 'upload']
+        submodules = ['replset', 'sharding', 'backup', 'oplogtailer', 'oploggetter', 'pipeline', 'archive', 'upload']
         for submodule_name in submodules:
             try:
                 submodule = getattr(self, submodule_name)
@@ -198,6 +229,46 @@ class MongodbConsistentBackup(object):
         self.release_lock()
         sys.exit(1)
 
+    def write_oplog_states(self, resolver_summary):
+        for shard in resolver_summary:
+            shard_dir = os.path.join(self.backup_directory, shard)
+            state = StateOplog(shard_dir, self.config, self.backup_time, shard)
+            state.load_state(resolver_summary[shard])
+            state.write()
+
+    def resolve_replset(self, replset):
+        self.resolver.set_unit(replset)
+        self.write_oplog_states(self.resolver.run())
+        self.resolver.close()
+
+    def run_pipeline(self, replsets):
+        # resolves, archives and uploads each replset backup as soon as its previous stage is done. Stages
+        # that cannot run per replset run once all replsets are ready for them
+        self.pipeline = Scheduler(self.timer, {
+            'resolver': self.config.pipeline.resolver.concurrency,
+            'archive':  self.config.pipeline.archive.concurrency,
+            'upload':   self.config.pipeline.upload.concurrency
+        })
+        ready = dict((replset, []) for replset in replsets)
+        if self.resolver:
+            for replset in replsets:
+                job = self.pipeline.add("resolver.%s" % replset, "resolver", self.resolve_replset, (replset,), on_close=self.resolver.close)
+                ready[replset] = [job]
+        for stage_name, stage in (("archive", self.archive), ("upload", self.upload)):
+            if not stage.has_task():
+                continue
+            if stage.has_unit_support():
+                for replset in replsets:
+                    job = self.pipeline.add("%s.%s" % (stage_name, replset), stage_name, stage.run, (replset,), ready[replset], stage.close)
+                    ready[replset] = [job]
+            else:
+                job = self.pipeline.add(stage_name, stage_name, stage.run, (), sum(ready.values(), []), stage.close)
+                ready = dict((replset, [job]) for replset in replsets)
+        if self.upload.has_unit_support():
+            # files of no replset, eg: the backup metadata
+            self.pipeline.add("upload", "upload", self.upload.run, (None, replsets), sum(ready.values(), []), self.upload.close)
+        self.pipeline.run()
+
     def exception(self, error_message, error):
         self.last_error_msg = error_message
         if isinstance(error, NotifyError):
@@ -279,7 +350,8 @@ class MongodbConsistentBackup(object):
                     self.timer,
                     self.backup_root_subdirectory,
                     self.backup_directory,
-                    self.replsets
+                    self.replsets,
+                    parent=self.backup_parent
                 )
                 if self.backup.is_compressed():
                     logging.info("Backup method supports compression, disabling compression in archive step")
@@ -327,7 +399,9 @@ class MongodbConsistentBackup(object):
                 self.exception("Problem stopping the balancer! Error: %s" % e, e)
 
             tailer_module = None
-            if self.config.oplog.tailer.method == "simple":
+            if self.backup_parent:
+                logging.info("Incremental backup captures the oplog since its parent backup, skipping oplog tailing")
+            elif self.config.oplog.tailer.method == "simple":
                 # init the oploggetters
                 try:
                     self.oploggetter = SimpleOplogGetter(
@@ -367,7 +441,8 @@ class MongodbConsistentBackup(object):
                     self.backup_directory,
                     self.replsets,
                     self.backup_stop,
-                    self.sharding
+                    self.sharding,
+                    self.backup_parent
                 )
                 if self.backup.is_compressed():
                     logging.info("Backup method supports compression, disabling compression in archive step and enabling oplog compression")
@@ -427,7 +502,8 @@ class MongodbConsistentBackup(object):
             if self.db:
                 self.db.close()
 
-            # resolve/merge tailed oplog into mongodump oplog.bson to a consistent point for all shards
+            # resolve/merge tailed oplog into mongodump oplog.bson to a consistent point for all shards, per
+            # shard in the pipeline when it overlaps stages
             if self.backup.task.lower() == "mongodump" and tailer_module.enabled():
                 self.resolver = Resolver(
                     self.manager,
@@ -439,29 +515,36 @@ class MongodbConsistentBackup(object):
                     self.backup_summary
                 )
                 self.resolver.compression(tailer_module.compression())
-                resolver_summary = self.resolver.run()
-                for shard in resolver_summary:
-                    shard_dir = os.path.join(self.backup_directory, shard)
-                    state = StateOplog(shard_dir, self.config, self.backup_time, shard)
-                    state.load_state(resolver_summary[shard])
-                    state.write()
-                self.resolver.close()
+                if self.config.pipeline.mode == "serial":
+                    self.write_oplog_states(self.resolver.run())
+                    self.resolver.close()
 
-        # archive backup directories
-        try:
-            self.archive.run()
-            self.archive.close()
-        except Exception, e:
-            self.archive.close()
-            self.exception("Problem performing archiving! Error: %s" % e, e)
+        if self.config.pipeline.mode == "overlap":
+            # resolve, archive and upload per replset
+            try:
+                self.run_pipeline(sorted(self.backup_summary.keys()))
+                self.archive.close()
+                self.upload.close()
+            except Exception, e:
+                self.archive.close()
+                self.upload.close()
+                self.exception("Problem running backup pipeline! Error: %s" % e, e)
+        else:
+            # archive backup directories
+            try:
+                self.archive.run()
+                self.archive.close()
+            except Exception, e:
+                self.archive.close()
+                self.exception("Problem performing archiving! Error: %s" % e, e)
 
-        # upload backup
-        try:
-            self.upload.run()
-            self.upload.close()
-        except Exception, e:
-            self.upload.close()
-            self.exception("Problem performing upload of backup! Error: %s" % e, e)
+            # upload backup
+            try:
+                self.upload.run()
+                self.upload.close()
+            except Exception, e:
+                self.upload.close()
+                self.exception("Problem performing upload of backup! Error: %s" % e, e)
 
         # stop timer
         self.stop_timer()
@@ -2,25 +2,34 @@ import os
 import logging
 
 from gzip import GzipFile
-from bson import BSON, decode_file_iter
-from bson.codec_options import CodecOptions
+from bson import BSON
+from struct import unpack
 from time import time
 
 from mongodb_consistent_backup.Errors import OperationError
+from mongodb_consistent_backup.Oplog.OplogIndex import OplogIndex
+from mongodb_consistent_backup.Oplog.OplogScanner import OplogScanner, get_change_ts, get_ts
 
 
 class Oplog:
-    def __init__(self, oplog_file, do_gzip=False, file_mode="r", flush_docs=100, flush_secs=1):
+    def __init__(self, oplog_file, do_gzip=False, file_mode="r", flush_docs=100, flush_secs=1, index_docs=0):
         self.oplog_file = oplog_file
         self.do_gzip    = do_gzip
         self.file_mode  = file_mode
         self.flush_docs = flush_docs
         self.flush_secs = flush_secs
+        self.index_docs = index_docs
 
         self._count    = 0
+        self._offset   = 0
         self._first_ts = None
         self._last_ts  = None
         self._oplog    = None
+        self._index    = None
+
+        # only new oplog files written from the start are indexed
+        if self.index_docs and self.index_docs > 0 and self.file_mode.startswith("w"):
+            self._index = OplogIndex(self.oplog_file, self.index_docs)
 
         self._last_flush_time  = time()
         self._writes_unflushed = 0
@@ -47,29 +56,85 @@ class Oplog:
         if self._oplog:
             return self._oplog.read(b)
 
+    def seek(self, offset):
+        if self._oplog:
+            return self._oplog.seek(offset)
+
+    def read_change(self):
+        # returns the next raw BSON change and its 'ts', without decoding the rest of the file
+        size_data = self._oplog.read(4)
+        if len(size_data) < 4:
+            return None, None
+        size   = unpack("<i", size_data)[0]
+        change = size_data + self._oplog.read(size - 4)
+        if len(change) < size:
+            raise OperationError("Truncated oplog change in file %s!" % self.oplog_file)
+        return change, get_change_ts(change)
+
+    def write_raw(self, data):
+        try:
+            self._oplog.write(data)
+        except Exception, e:
+            logging.fatal("Cannot write to oplog file %s! Error: %s" % (self.oplog_file, e))
+            raise OperationError(e)
+
     def load(self):
         try:
-            oplog = self.open()
-            logging.debug("Reading oplog file %s" % self.oplog_file)
-            for change in decode_file_iter(oplog, CodecOptions(unicode_decode_error_handler="ignore")):
-                if 'ts' in change:
-                    self._last_ts = change['ts']
-                if self._first_ts is None and self._last_ts is not None:
-                    self._first_ts = self._last_ts
+            index = OplogIndex(self.oplog_file, self.index_docs)
+            if index.is_current(self.do_gzip):
+                logging.debug("Reading oplog summary for %s from index %s" % (self.oplog_file, index.index_file))
+                summary = index.summary()
+                self._count    = summary['count']
+                self._first_ts = summary['first_ts']
+                self._last_ts  = summary['last_ts']
+                self._oplog.close()
+                self._oplog = None
+                return
+
+            # scan the changes by their length prefix, building an index if enabled
+            self._oplog.close()
+            self._oplog = None
+            if self.index_docs and self.index_docs > 0:
+                self._index = index
+            first_ts = None
+            last_ts  = None
+            for offset, size, ts in OplogScanner(self.oplog_file, self.do_gzip).scan():
+                if ts:
+                    if self._index and self._count % self.index_docs == 0:
+                        self._index.add(get_ts(ts), offset, self._count)
+                    last_ts = ts
+                if first_ts is None and last_ts is not None:
+                    first_ts = last_ts
                 self._count += 1
-            oplog.close()
+                self._offset = offset + size
+            self._first_ts = get_ts(first_ts)
+            self._last_ts  = get_ts(last_ts)
+            if self._index:
+                self._index.finish(self._count, self._first_ts, self._last_ts, self._offset)
+                self._index = None
         except Exception, e:
             logging.fatal("Error reading oplog file %s! Error: %s" % (self.oplog_file, e))
             raise OperationError(e)
 
     def add(self, doc, autoflush=True):
+        return self.add_batch([doc], autoflush)
+
+    def add_batch(self, docs, autoflush=True):
+        if len(docs) < 1:
+            return
         try:
-            self._oplog.write(BSON.encode(doc))
-            self._writes_unflushed += 1
-            self._count            += 1
+            encoded = [BSON.encode(doc) for doc in docs]
+            if self._index:
+                for i in range(len(docs)):
+                    if (self._count + i) % self.index_docs == 0:
+                        self._index.add(docs[i]['ts'], self._offset, self._count + i)
+                    self._offset += len(encoded[i])
+            self._oplog.write("".join(encoded))
+            self._writes_unflushed += len(docs)
+            self._count            += len(docs)
             if not self._first_ts:
-                self._first_ts = doc['ts']
-            self._last_ts = doc['ts']
+                self._first_ts = docs[0]['ts']
+            self._last_ts = docs[-1]['ts']
             if autoflush:
                 self.autoflush()
         except Exception, e:
@@ -96,6 +161,8 @@ class Oplog:
             self._oplog.flush()
             self._last_flush_time  = time()
             self._writes_unflushed = 0
+            if self._index:
+                self._index.flush()
             return os.fsync(self._oplog.fileno())
 
     def autoflush(self):
@@ -111,7 +178,12 @@ class Oplog:
     def close(self):
         if self._oplog:
             self.fsync()
-            return self._oplog.close()
+            self._oplog.close()
+            self._oplog = None
+            # the index summary is written last, marking it as current for the closed oplog
+            if self._index:
+                self._index.finish(self._count, self._first_ts, self._last_ts, self._offset)
+                self._index = None
 
     def count(self):
         return self._count
@@ -0,0 +1,166 @@
+import logging
+import os
+
+from bisect import bisect_left, bisect_right
+# Skip bson in requirements , pymongo provides
+# noinspection PyPackageRequirements
+from bson.timestamp import Timestamp
+from struct import Struct
+
+from mongodb_consistent_backup.Errors import OperationError
+
+
+# Sparse 'ts' -> byte offset index of an oplog file, stored as a sidecar
+# file next to it. Offsets are positions in the uncompressed BSON stream.
+# A footer with the count, first/last 'ts' and size of the oplog is written
+# when the oplog file is complete.
+class OplogIndex:
+    magic        = "MCBOPIDX"
+    footer_magic = "MCBOPEND"
+    header       = Struct("<8sI")
+    record       = Struct("<IIQQ")
+    footer       = Struct("<8sQIIIIQ")
+
+    def __init__(self, oplog_file, interval=1000):
+        self.oplog_file = oplog_file
+        self.index_file = "%s.idx" % self.oplog_file
+        self.interval   = interval
+
+        self._index   = None
+        self._records = None
+        self._keys    = None
+        self._summary = None
+
+    def exists(self):
+        return os.path.isfile(self.index_file)
+
+    def open(self):
+        if not self._index:
+            try:
+                logging.debug("Opening oplog index file %s" % self.index_file)
+                self._index = open(self.index_file, "w+b")
+                self._index.write(self.header.pack(self.magic, self.interval))
+            except Exception, e:
+                logging.fatal("Error opening oplog index file %s! Error: %s" % (self.index_file, e))
+                raise OperationError(e)
+        return self._index
+
+    def append(self):
+        # re-opens a complete index for appending, returns False if it cannot be extended
+        self.load()
+        if not self._summary:
+            return False
+        try:
+            logging.debug("Opening oplog index file %s for appending" % self.index_file)
+            self._index = open(self.index_file, "r+b")
+            self._index.seek(self.header.size + (len(self._records) * self.record.size))
+            self._index.truncate()
+        except Exception, e:
+            logging.fatal("Error opening oplog index file %s! Error: %s" % (self.index_file, e))
+            raise OperationError(e)
+        return True
+
+    def add(self, ts, offset, num):
+        self.open().write(self.record.pack(ts.time, ts.inc, offset, num))
+
+    def flush(self):
+        if self._index:
+            self._index.flush()
+            return os.fsync(self._index.fileno())
+
+    def finish(self, count, first_ts, last_ts, size):
+        if first_ts is None:
+            first_ts = Timestamp(0, 0)
+        if last_ts is None:
+            last_ts = Timestamp(0, 0)
+        self.open().write(self.footer.pack(self.footer_magic, count, first_ts.time, first_ts.inc, last_ts.time, last_ts.inc, size))
+        self.close()
+
+    def close(self):
+        if self._index:
+            self.flush()
+            self._index.close()
+            self._index = None
+
+    def remove(self):
+        self.close()
+        if self.exists():
+            logging.debug("Removing oplog index file: %s" % self.index_file)
+            os.remove(self.index_file)
+
+    def parse_ts(self, ts_time, ts_inc):
+        if ts_time == 0 and ts_inc == 0:
+            return None
+        return Timestamp(ts_time, ts_inc)
+
+    def load(self):
+        if self._records is None:
+            self._records = []
+            self._keys    = []
+            self._summary = None
+            if self.exists():
+                f = None
+                try:
+                    f = open(self.index_file, "rb")
+                    data = f.read()
+                    magic, self.interval = self.header.unpack_from(data)
+                    if magic != self.magic:
+                        raise OperationError("File %s is not an oplog index!" % self.index_file)
+                    end = len(data)
+                    if end >= self.header.size + self.footer.size and data[end - self.footer.size:].startswith(self.footer_magic):
+                        end -= self.footer.size
+                        magic, count, first_time, first_inc, last_time, last_inc, size = self.footer.unpack_from(data, end)
+                        self._summary = {
+                            'count':    count,
+                            'first_ts': self.parse_ts(first_time, first_inc),
+                            'last_ts':  self.parse_ts(last_time, last_inc),
+                            'size':     size
+                        }
+                    for pos in xrange(self.header.size, end - self.record.size + 1, self.record.size):
+                        ts_time, ts_inc, offset, num = self.record.unpack_from(data, pos)
+                        self._records.append((Timestamp(ts_time, ts_inc), offset, num))
+                        self._keys.append((ts_time, ts_inc))
+                except OperationError, e:
+                    raise e
+                except Exception, e:
+                    logging.fatal("Error reading oplog index file %s! Error: %s" % (self.index_file, e))
+                    raise OperationError(e)
+                finally:
+                    if f:
+                        f.close()
+        return self._records
+
+    def records(self, start_offset=0, end_offset=None):
+        records = []
+        for ts, offset, num in self.load():
+            if offset >= start_offset and (end_offset is None or offset < end_offset):
+                records.append((ts, offset, num))
+        return records
+
+    def summary(self):
+        self.load()
+        return self._summary
+
+    def is_current(self, do_gzip=False):
+        # a summary is only trusted if the oplog was not changed after the index was completed
+        if not self.exists() or not os.path.isfile(self.oplog_file) or not self.summary():
+            return False
+        if os.path.getmtime(self.index_file) < os.path.getmtime(self.oplog_file):
+            return False
+        if not do_gzip and os.path.getsize(self.oplog_file) != self._summary['size']:
+            return False
+        return True
+
+    def find(self, ts, inclusive=True):
+        # returns the (offset, num) of the last indexed change with a 'ts' before (or at) 'ts'
+        self.load()
+        if ts is None or len(self._records) == 0:
+            return 0, 0
+        if inclusive:
+            pos = bisect_right(self._keys, (ts.time, ts.inc))
+        else:
+            pos = bisect_left(self._keys, (ts.time, ts.inc))
+        if pos == 0:
+            return 0, 0
+        ts, offset, num = self._records[pos - 1]
+        return offset, num
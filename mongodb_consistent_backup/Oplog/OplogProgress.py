@@ -0,0 +1,64 @@
+# Skip bson in requirements , pymongo provides
+# noinspection PyPackageRequirements
+from bson.timestamp import Timestamp
+from ctypes import c_ulonglong
+from multiprocessing.sharedctypes import RawArray
+
+
+# Lock-free count/first_ts/last_ts record in shared memory, written by a single
+# worker process. The sequence slot is odd while a write is in progress, readers
+# retry instead of taking a lock.
+class OplogProgress:
+    SEQ        = 0
+    COUNT      = 1
+    FIRST_TIME = 2
+    FIRST_INC  = 3
+    LAST_TIME  = 4
+    LAST_INC   = 5
+    SLOTS      = 6
+
+    keys = ('count', 'first_ts', 'last_ts')
+
+    def __init__(self):
+        self._record = RawArray(c_ulonglong, self.SLOTS)
+
+    def set_ts(self, time_slot, inc_slot, ts):
+        if ts is None:
+            self._record[time_slot] = 0
+            self._record[inc_slot]  = 0
+        else:
+            self._record[time_slot] = ts.time
+            self._record[inc_slot]  = ts.inc
+
+    def get_ts(self, values, time_slot, inc_slot):
+        if values[time_slot] == 0 and values[inc_slot] == 0:
+            return None
+        return Timestamp(int(values[time_slot]), int(values[inc_slot]))
+
+    def write(self, values):
+        self._record[self.SEQ] += 1
+        try:
+            if 'count' in values:
+                self._record[self.COUNT] = values['count'] or 0
+            if 'first_ts' in values:
+                self.set_ts(self.FIRST_TIME, self.FIRST_INC, values['first_ts'])
+            if 'last_ts' in values:
+                self.set_ts(self.LAST_TIME, self.LAST_INC, values['last_ts'])
+        finally:
+            self._record[self.SEQ] += 1
+
+    def read(self):
+        while True:
+            seq = self._record[self.SEQ]
+            if seq % 2 == 0:
+                values = self._record[:]
+                if self._record[self.SEQ] == seq:
+                    break
+        return {
+            'count':    int(values[self.COUNT]),
+            'first_ts': self.get_ts(values, self.FIRST_TIME, self.FIRST_INC),
+            'last_ts':  self.get_ts(values, self.LAST_TIME, self.LAST_INC)
+        }
+
+    def get(self, key):
+        return self.read()[key]
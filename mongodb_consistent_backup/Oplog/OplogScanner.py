@@ -0,0 +1,153 @@
+import logging
+import os
+
+from gzip import GzipFile
+from mmap import mmap, ACCESS_READ
+# Skip bson in requirements , pymongo provides
+# noinspection PyPackageRequirements
+from bson.timestamp import Timestamp
+from struct import Struct, unpack_from
+
+from mongodb_consistent_backup.Errors import OperationError
+
+
+# sizes of fixed-length BSON element values, by element type
+BSON_FIXED_SIZES = {
+    "\x01": 8, "\x06": 0, "\x07": 12, "\x08": 1, "\x09": 8, "\x0A": 0, "\x10": 4,
+    "\x11": 8, "\x12": 8, "\x13": 16, "\x7F": 0, "\xFF": 0
+}
+
+
+def find_cstring_end(data, pos):
+    end = data.find("\x00", pos)
+    if end < 0:
+        raise OperationError("Unterminated BSON cstring at offset %i" % pos)
+    return end
+
+
+def bson_value_size(elem_type, data, pos):
+    if elem_type in BSON_FIXED_SIZES:
+        return BSON_FIXED_SIZES[elem_type]
+    elif elem_type in ("\x02", "\x0D", "\x0E"):
+        return 4 + unpack_from("<i", data, pos)[0]
+    elif elem_type in ("\x03", "\x04", "\x0F"):
+        return unpack_from("<i", data, pos)[0]
+    elif elem_type == "\x05":
+        return 5 + unpack_from("<i", data, pos)[0]
+    elif elem_type == "\x0B":
+        pattern_end = find_cstring_end(data, pos)
+        return find_cstring_end(data, pattern_end + 1) + 1 - pos
+    elif elem_type == "\x0C":
+        return 16 + unpack_from("<i", data, pos)[0]
+    raise OperationError("Unsupported BSON element type: %i" % ord(elem_type))
+
+
+# int32 length, first element type + name and the inc/time of a leading 'ts'
+CHANGE_HEAD      = Struct("<i4sII")
+CHANGE_HEAD_TS   = "\x11ts\x00"
+CHANGE_HEAD_SIZE = CHANGE_HEAD.size
+
+
+def get_change_ts_key(change, start=0):
+    # walks the raw BSON elements of an oplog change and only reads the (time, inc) of the 'ts' element
+    pos = start + 4
+    end = start + unpack_from("<i", change, start)[0] - 1
+    while pos < end:
+        elem_type = change[pos]
+        name_end  = find_cstring_end(change, pos + 1)
+        name      = change[pos + 1:name_end]
+        pos       = name_end + 1
+        if elem_type == "\x11" and name == "ts":
+            inc, ts_time = unpack_from("<II", change, pos)
+            return ts_time, inc
+        pos += bson_value_size(elem_type, change, pos)
+    return None
+
+
+def get_ts(ts_key):
+    if ts_key:
+        return Timestamp(ts_key[0], ts_key[1])
+
+
+def get_change_ts(change, start=0):
+    return get_ts(get_change_ts_key(change, start))
+
+
+# Walks the changes of an oplog file by their int32 length prefix, yielding
+# the (offset, size, ts key) of each change without decoding the documents.
+# The ts key is a (time, inc) tuple, or None if the change has no 'ts'. It
+# is converted to a Timestamp by get_ts() only where needed, as building a
+# Timestamp per change costs as much as the scan itself.
+# Uncompressed files are memory-mapped, gzip files are streamed in blocks.
+class OplogScanner:
+    def __init__(self, oplog_file, do_gzip=False, block_size=16 * 1024 * 1024):
+        self.oplog_file = oplog_file
+        self.do_gzip    = do_gzip
+        self.block_size = block_size
+
+    def scan(self):
+        logging.debug("Scanning oplog file %s" % self.oplog_file)
+        if self.do_gzip:
+            return self.scan_blocks()
+        return self.scan_mmap()
+
+    def scan_mmap(self):
+        f = open(self.oplog_file, "rb")
+        try:
+            file_size = os.fstat(f.fileno()).st_size
+            if file_size == 0:
+                return
+            data = mmap(f.fileno(), 0, access=ACCESS_READ)
+            try:
+                pos = 0
+                while pos + 4 <= file_size:
+                    if pos + CHANGE_HEAD_SIZE <= file_size:
+                        size, head, inc, ts_time = CHANGE_HEAD.unpack_from(data, pos)
+                    else:
+                        size, head = unpack_from("<i", data, pos)[0], None
+                    if size < 5 or pos + size > file_size:
+                        raise OperationError("Truncated oplog change at offset %i in file %s!" % (pos, self.oplog_file))
+                    if head == CHANGE_HEAD_TS:
+                        yield pos, size, (ts_time, inc)
+                    else:
+                        yield pos, size, get_change_ts_key(data, pos)
+                    pos += size
+                if pos != file_size:
+                    raise OperationError("Truncated oplog change at offset %i in file %s!" % (pos, self.oplog_file))
+            finally:
+                data.close()
+        finally:
+            f.close()
+
+    def scan_blocks(self):
+        f = GzipFile(self.oplog_file, "rb")
+        try:
+            buf    = ""
+            offset = 0
+            while True:
+                block = f.read(self.block_size)
+                if not block:
+                    break
+                buf    += block
+                buf_len = len(buf)
+                pos     = 0
+                while pos + 4 <= buf_len:
+                    if pos + CHANGE_HEAD_SIZE <= buf_len:
+                        size, head, inc, ts_time = CHANGE_HEAD.unpack_from(buf, pos)
+                    else:
+                        size, head = unpack_from("<i", buf, pos)[0], None
+                    if size < 5:
+                        raise OperationError("Invalid oplog change at offset %i in file %s!" % (offset + pos, self.oplog_file))
+                    if pos + size > buf_len:
+                        break
+                    if head == CHANGE_HEAD_TS:
+                        yield offset + pos, size, (ts_time, inc)
+                    else:
+                        yield offset + pos, size, get_change_ts_key(buf, pos)
+                    pos += size
+                buf     = buf[pos:]
+                offset += pos
+            if len(buf) > 0:
+                raise OperationError("Truncated oplog change at offset %i in file %s!" % (offset, self.oplog_file))
+        finally:
+            f.close()
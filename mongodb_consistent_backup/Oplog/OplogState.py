@@ -2,21 +2,29 @@ import json
 import logging
 
 from mongodb_consistent_backup.Errors import OperationError
+from mongodb_consistent_backup.Oplog.OplogProgress import OplogProgress
 
 
 class OplogState:
-    def __init__(self, manager, uri, oplog_file=None):
+    def __init__(self, manager, uri, oplog_file=None, shared_progress=True):
         self.uri = uri
         self.oplog_file = oplog_file
 
+        # count/first_ts/last_ts live in shared memory, the manager only holds
+        # the rarely-changed fields. Pooled (pickled) states must disable this
+        self._progress = None
+        if shared_progress:
+            self._progress = OplogProgress()
+
         try:
             self._state = manager.dict()
             if uri:
                 self._state['uri'] = self.uri.str()
             self._state['file'] = self.oplog_file
-            self._state['count'] = 0
-            self._state['first_ts'] = None
-            self._state['last_ts'] = None
+            if not self._progress:
+                self._state['count'] = 0
+                self._state['first_ts'] = None
+                self._state['last_ts'] = None
             self._state['running'] = False
             self._state['completed'] = False
         except Exception, e:
@@ -25,9 +33,18 @@ class OplogState:
     def state(self):
         return self._state
 
+    def is_progress_key(self, key):
+        if self._progress and key in self._progress.keys:
+            return True
+        return False
+
     def get(self, key=None):
         try:
+            if self.is_progress_key(key):
+                return self._progress.get(key)
             state = self._state.copy()
+            if self._progress:
+                state.update(self._progress.read())
             if key:
                 if key in state:
                     return state[key]
@@ -42,8 +59,18 @@ class OplogState:
     def set(self, key, value, merge=False):
         try:
             if merge and isinstance(value, dict):
-                for key in value:
-                    self._state[key] = value[key]
+                value = value.copy()
+                if self._progress:
+                    progress = {}
+                    for progress_key in self._progress.keys:
+                        if progress_key in value:
+                            progress[progress_key] = value.pop(progress_key)
+                    self._progress.write(progress)
+                if len(value) > 0:
+                    # single round-trip to the manager process
+                    self._state.update(value)
+            elif self.is_progress_key(key):
+                self._progress.write({key: value})
             else:
                 self._state[key] = value
         except IOError, e:
@@ -55,7 +82,7 @@ class OplogState:
         f = None
         try:
             f = open(file_name, "w+")
-            f.write(json.dumps(self._state))
+            f.write(json.dumps(self.get()))
         except Exception, e:
             logging.debug("Writing oplog state to file: '%s'! Error: %s" % (self.oplog_file, e))
             raise OperationError(e)
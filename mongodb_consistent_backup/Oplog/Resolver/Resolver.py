@@ -1,4 +1,5 @@
 import logging
+import os
 
 # Skip bson in requirements , pymongo provides
 # noinspection PyPackageRequirements
@@ -42,8 +43,12 @@ class Resolver(Task):
         self._pooled   = []
         self._results  = {}
 
+        self.unit_support = True
+
         self.threads(self.config.oplog.resolver.threads)
 
+    def start_pool(self):
+        # started by .run(), as pipeline jobs run the task in a child process
         try:
             self._pool = Pool(processes=self.threads())
         except Exception, e:
@@ -112,12 +117,15 @@ class Resolver(Task):
         try:
             logging.info("Resolving oplogs (options: threads=%s, compression=%s)" % (self.threads(), self.compression()))
             self.timer.start(self.timer_name)
+            self.start_pool()
             self.running = True
             consistent_end_ts = self.get_consistent_end_ts()
             logging.info("Consistent end timestamp for all shards is %s" % consistent_end_ts)
             for shard in self.backup_oplogs:
+                if not self.is_unit_path(os.path.join(self.backup_dir, shard)):
+                    continue
                 backup_oplog = self.backup_oplogs[shard]
-                self.resolver_state[shard] = OplogState(self.manager, None, backup_oplog['file'])
+                self.resolver_state[shard] = OplogState(self.manager, None, backup_oplog['file'], shared_progress=False)
                 uri = MongoUri(backup_oplog['uri']).get()
                 if shard in self.tailed_oplogs:
                     tailed_oplog = self.tailed_oplogs[shard]
@@ -1,17 +1,13 @@
 import logging
 import os
-# Skip bson in requirements , pymongo provides
-# noinspection PyPackageRequirements
-from bson import decode_file_iter
-from bson.codec_options import CodecOptions
 
 from mongodb_consistent_backup.Errors import Error
-from mongodb_consistent_backup.Oplog import Oplog
+from mongodb_consistent_backup.Oplog import Oplog, OplogIndex
 from mongodb_consistent_backup.Pipeline import PoolThread
 
 
 class ResolverThread(PoolThread):
-    def __init__(self, config, state, uri, tailed_oplog, mongodump_oplog, max_end_ts, compression='none'):
+    def __init__(self, config, state, uri, tailed_oplog, mongodump_oplog, max_end_ts, compression='none', copy_bytes=4 * 1024 * 1024):
         super(ResolverThread, self).__init__(self.__class__.__name__, compression)
         self.config             = config
         self.state              = state
@@ -20,33 +16,101 @@ class ResolverThread(PoolThread):
         self.mongodump_oplog    = mongodump_oplog
         self.max_end_ts         = max_end_ts
         self.compression_method = compression
+        self.copy_bytes         = copy_bytes
 
-        # Pool threads break self.config unless flattened to a normal dict:
-        self.flush_docs = self.config['oplog']['flush']['max_docs']
-        self.flush_secs = self.config['oplog']['flush']['max_secs']
-
-        self.oplogs  = {}
-        self.last_ts = None
+        self.oplogs       = {}
+        self.index        = OplogIndex(self.tailed_oplog['file'])
+        self.backup_index = None
+        self.backup_size  = 0
+        self.backup_count = 0
+        self.last_ts      = None
         self.changes = 0
         self.stopped = False
 
+    def copy(self, byte_count):
+        # copy raw changes from the tailed oplog to the backup oplog without decoding them
+        while byte_count > 0:
+            data = self.oplogs['tailed'].read(min(self.copy_bytes, byte_count))
+            if not data:
+                raise Error("Unexpected end of tailed oplog %s!" % self.tailed_oplog['file'])
+            self.oplogs['backup'].write_raw(data)
+            self.backup_size += len(data)
+            byte_count       -= len(data)
+
+    def open_backup_index(self):
+        # extend the index of the mongodump oplog, a stale index is removed instead
+        self.backup_index = OplogIndex(self.mongodump_oplog['file'])
+        if self.backup_index.is_current(self.do_gzip()) and self.backup_index.append():
+            summary = self.backup_index.summary()
+            self.backup_size  = summary['size']
+            self.backup_count = summary['count']
+        else:
+            self.backup_index.remove()
+            self.backup_index = None
+
+    def write_change(self, change, ts):
+        if self.backup_index and self.backup_count % self.backup_index.interval == 0:
+            self.backup_index.add(ts, self.backup_size, self.backup_count)
+        self.oplogs['backup'].write_raw(change)
+        self.backup_size  += len(change)
+        self.backup_count += 1
+        self.changes      += 1
+        self.last_ts       = ts
+
+    def copy_index(self, start_offset, start_num, end_offset):
+        # translate the tailed oplog index records of a bulk-copied range
+        if self.backup_index:
+            for ts, offset, num in self.index.records(start_offset, end_offset):
+                self.backup_index.add(ts, self.backup_size + (offset - start_offset), self.backup_count + (num - start_num))
+
+    def resolve(self):
+        tailed   = self.oplogs['tailed']
+        backup   = self.oplogs['backup']
+        start_ts = self.mongodump_oplog['last_ts']
+
+        # seek to the last indexed change at or before the end of the mongodump oplog
+        offset, num = self.index.find(start_ts)
+        tailed.seek(offset)
+
+        # skip changes already in the mongodump oplog
+        change, ts = tailed.read_change()
+        while change and start_ts and ts <= start_ts:
+            offset += len(change)
+            num    += 1
+            change, ts = tailed.read_change()
+        if not change or ts >= self.max_end_ts:
+            return
+
+        # bulk-copy all changes before the last indexed change below the max end ts
+        end_offset, end_num = self.index.find(self.max_end_ts, False)
+        if end_offset > offset:
+            self.copy_index(offset, num, end_offset)
+            backup.write_raw(change)
+            self.backup_size += len(change)
+            self.copy(end_offset - offset - len(change))
+            self.backup_count += end_num - num
+            self.changes      += end_num - num
+            change, ts = tailed.read_change()
+
+        # walk the remaining changes up to the max end ts
+        while change and ts < self.max_end_ts:
+            self.write_change(change, ts)
+            change, ts = tailed.read_change()
+
     def run(self):
         try:
-            self.oplogs['backup'] = Oplog(self.mongodump_oplog['file'], self.do_gzip(), 'a+', self.flush_docs, self.flush_secs)
+            self.open_backup_index()
+            self.oplogs['backup'] = Oplog(self.mongodump_oplog['file'], self.do_gzip(), 'a+')
             self.oplogs['tailed'] = Oplog(self.tailed_oplog['file'], self.do_gzip())
             logging.info("Resolving oplog for %s to max ts: %s" % (self.uri, self.max_end_ts))
             self.state.set('running', True)
             self.state.set('first_ts', self.mongodump_oplog['first_ts'])
             if not self.state.get('first_ts'):
                 self.state.set('first_ts', self.tailed_oplog['first_ts'])
-            for change in decode_file_iter(self.oplogs['tailed'], CodecOptions(unicode_decode_error_handler="ignore")):
-                self.last_ts = change['ts']
-                if not self.mongodump_oplog['last_ts'] or self.last_ts > self.mongodump_oplog['last_ts']:
-                    if self.last_ts < self.max_end_ts:
-                        self.oplogs['backup'].add(change)
-                        self.changes += 1
-                    elif self.last_ts > self.max_end_ts:
-                        break
+
+            self.resolve()
+            if not self.last_ts:
+                self.last_ts = self.mongodump_oplog['last_ts']
 
             self.state.set('count', self.mongodump_oplog['count'] + self.changes)
             self.state.set('last_ts', self.last_ts)
@@ -66,7 +130,13 @@ class ResolverThread(PoolThread):
             logging.debug("Closing oplog file handles")
             for oplog in self.oplogs:
                 self.oplogs[oplog].close()
+            if self.backup_index and self.exit_code == 0:
+                self.backup_index.finish(self.backup_count, self.state.get('first_ts'), self.last_ts, self.backup_size)
+            elif self.backup_index:
+                self.backup_index.remove()
+            self.backup_index = None
             self.stopped = True
         if 'file' in self.tailed_oplog and os.path.isfile(self.tailed_oplog['file']):
             logging.debug("Removing temporary/tailed oplog file: %s" % self.tailed_oplog['file'])
             os.remove(self.tailed_oplog['file'])
+            self.index.remove()
@@ -26,6 +26,7 @@ class SimpleOplogGetterThread(Process):
         self.dump_gzip   = dump_gzip
         self.flush_docs  = self.config.oplog.flush.max_docs
         self.flush_secs  = self.config.oplog.flush.max_secs
+        self.index_docs  = self.config.oplog.index.interval
         self.status_secs = self.config.oplog.tailer.status_interval
         self.status_last = time()
 
@@ -55,7 +56,8 @@ class SimpleOplogGetterThread(Process):
                 self.dump_gzip,
                 'w+',
                 self.flush_docs,
-                self.flush_secs
+                self.flush_secs,
+                self.index_docs
             )
         return self._oplog
 
@@ -26,6 +26,8 @@ class TailThread(Process):
         self.dump_gzip   = dump_gzip
         self.flush_docs  = self.config.oplog.flush.max_docs
         self.flush_secs  = self.config.oplog.flush.max_secs
+        self.index_docs  = self.config.oplog.index.interval
+        self.batch_docs  = self.config.oplog.tailer.batch_docs
         self.status_secs = self.config.oplog.tailer.status_interval
         self.status_last = time()
 
@@ -40,6 +42,8 @@ class TailThread(Process):
         self._oplog          = None
         self._cursor         = None
         self._cursor_addr    = None
+        self._cursor_read    = 0
+        self._batch          = []
         self.exit_code       = 0
         self._tail_retry     = 0
         self._tail_retry_max = 10
@@ -54,7 +58,8 @@ class TailThread(Process):
                 self.dump_gzip,
                 'w+',
                 self.flush_docs,
-                self.flush_secs
+                self.flush_secs,
+                self.index_docs
             )
         return self._oplog
 
@@ -87,6 +92,36 @@ class TailThread(Process):
             logging.info("Oplog tailer %s status: %i oplog changes, ts: %s" % (self.uri, state['count'], state['last_ts']))
             self.status_last = now
 
+    def cursor_buffered(self):
+        # documents already fetched by the cursor that can be read without a getMore
+        if self._cursor:
+            return self._cursor.retrieved - self._cursor_read
+        return 0
+
+    def do_write_batch(self):
+        if len(self._batch) >= self.batch_docs:
+            return True
+        elif self.cursor_buffered() < 1:
+            return True
+        return False
+
+    def write_batch(self):
+        if len(self._batch) > 0:
+            self.oplog().add_batch(self._batch)
+            self.count  += len(self._batch)
+            self._batch  = []
+
+            # update states once per batch
+            update = {
+                'count':    self.count,
+                'first_ts': self.first_ts,
+                'last_ts':  self.last_ts
+            }
+            self.state.set(None, update, True)
+
+            # print status report every N seconds
+            self.status()
+
     def connect(self):
         if not self.db:
             self.db = DB(self.uri, self.config, True, 'secondary', True)
@@ -102,29 +137,23 @@ class TailThread(Process):
             oplog = self.oplog()
             while not self.tail_stop.is_set() and not self.backup_stop.is_set():
                 try:
-                    self._cursor = self.db.get_oplog_cursor_since(self.__class__, self.last_ts)
+                    self._cursor      = self.db.get_oplog_cursor_since(self.__class__, self.last_ts)
+                    self._cursor_read = 0
                     while self.check_cursor():
                         try:
-                            # get the next oplog doc and write it
+                            # get the next oplog doc and add it to the batch
                             doc = self._cursor.next()
+                            self._cursor_read += 1
                             if self.last_ts and self.last_ts >= doc['ts']:
                                 continue
-                            oplog.add(doc)
-
-                            # update states
-                            self.count  += 1
+                            self._batch.append(doc)
                             self.last_ts = doc['ts']
                             if self.first_ts is None:
                                 self.first_ts = self.last_ts
-                            update = {
-                                'count':    self.count,
-                                'first_ts': self.first_ts,
-                                'last_ts':  self.last_ts
-                            }
-                            self.state.set(None, update, True)
-
-                            # print status report every N seconds
-                            self.status()
+
+                            # write the batch once the cursor's fetched documents are drained
+                            if self.do_write_batch():
+                                self.write_batch()
                         except NotMasterError:
                             # pymongo.errors.NotMasterError means a RECOVERING-state when connected to secondary (which should be true)
                             self.backup_stop.set()
@@ -145,6 +174,7 @@ class TailThread(Process):
                             continue
                     sleep(1)
                 finally:
+                    self.write_batch()
                     if self._cursor:
                         logging.debug("Stopping oplog cursor on %s" % self.uri)
                         self._cursor.close()
@@ -164,6 +194,7 @@ class TailThread(Process):
             self.backup_stop.set()
             raise e
         finally:
+            self.write_batch()
             oplog.flush()
             oplog.close()
             self.stopped = True
@@ -1,4 +1,7 @@
 from Oplog import Oplog  # NOQA
+from OplogIndex import OplogIndex  # NOQA
+from OplogProgress import OplogProgress  # NOQA
+from OplogScanner import OplogScanner  # NOQA
 from OplogState import OplogState  # NOQA
 from Resolver import Resolver  # NOQA
 from Tailer import Tailer  # NOQA
@@ -12,8 +15,13 @@ def config(parser):
                         help="Maximum number of oplog document writes to trigger a flush of the backup oplog file (default: 100)")
     parser.add_argument("--oplog.flush.max_secs", dest="oplog.flush.max_secs", default=1, type=int,
                         help="Number of seconds to wait to flush the backup oplog file, if 'max_docs' is not reached (default: 1)")
+    parser.add_argument("--oplog.index.interval", dest="oplog.index.interval", default=1000, type=int,
+                        help="Number of oplog documents between entries of the sparse timestamp index written next to "
+                             "captured oplog files, 0 disables the index (default: 1000)")
     parser.add_argument("--oplog.resolver.threads", dest="oplog.resolver.threads", default=0, type=int,
                         help="Number of threads to use during resolver step (default: 1-per-CPU)")
+    parser.add_argument("--oplog.tailer.batch_docs", dest="oplog.tailer.batch_docs", default=1000, type=int,
+                        help="Maximum number of tailed oplog documents to write and report as a single batch (default: 1000)")
     parser.add_argument("--oplog.tailer.enabled", dest="oplog.tailer.enabled", default='true', type=str,
                         help="Enable/disable capturing of cluster-consistent oplogs, required for cluster-wide PITR (default: true)")
     parser.add_argument("--oplog.tailer.status_interval", dest="oplog.tailer.status_interval", default=30, type=int,
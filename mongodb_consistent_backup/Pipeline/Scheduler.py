@@ -0,0 +1,130 @@
+import logging
+import sys
+
+from multiprocessing import Process
+from signal import signal, SIGINT, SIGTERM, SIG_IGN
+from time import sleep, time
+
+from mongodb_consistent_backup.Errors import Error, OperationError
+
+
+class SchedulerJob(Process):
+    def __init__(self, job_name, stage, target, args=(), depends=None, on_close=None):
+        Process.__init__(self, name=job_name)
+        self.job_name = job_name
+        self.stage    = stage
+        self.job_func = target
+        self.job_args = args
+        self.depends  = depends or []
+        self.on_close = on_close
+
+        self.start_time = None
+        self.end_time   = None
+
+    def stop(self, signum=None, frame=None):
+        if self.on_close:
+            self.on_close()
+        sys.exit(1)
+
+    def run(self):
+        signal(SIGINT, SIG_IGN)
+        signal(SIGTERM, self.stop)
+        try:
+            self.job_func(*self.job_args)
+        except Exception, e:
+            logging.error("Pipeline job %s failed! Error: %s" % (self.job_name, e))
+            sys.exit(1)
+
+
+# Runs pipeline jobs as child processes as soon as all jobs they depend on
+# have completed, with an optional limit of concurrent jobs per stage. Jobs
+# can only depend on jobs added before them, so the graph has no cycles.
+class Scheduler:
+    def __init__(self, timer=None, stage_limits=None, poll_secs=0.5):
+        self.timer        = timer
+        self.stage_limits = stage_limits or {}
+        self.poll_secs    = poll_secs
+
+        self.jobs      = {}
+        self.pending   = []
+        self.running   = []
+        self.completed = []
+        self.failed    = []
+        self.stopped   = False
+
+    def add(self, job_name, stage, target, args=(), depends=None, on_close=None):
+        if job_name in self.jobs:
+            raise Error("Pipeline job %s already exists!" % job_name)
+        for depend in depends or []:
+            if depend not in self.jobs:
+                raise Error("Pipeline job %s depends on unknown job %s!" % (job_name, depend))
+        self.jobs[job_name] = SchedulerJob(job_name, stage, target, args, depends, on_close)
+        self.pending.append(job_name)
+        return job_name
+
+    def stage_running(self, stage):
+        return len(filter(lambda job_name: self.jobs[job_name].stage == stage, self.running))
+
+    def is_ready(self, job_name):
+        job = self.jobs[job_name]
+        for depend in job.depends:
+            if depend not in self.completed:
+                return False
+        limit = self.stage_limits.get(job.stage, 0)
+        if limit > 0 and self.stage_running(job.stage) >= limit:
+            return False
+        return True
+
+    def start_ready(self):
+        for job_name in list(self.pending):
+            if self.is_ready(job_name):
+                job = self.jobs[job_name]
+                logging.info("Starting pipeline job: %s" % job_name)
+                job.start_time = time()
+                job.start()
+                self.pending.remove(job_name)
+                self.running.append(job_name)
+
+    def reap(self):
+        for job_name in list(self.running):
+            job = self.jobs[job_name]
+            if job.is_alive():
+                continue
+            job.join()
+            job.end_time = time()
+            self.running.remove(job_name)
+            if job.exitcode == 0:
+                logging.info("Completed pipeline job %s in %.2f seconds" % (job_name, job.end_time - job.start_time))
+                if self.timer:
+                    self.timer.record("Pipeline.%s" % job_name, job.start_time, job.end_time)
+                self.completed.append(job_name)
+            else:
+                logging.error("Pipeline job %s failed with exit code: %s" % (job_name, job.exitcode))
+                self.failed.append(job_name)
+
+    def run(self):
+        logging.info("Running %i pipeline job(s) (stage limits: %s)" % (len(self.pending), self.stage_limits))
+        try:
+            while len(self.pending) > 0 or len(self.running) > 0:
+                self.reap()
+                if len(self.failed) > 0:
+                    raise OperationError("Pipeline job(s) failed: %s" % ", ".join(self.failed))
+                self.start_ready()
+                if len(self.running) == 0 and len(self.pending) > 0:
+                    raise OperationError("Pipeline jobs cannot be started: %s" % ", ".join(self.pending))
+                sleep(self.poll_secs)
+        except Exception:
+            self.close()
+            raise
+        return self.completed
+
+    def close(self):
+        if self.stopped:
+            return
+        for job_name in self.running:
+            job = self.jobs[job_name]
+            if job.is_alive():
+                logging.info("Stopping pipeline job: %s" % job_name)
+                job.terminate()
+                job.join()
+        self.stopped = True
@@ -74,26 +74,36 @@ class Stage(object):
         if self.has_task() and hasattr(self._task, "thread"):
             return self._task.threads(threads)
 
-    def run(self):
+    def has_unit_support(self):
+        if self.has_task() and self._task.unit_support:
+            return True
+        return False
+
+    def run(self, unit=None, skip_units=None):
         if self.has_task():
-            data = None
+            data       = None
+            timer_name = self.stage
             try:
-                self.timers.start(self.stage)
+                if unit or skip_units:
+                    self._task.set_unit(unit, skip_units)
+                    if unit:
+                        timer_name = "%s.%s" % (self.stage, unit)
+                self.timers.start(timer_name)
                 self.running = True
-                logging.info("Running stage %s with task: %s" % (self.stage, self.task.capitalize()))
+                logging.info("Running stage %s with task: %s" % (timer_name, self.task.capitalize()))
                 data = self._task.run()
                 self.stopped = True
             except Exception, e:
-                logging.error("State %s returned error: %s" % (self.stage, e))
+                logging.error("State %s returned error: %s" % (timer_name, e))
                 raise OperationError(e)
             finally:
                 self.running = False
-                self.timers.stop(self.stage)
+                self.timers.stop(timer_name)
                 if self._task.completed:
                     logging.info("Completed running stage %s with task %s in %.2f seconds" % (
-                        self.stage,
+                        timer_name,
                         self.task.capitalize(),
-                        self.timers.duration(self.stage))
+                        self.timers.duration(timer_name))
                     )
                     self.completed = True
                 else:
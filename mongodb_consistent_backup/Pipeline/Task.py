@@ -1,4 +1,5 @@
 import logging
+import os
 
 from multiprocessing import cpu_count
 from signal import signal, SIGINT, SIGTERM, SIG_IGN
@@ -29,6 +30,11 @@ class Task(object):
         self.compression_supported = ['none']
         self.timer_name            = self.__class__.__name__
 
+        # tasks that can run for a single replset backup set 'unit_support'
+        self.unit_support = False
+        self.unit         = None
+        self.skip_units   = []
+
         signal(SIGINT, SIG_IGN)
         signal(SIGTERM, self.close)
 
@@ -58,6 +64,25 @@ class Task(object):
             self.thread_count = self.cpu_count * default_cpu_multiply
         return int(self.thread_count)
 
+    def set_unit(self, unit=None, skip_units=None):
+        # limits the task to the backup of one replset, or to files of no replset in 'skip_units'
+        if not self.unit_support:
+            raise Error("Task %s cannot run per replset!" % self.task_name)
+        self.unit       = unit
+        self.skip_units = skip_units or []
+        if self.unit:
+            self.timer_name = "%s.%s" % (self.__class__.__name__, self.unit)
+
+    def is_unit_path(self, path):
+        # replset backups are a '<replset>' subdir of the backup dir, archives are '<replset>.<ext>' files
+        name = os.path.relpath(path, self.backup_dir).split(os.sep)[0]
+        if self.unit:
+            return name == self.unit or name.startswith("%s." % self.unit)
+        for unit in self.skip_units:
+            if name == unit or name.startswith("%s." % unit):
+                return False
+        return True
+
     def run(self):
         raise Error("Must define a .run() method when using %s class!" % self.__class__.__name__)
 
@@ -1,3 +1,17 @@
 from PoolThread import PoolThread  # NOQA
+from Scheduler import Scheduler  # NOQA
 from Stage import Stage  # NOQA
 from Task import Task  # NOQA
+
+
+def config(parser):
+    parser.add_argument("--pipeline.mode", dest="pipeline.mode", default='serial', choices=['serial', 'overlap'],
+                        help="Run the resolve, archive and upload stages for all replsets at once (serial) or per replset, "
+                             "as soon as its previous stage completed (overlap) (default: serial)")
+    parser.add_argument("--pipeline.resolver.concurrency", dest="pipeline.resolver.concurrency", default=0, type=int,
+                        help="Max replsets resolved concurrently in overlap mode, 0 for no limit (default: 0)")
+    parser.add_argument("--pipeline.archive.concurrency", dest="pipeline.archive.concurrency", default=1, type=int,
+                        help="Max replsets archived concurrently in overlap mode, 0 for no limit (default: 1)")
+    parser.add_argument("--pipeline.upload.concurrency", dest="pipeline.upload.concurrency", default=1, type=int,
+                        help="Max replsets uploaded concurrently in overlap mode, 0 for no limit (default: 1)")
+    return parser
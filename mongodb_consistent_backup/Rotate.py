@@ -72,6 +72,12 @@ class Rotate(object):
                 kept_backups += 1
             else:
                 remove_backups[name] = ts
+        # backups that kept incremental backups are chained to are needed to restore them
+        for backup in [self.latest] + [self.backups[ts] for ts in self.backups if ts not in remove_backups.values()]:
+            for name in backup.get("chain", []):
+                if name in remove_backups:
+                    logging.info("Keeping backup %s, incremental backup %s is chained to it" % (name, backup["name"]))
+                    del remove_backups[name]
         if len(remove_backups) > 0:
             logging.info("Backup(s) exceeds max backup count or age, removing: %s" % sorted(remove_backups.keys()))
             for name in remove_backups:
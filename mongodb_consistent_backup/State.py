@@ -100,12 +100,108 @@ class StateOplog(StateBaseReplset):
         StateBaseReplset.__init__(self, base_dir, config, backup_time, set_name, "oplog.bson")
 
 
+class StateUpload(StateBase):
+    def __init__(self, base_dir, config, unit=None):
+        # pipeline jobs of different units write their own upload state file, with its own lock
+        filename = "upload.bson"
+        if unit:
+            filename = "upload.%s.bson" % unit
+        StateBase.__init__(self, base_dir, config, filename)
+        self.state_lock = "%s.lock" % self.state_file
+        self.lock       = Lock(self.state_lock, False)
+        self.state['uploads'] = {}
+        if os.path.isfile(self.state_file):
+            try:
+                self.state = self.merge(self.load(True), self.state)
+            except Exception, e:
+                logging.warning("Cannot load upload state file %s, ignoring it: %s" % (self.state_file, e))
+
+
+class StateChecksums(StateBase):
+    def __init__(self, base_dir, config, unit=None):
+        # pipeline jobs of different units write their own checksums file, with its own lock
+        filename = "checksums.bson"
+        if unit:
+            filename = "checksums.%s.bson" % unit
+        StateBase.__init__(self, base_dir, config, filename)
+        self.state_lock = "%s.lock" % self.state_file
+        self.lock       = Lock(self.state_lock, False)
+        self.state['files']   = {}
+        self.state['streams'] = {}
+        self.state['members'] = {}
+        if os.path.isfile(self.state_file):
+            try:
+                self.state = self.merge(self.load(True), self.state)
+            except Exception, e:
+                logging.warning("Cannot load checksums file %s, ignoring it: %s" % (self.state_file, e))
+
+    def add_file(self, rel_path, checksum):
+        self.state['files'][rel_path] = checksum
+
+    def add_stream(self, name, checksum):
+        self.state['streams'][name] = checksum
+
+    def add_members(self, name, members):
+        # the size and sha256 of each file in an archive, by archive member name
+        self.state['members'][name] = members
+
+    def load_files(self):
+        # the checksums of all files, from the checksums files of all units
+        files = {}
+        for filename in sorted(os.listdir(self.state_dir)):
+            if filename.startswith("checksums.") and filename.endswith(".bson"):
+                try:
+                    files.update(self.load(True, os.path.join(self.state_dir, filename)).get('files', {}))
+                except Exception, e:
+                    logging.warning("Cannot load checksums file %s, ignoring it: %s" % (filename, e))
+        files.update(self.state['files'])
+        return files
+
+
+class StateCollections(StateBase):
+    def __init__(self, base_dir, config, replset=None, mode=None):
+        # each replset dump writes its own collections file
+        filename = "collections.bson"
+        if replset:
+            filename = "collections.%s.bson" % replset
+        StateBase.__init__(self, base_dir, config, filename)
+        self.state['replset']     = replset
+        self.state['mode']        = mode
+        self.state['collections'] = {}
+
+    def add_collection(self, namespace, fingerprint, files, stable, reused_from=None):
+        # 'files' are relative to the backup dir, 'reused_from' is the name of the backup they were linked from
+        self.state['collections'][namespace] = {
+            'fingerprint': fingerprint,
+            'files':       files,
+            'stable':      stable,
+            'reused_from': reused_from
+        }
+
+    def load_reused_files(self):
+        # the name of the backup each reused file was linked from, by path relative to the backup dir
+        files = {}
+        for filename in sorted(os.listdir(self.state_dir)):
+            if filename.startswith("collections.") and filename.endswith(".bson"):
+                try:
+                    state = self.load(True, os.path.join(self.state_dir, filename))
+                except Exception, e:
+                    logging.warning("Cannot load collections file %s, ignoring it: %s" % (filename, e))
+                    continue
+                for collection in state.get('collections', {}).itervalues():
+                    if collection.get('reused_from'):
+                        for rel_path in collection['files']:
+                            files[rel_path] = collection['reused_from']
+        return files
+
+
 class StateBackup(StateBase):
     def __init__(self, base_dir, config, backup_time, seed_uri, argv=None):
         StateBase.__init__(self, base_dir, config)
         self.base_dir            = base_dir
         self.state['backup']     = True
         self.state['completed']  = False
+        self.state['type']       = 'full'
         self.state['name']       = backup_time
         self.state['method']     = config.backup.method
         self.state['path']       = base_dir
@@ -130,6 +226,12 @@ class StateBackup(StateBase):
     def init(self):
         logging.info("Initializing backup state directory: %s" % self.base_dir)
 
+    def set_parent(self, parent, chain):
+        # 'chain' is the full backup and the incremental backups up to the parent, restores apply them in order
+        self.state['type']   = 'incremental'
+        self.state['parent'] = parent
+        self.state['chain']  = chain
+
 
 class StateRoot(StateBase):
     def __init__(self, base_dir, config):
@@ -161,3 +263,23 @@ class StateRoot(StateBase):
                     continue
             logging.info("Found %i existing completed backups for set" % self.completed_backups)
         return self.backups
+
+    def get_latest_completed(self, before=None):
+        # the newest completed backup, older than 'before' if set
+        for name in sorted(self.backups.keys(), reverse=True):
+            if before and name >= before:
+                continue
+            if self.backups[name].get("completed"):
+                return self.backups[name]
+
+    def get_oplog_end_ts(self, name):
+        # the 'ts' of the last change of each replset in a backup, resolved to a consistent end in sharded backups
+        end_ts = {}
+        for shard, summary in self.backups[name].get("backup_oplog", {}).iteritems():
+            end_ts[shard] = summary.get("last_ts")
+            state_file = os.path.join(self.base_dir, name, shard, self.meta_name, "oplog.bson")
+            if os.path.isfile(state_file):
+                resolved = self.load(True, state_file)
+                if resolved.get("last_ts"):
+                    end_ts[shard] = resolved["last_ts"]
+        return end_ts
@@ -0,0 +1,157 @@
+import os
+import tarfile
+
+from hashlib import sha256
+from struct import Struct
+from zlib import crc32
+
+from mongodb_consistent_backup.Archive.Native.IndexedArchive import EXTENSION, FileSource, IndexedArchiveReader
+from mongodb_consistent_backup.Errors import OperationError
+
+
+# the largest document mongod writes, 16mb plus room for the fields it adds
+MAX_DOC_BYTES = 16 * 1024 * 1024 + 16 * 1024
+
+_length = Struct("<i")
+
+
+# Content-defined chunking at BSON document boundaries: mongodump and oplog
+# files are a series of documents, each starting with its int32 length. A
+# chunk ends after a document when the crc32 of the document is below its
+# length modulo the average chunk size, so each document ends a chunk with a
+# probability proportional to its size and boundaries only depend on the
+# documents themselves. Inserted or removed documents only change the chunks
+# around them and unchanged data gives the same chunks in every backup.
+# Data that is not a series of documents is cut in fixed-size blocks.
+#
+# Only the document lengths are read in python, the hashing is done by zlib
+# and hashlib, see: scripts/dedup_chunk_benchmark.py
+class Chunker:
+    def __init__(self, avg_bytes, min_bytes=None, max_bytes=None, read_bytes=8 * 1024 * 1024):
+        self.avg_bytes  = avg_bytes
+        self.min_bytes  = min_bytes or avg_bytes / 4
+        self.max_bytes  = max_bytes or avg_bytes * 4
+        self.read_bytes = max(read_bytes, self.max_bytes)
+
+        # chunks are cut after 'min_bytes', so the chance of a cut per byte after it gives the average size
+        self.divisor = max(self.avg_bytes - self.min_bytes, 1)
+
+    def walk(self, buf, start, pos):
+        # walks the documents of 'buf' from 'pos' in the chunk at 'start', returns the end of the chunk
+        # when a document ends it, or the position of the first document that is not in 'buf' or invalid
+        buf_bytes = len(buf)
+        min_end   = start + self.min_bytes
+        max_end   = start + self.max_bytes
+        divisor   = self.divisor
+        unpack    = _length.unpack_from
+        while pos + 4 <= buf_bytes:
+            doc_bytes = unpack(buf, pos)[0]
+            end       = pos + doc_bytes
+            if doc_bytes < 5 or doc_bytes > MAX_DOC_BYTES or end > buf_bytes or buf[end - 1] != "\x00":
+                return pos, False
+            elif end > max_end and pos > start:
+                return pos, True
+            elif end >= max_end or (end >= min_end and (crc32(buffer(buf, pos, doc_bytes)) & 0xffffffff) % divisor < doc_bytes):
+                return end, True
+            pos = end
+        return pos, False
+
+    def chunks(self, f, offset=0, byte_count=None):
+        # yields the (offset, length, sha256) of the chunks of 'byte_count' bytes of 'f' at 'offset'
+        f.seek(offset)
+        remaining = byte_count
+        buf       = ""
+        start     = 0
+        pos       = 0
+        eof       = False
+        documents = True
+        while True:
+            # the next document, or block, must be in the buffer with the chunk it ends
+            need = self.avg_bytes
+            if documents:
+                need = 4
+                if len(buf) - pos >= 4:
+                    need = max(min(_length.unpack_from(buf, pos)[0], MAX_DOC_BYTES), 4)
+            if not eof and len(buf) - pos < need:
+                read_bytes = max(self.read_bytes, need)
+                if remaining is not None:
+                    read_bytes = min(read_bytes, remaining)
+                data = f.read(read_bytes)
+                if not data:
+                    eof = True
+                else:
+                    if remaining is not None:
+                        remaining -= len(data)
+                    buf   = buf[start:] + data
+                    pos  -= start
+                    start = 0
+                continue
+            if pos >= len(buf):
+                break
+            cut = True
+            if documents:
+                pos, cut = self.walk(buf, start, pos)
+                if not cut and (eof or len(buf) - pos >= need):
+                    # the rest is not a series of documents
+                    documents = False
+                    cut       = pos > start
+            else:
+                pos = min(pos + self.avg_bytes, len(buf))
+            if cut:
+                yield offset, pos - start, sha256(buffer(buf, start, pos - start)).hexdigest()
+                offset += pos - start
+                start   = pos
+        if pos > start:
+            yield offset, pos - start, sha256(buffer(buf, start, pos - start)).hexdigest()
+
+
+def get_member_regions(file_path):
+    # the (offset, length) of the files in an uncompressed tar or indexed archive, the documents
+    # of each file are chunked from their first one like the files of an unarchived backup
+    regions = []
+    if file_path.endswith(".tar"):
+        try:
+            tar = tarfile.open(file_path, "r:")
+            try:
+                for member in tar.getmembers():
+                    if member.isreg() and member.size > 0:
+                        regions.append((member.offset_data, member.size))
+            finally:
+                tar.close()
+        except tarfile.TarError:
+            return []
+    elif file_path.endswith(".%s" % EXTENSION):
+        try:
+            index = IndexedArchiveReader(FileSource(file_path)).index()
+        except (OperationError, ValueError):
+            return []
+        for member in index.itervalues():
+            if member['codec'] == "none" and member['length'] > 0:
+                regions.append((member['offset'], member['length']))
+    return sorted(regions)
+
+
+def get_file_regions(file_path, region_bytes):
+    # splits a file into regions chunked in parallel: the files of archives, the data between them and
+    # fixed-size regions of other files. Region boundaries are chunk boundaries in every backup and only
+    # cost one extra chunk. Documents cannot be found from a fixed offset, .bson files are one region
+    size = os.path.getsize(file_path)
+    if size == 0:
+        return [(file_path, 0, 0)]
+    elif file_path.endswith(".bson"):
+        return [(file_path, 0, size)]
+    regions = []
+    offset  = 0
+    for member_offset, member_bytes in get_member_regions(file_path) + [(size, 0)]:
+        if member_offset > offset:
+            regions.extend([(file_path, gap, min(region_bytes, member_offset - gap)) for gap in xrange(offset, member_offset, region_bytes)])
+        if member_bytes > 0:
+            regions.append((file_path, member_offset, member_bytes))
+        offset = member_offset + member_bytes
+    return regions
+
+
+def chunk_region_job(job):
+    file_path, offset, byte_count, avg_bytes = job
+    with open(file_path, "rb") as f:
+        return file_path, offset, list(Chunker(avg_bytes).chunks(f, offset, byte_count))
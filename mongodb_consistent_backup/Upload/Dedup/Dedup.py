@@ -0,0 +1,205 @@
+import logging
+import os
+
+from copy_reg import pickle
+from multiprocessing import Pool
+from time import time
+from types import MethodType
+
+from Chunker import chunk_region_job, get_file_regions
+from DedupStore import DedupStore
+
+from mongodb_consistent_backup.Common import RateLimiter, is_checksum_current, register_rate_limiter
+from mongodb_consistent_backup.Errors import OperationError
+from mongodb_consistent_backup.Pipeline import Task
+from mongodb_consistent_backup.State import StateChecksums
+from mongodb_consistent_backup.Upload.Util import get_upload_files
+
+
+# Allows pooled .imap_unordered()s to work on Class-methods:
+def _reduce_method(m):
+    if m.im_self is None:
+        return getattr, (m.im_class, m.im_func.func_name)
+    else:
+        return getattr, (m.im_self, m.im_func.func_name)
+
+
+pickle(MethodType, _reduce_method)
+
+
+class Dedup(Task):
+    def __init__(self, manager, config, timer, base_dir, backup_dir, **kwargs):
+        super(Dedup, self).__init__(self.__class__.__name__, manager, config, timer, base_dir, backup_dir, **kwargs)
+        self.remove_uploaded = self.config.upload.remove_uploaded
+        self.retries         = self.config.upload.retries
+        self.storage         = self.config.upload.dedup.storage
+        self.avg_chunk_bytes = self.config.upload.dedup.avg_chunk_kb * 1024
+        # files are chunked in regions of this size in parallel, changing it moves chunk boundaries
+        self.region_bytes    = 256 * 1024 * 1024
+        self.meta_dir        = "mongodb-consistent-backup_META"
+        if self.config.upload.file_regex == "none":
+            self.upload_file_regex = None
+        else:
+            self.upload_file_regex = self.config.upload.file_regex
+
+        self.threads(self.config.upload.threads)
+        self._pool = None
+
+        if self.avg_chunk_bytes < 64 * 1024:
+            raise OperationError("Dedup average chunk size must be at least 64kb!")
+        self.store = DedupStore(self.config, self.storage, self.retries)
+
+        # limits all uploads to the bucket, on top of the 'upload.bandwidth' limit
+        target_mb_per_second = getattr(self.config.upload, self.storage).target_mb_per_second
+        if target_mb_per_second is not None:
+            register_rate_limiter(self.storage, RateLimiter(target_mb_per_second * 1024 * 1024))
+
+    def is_compressed_backup(self):
+        # compressed data changes entirely with any change, almost no chunk would be found again
+        if self.config.archive.method == "tar" and self.config.archive.tar.compression != "none":
+            return True
+        elif self.config.archive.method == "native" and self.config.archive.native.compression != "none":
+            return True
+        return self.config.backup.method == "mongodump" and self.config.backup.mongodump.compression != "none"
+
+    def chunk_files(self, file_paths):
+        # the chunks of each file by file path, regions of all files are chunked in parallel
+        jobs = []
+        for file_path in file_paths:
+            for region in get_file_regions(file_path, self.region_bytes):
+                jobs.append(region + (self.avg_chunk_bytes,))
+        # largest regions first, so the largest one does not start last
+        jobs.sort(key=lambda job: job[2], reverse=True)
+        regions = {}
+        for file_path, offset, chunks in self._pool.imap_unordered(chunk_region_job, jobs):
+            if file_path not in regions:
+                regions[file_path] = {}
+            regions[file_path][offset] = chunks
+        files = {}
+        for file_path in file_paths:
+            files[file_path] = []
+            for offset in sorted(regions[file_path]):
+                files[file_path].extend(regions[file_path][offset])
+        return files
+
+    def get_upload_jobs(self, files, stored_chunks, job_bytes=64 * 1024 * 1024):
+        # chunks not in the store, each once, grouped by file into jobs of up to 'job_bytes'
+        jobs    = []
+        pending = set()
+        for file_path, chunks in files.iteritems():
+            job = []
+            job_size = 0
+            for offset, length, sha in chunks:
+                if sha in stored_chunks or sha in pending:
+                    continue
+                pending.add(sha)
+                job.append((offset, length, sha))
+                job_size += length
+                if job_size >= job_bytes:
+                    jobs.append((file_path, job))
+                    job = []
+                    job_size = 0
+            if len(job) > 0:
+                jobs.append((file_path, job))
+        return jobs
+
+    def get_recipe(self, files):
+        # the backup files as lists of chunks, with the checksum of the file when the backup has it
+        checksums = StateChecksums(self.backup_dir, self.config).load_files()
+        recipe    = {
+            'version':    1,
+            'backup':     self.base_dir,
+            'created_at': int(time()),
+            'chunker':    {
+                'algorithm': 'bson-documents',
+                'avg_bytes': self.avg_chunk_bytes
+            },
+            'files':      {}
+        }
+        for file_path, chunks in files.iteritems():
+            rel_path = os.path.relpath(file_path, self.backup_dir)
+            recipe['files'][rel_path] = {
+                'size':   sum([length for offset, length, sha in chunks]),
+                'chunks': [[sha, length] for offset, length, sha in chunks]
+            }
+            if is_checksum_current(checksums.get(rel_path), file_path):
+                recipe['files'][rel_path]['sha256'] = checksums[rel_path]['sha256']
+        return recipe
+
+    def remove_files(self, file_paths):
+        for file_path in file_paths:
+            if self.meta_dir not in file_path:
+                logging.debug("Removing uploaded file: %s" % file_path)
+                os.remove(file_path)
+
+    def run(self):
+        if not os.path.isdir(self.backup_dir):
+            logging.error("The source directory: %s does not exist or is not a directory! Skipping dedup upload!" % self.backup_dir)
+            return
+        try:
+            self.running = True
+            self.timer.start(self.timer_name)
+            if self.is_compressed_backup():
+                logging.warning("Dedup upload of a compressed backup will find few unchanged chunks, disable the "
+                                "backup and archive compression to upload only changed data!")
+            file_paths = get_upload_files(self.backup_dir, self.upload_file_regex)
+            logging.info("Starting dedup upload of %i file(s) to %s bucket %s (threads=%i, average chunk=%ikb)" % (
+                len(file_paths),
+                self.storage,
+                self.store.bucket_name,
+                self.threads(),
+                self.avg_chunk_bytes / 1024
+            ))
+            self._pool = Pool(processes=self.threads())
+
+            start = time()
+            files = self.chunk_files(file_paths)
+            logging.info("Chunked %i file(s) in %.2f secs" % (len(file_paths), time() - start))
+
+            stored_chunks = self.store.list_chunks()
+            logging.info("Found %i chunk(s) in the chunk store" % len(stored_chunks))
+
+            start    = time()
+            failed   = []
+            uploaded = {}
+            for file_path, chunks, error in self._pool.imap_unordered(self.store.put_chunks_job, self.get_upload_jobs(files, stored_chunks)):
+                uploaded.update(chunks)
+                if error:
+                    failed.append(file_path)
+            self._pool.close()
+            self._pool.join()
+            if len(failed) > 0:
+                raise OperationError("Dedup upload of chunks of file(s) failed: %s" % ", ".join(sorted(set(failed))))
+
+            # the recipe is only written after all of its chunks are stored
+            recipe_key = self.store.put_recipe(self.base_dir, self.get_recipe(files))
+
+            total_bytes    = sum([length for chunks in files.itervalues() for offset, length, sha in chunks])
+            uploaded_bytes = sum(uploaded.itervalues())
+            duration       = max(time() - start, 0.001)
+            logging.info("Dedup upload complete: uploaded %i new chunk(s), %.2fmb of %.2fmb (%.1f%%) in %.2f secs (%.2f MB/sec), recipe: %s" % (
+                len(uploaded),
+                float(uploaded_bytes / 1024.00 / 1024.00),
+                float(total_bytes / 1024.00 / 1024.00),
+                uploaded_bytes * 100.0 / max(total_bytes, 1),
+                duration,
+                uploaded_bytes / duration / 1024 / 1024,
+                recipe_key
+            ))
+            if self.remove_uploaded:
+                self.remove_files(file_paths)
+            self.exit_code = 0
+            self.completed = True
+        except Exception, e:
+            logging.error("Dedup upload failed! Error: %s" % e)
+            raise OperationError(e)
+        finally:
+            self.timer.stop(self.timer_name)
+            self.stopped = True
+
+    def close(self, code=None, frame=None):
+        if self._pool and not self.stopped:
+            logging.error("Stopping dedup upload threads")
+            self._pool.terminate()
+            self._pool.join()
+            self.stopped = True
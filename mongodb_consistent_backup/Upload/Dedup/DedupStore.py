@@ -0,0 +1,107 @@
+import json
+import logging
+
+from hashlib import sha256
+from time import sleep
+
+from mongodb_consistent_backup.Common import consume_rate_limit
+from mongodb_consistent_backup.Errors import OperationError
+from mongodb_consistent_backup.Upload.Gs.GsSession import get_session_bucket as get_gs_session_bucket
+from mongodb_consistent_backup.Upload.S3.S3Session import get_session_bucket as get_s3_session_bucket
+
+
+# The chunk store in an S3 or Google Cloud Storage bucket:
+#
+#   <prefix>/chunks/<2 hex chars>/<sha256>   - the chunks of all backups
+#   <prefix>/recipes/<backup dir>.json      - the files of a backup, as a list of chunks
+#
+# Chunks are shared by the backups and never removed, 'rotate' only removes
+# local backups. Backups are restored with: scripts/restore_dedup.py
+#
+# Only the settings are kept, so the store can be passed to pool processes
+# that open their own session to the bucket.
+class DedupStore:
+    def __init__(self, config, storage, retries=5):
+        self.storage = storage
+        self.retries = retries
+
+        if self.storage == "s3":
+            options     = config.upload.s3
+            self.region = options.region
+            self.secure = options.secure
+        elif self.storage == "gs":
+            options = config.upload.gs
+        else:
+            raise OperationError("Unsupported dedup storage: %s!" % self.storage)
+        self.bucket_name = getattr(options, 'bucket_name', None)
+        self.access_key  = getattr(options, 'access_key', None)
+        self.secret_key  = getattr(options, 'secret_key', None)
+        self.prefix      = (getattr(options, 'bucket_prefix', None) or "").strip("/")
+        self.acl         = getattr(options, 'acl', None)
+
+        self.rate_limits = ("upload", self.storage)
+
+        if not self.bucket_name:
+            raise OperationError("Invalid or missing %s bucket name for dedup upload!" % self.storage)
+
+    def bucket(self):
+        if self.storage == "s3":
+            return get_s3_session_bucket(self.region, self.access_key, self.secret_key, self.bucket_name, self.secure,
+                                         self.retries)
+        return get_gs_session_bucket(self.access_key, self.secret_key, self.bucket_name, self.retries)
+
+    def key_name(self, *parts):
+        return "/".join(filter(None, [self.prefix] + list(parts)))
+
+    def chunk_key_name(self, sha):
+        return self.key_name("chunks", sha[:2], sha)
+
+    def recipe_key_name(self, backup_name):
+        return self.key_name("recipes", "%s.json" % backup_name)
+
+    def list_chunks(self):
+        # the chunk index: a single listing of all stored chunks
+        chunks = set()
+        for key in self.bucket().list(prefix=self.key_name("chunks") + "/"):
+            chunks.add(key.name.rsplit("/", 1)[-1])
+        return chunks
+
+    def put(self, key_name, data):
+        key = self.bucket().new_key(key_name)
+        for attempt in xrange(1, self.retries + 1):
+            try:
+                # boto sends the md5 of the data, the bucket rejects a corrupted upload
+                if self.acl and self.storage == "s3":
+                    key.set_contents_from_string(data, policy=self.acl)
+                else:
+                    key.set_contents_from_string(data)
+                consume_rate_limit(len(data), *self.rate_limits)
+                return
+            except Exception, e:
+                if attempt == self.retries:
+                    raise e
+                logging.warning("Uploading %s failed, retrying (attempt %i/%i). Error: %s" % (key_name, attempt, self.retries, e))
+                sleep(attempt)
+
+    def put_chunks_job(self, job):
+        # uploads chunks of one file, returns the (sha, bytes) uploaded and an error
+        file_path, chunks = job
+        uploaded = []
+        try:
+            with open(file_path, "rb") as f:
+                for offset, length, sha in chunks:
+                    f.seek(offset)
+                    data = f.read(length)
+                    if sha256(data).hexdigest() != sha:
+                        raise IOError("Chunk at offset %i of %s changed since it was hashed!" % (offset, file_path))
+                    self.put(self.chunk_key_name(sha), data)
+                    uploaded.append((sha, length))
+            return file_path, uploaded, None
+        except Exception, e:
+            logging.error("Uploading chunks of %s failed! Error: %s" % (file_path, e))
+            return file_path, uploaded, str(e)
+
+    def put_recipe(self, backup_name, recipe):
+        key_name = self.recipe_key_name(backup_name)
+        self.put(key_name, json.dumps(recipe, sort_keys=True))
+        return key_name
@@ -0,0 +1,11 @@
+from Dedup import Dedup  # NOQA
+
+
+def config(parser):
+    parser.add_argument("--upload.dedup.storage", dest="upload.dedup.storage", default='s3', choices=['gs', 's3'],
+                        help="Dedup Uploader chunk store, using the bucket settings of the 'upload.s3' or 'upload.gs' "
+                             "method. Chunks are never removed, 'rotate' only removes local backups (default: s3)")
+    parser.add_argument("--upload.dedup.avg_chunk_kb", dest="upload.dedup.avg_chunk_kb", default=1024, type=int,
+                        help="Dedup Uploader average chunk size in kilobytes, changing it stores new chunks for all "
+                             "data (default: 1024)")
+    return parser
@@ -1,45 +1,63 @@
 import logging
 import os
 
-from copy_reg import pickle
-from multiprocessing import Pool
-from types import MethodType
+from GsUploadPool import GsUploadPool
 
+from mongodb_consistent_backup.Common import RateLimiter, register_rate_limiter
 from mongodb_consistent_backup.Errors import OperationError
 from mongodb_consistent_backup.Pipeline import Task
-from mongodb_consistent_backup.Upload.Util import get_upload_files
-
-from GsUploadThread import GsUploadThread
-
-
-# Allows pooled .apply_async()s to work on Class-methods:
-def _reduce_method(m):
-    if m.im_self is None:
-        return getattr, (m.im_class, m.im_func.func_name)
-    else:
-        return getattr, (m.im_self, m.im_func.func_name)
-
-
-pickle(MethodType, _reduce_method)
+from mongodb_consistent_backup.State import StateUpload
+from mongodb_consistent_backup.Upload.Util import copy_reused_files, get_checksums, get_upload_files
 
 
 class Gs(Task):
     def __init__(self, manager, config, timer, base_dir, backup_dir, **kwargs):
         super(Gs, self).__init__(self.__class__.__name__, manager, config, timer, base_dir, backup_dir, **kwargs)
-        self.backup_location = self.config.backup.location
         self.remove_uploaded = self.config.upload.remove_uploaded
         self.retries         = self.config.upload.retries
         self.project_id      = self.config.upload.gs.project_id
         self.access_key      = self.config.upload.gs.access_key
         self.secret_key      = self.config.upload.gs.secret_key
-        self.bucket          = self.config.upload.gs.bucket
+        self.bucket_name     = self.config.upload.gs.bucket_name
+        self.bucket_prefix   = getattr(self.config.upload.gs, 'bucket_prefix', None)
+        self.chunk_size_mb   = self.config.upload.gs.chunk_size_mb
+        self.chunk_size      = self.chunk_size_mb * 1024 * 1024
+        if self.config.upload.file_regex == "none":
+            self.upload_file_regex = None
+        else:
+            self.upload_file_regex = self.config.upload.file_regex
+
+        # limits all GS uploads, on top of the 'upload.bandwidth' limit
+        if self.config.upload.gs.target_mb_per_second is not None:
+            register_rate_limiter("gs", RateLimiter(self.config.upload.gs.target_mb_per_second * 1024 * 1024))
 
         self.threads(self.config.upload.threads)
-        self._pool = Pool(processes=self.threads())
+        self.unit_support = True
+        self._pool        = None
 
-    def close(self):
-        if self.running and not self.stopped:
-            self._pool.terminate()
+        if not self.bucket_name:
+            raise OperationError("Invalid or missing Google Cloud Storage bucket name detected!")
+
+    def get_object_name(self, file_path=None, base_dir=None):
+        # object names have no leading '/', the name of the backup directory is the listing prefix
+        names = [base_dir or self.base_dir]
+        if self.bucket_prefix and self.bucket_prefix.strip("/"):
+            names.insert(0, self.bucket_prefix.strip("/"))
+        if file_path:
+            names.append(os.path.relpath(file_path, self.backup_dir))
+        return "/".join(names)
+
+    def get_previous_object_name(self, backup_name, rel_path):
+        # the object of a file of an earlier backup of the same name
+        base_dir = os.path.join(os.path.dirname(self.base_dir), backup_name)
+        return self.get_object_name(os.path.join(self.backup_dir, rel_path), base_dir)
+
+    def copy_file(self, file_path, src_object_name):
+        return self._pool.copy(file_path, self.get_object_name(file_path), src_object_name)
+
+    def close(self, code=None, frame=None):
+        if self._pool:
+            self._pool.close()
             self.stopped = True
 
     def run(self):
@@ -49,22 +67,39 @@ class Gs(Task):
         try:
             self.running = True
             self.timer.start(self.timer_name)
-            logging.info("Uploading %s to Google Cloud Storage (bucket=%s, threads=%i)" % (self.base_dir, self.bucket, self.threads()))
-            for file_path in get_upload_files():
-                gs_path = os.path.relpath(file_path, self.backup_location)
-                self._pool.apply_async(GsUploadThread(
-                    self.backup_dir,
-                    file_path,
-                    gs_path,
-                    self.bucket,
-                    self.project_id,
-                    self.access_key,
-                    self.secret_key,
-                    self.remove_uploaded,
-                    self.retries
-                ).run)
-            self._pool.close()
-            self._pool.join()
+            # the resumable upload sessions and composed objects are tracked in the backup META directory
+            upload_state = StateUpload(self.backup_dir, self.config, self.unit)
+            self._pool   = GsUploadPool(
+                self.bucket_name,
+                self.access_key,
+                self.secret_key,
+                self.threads(),
+                self.remove_uploaded,
+                self.chunk_size,
+                self.retries,
+                upload_state
+            )
+            logging.info("Uploading %s to Google Cloud Storage (bucket=%s, threads=%i, %imb components)" % (
+                self.base_dir,
+                self.bucket_name,
+                self.threads(),
+                self.chunk_size_mb
+            ))
+            self._pool.list_objects("%s/" % self.get_object_name())
+            file_paths = []
+            for file_path in get_upload_files(self.backup_dir, self.upload_file_regex):
+                if not self.is_unit_path(file_path):
+                    continue
+                elif file_path == upload_state.state_file or file_path.startswith(self._pool.tracker_dir + os.sep):
+                    continue
+                file_paths.append(file_path)
+            # files of collections reused from the previous backup are copied from its objects
+            file_paths = copy_reused_files(self.backup_dir, self.config, file_paths, self.copy_file,
+                                           self.get_previous_object_name, self.threads())
+            checksums = get_checksums(self.backup_dir, self.config, file_paths, self.unit, self.threads())
+            for file_path in file_paths:
+                self._pool.upload(file_path, self.get_object_name(file_path), checksums.get(os.path.relpath(file_path, self.backup_dir)))
+            self._pool.wait()
             self.exit_code = 0
             self.completed = True
         except Exception, e:
@@ -72,4 +107,6 @@ class Gs(Task):
             raise OperationError(e)
         finally:
             self.timer.stop(self.timer_name)
+            if self._pool:
+                self._pool.close()
             self.stopped = True
@@ -0,0 +1,54 @@
+import os
+
+import boto
+
+from boto.gs.connection import GSConnection
+
+from mongodb_consistent_backup.Errors import OperationError
+
+
+# buckets of the current process, keeping one keep-alive connection per upload pool process
+_session_buckets = {}
+
+
+def get_session_bucket(access_key, secret_key, bucket_name, num_retries=5):
+    # the pid is part of the key, as forked processes must not share the connection of their parent
+    cache_key = (os.getpid(), access_key, secret_key, bucket_name)
+    if cache_key not in _session_buckets:
+        _session_buckets[cache_key] = GsSession(access_key, secret_key, num_retries).get_bucket(bucket_name)
+    return _session_buckets[cache_key]
+
+
+def reset_session_bucket(access_key, secret_key, bucket_name):
+    cache_key = (os.getpid(), access_key, secret_key, bucket_name)
+    if cache_key in _session_buckets:
+        del _session_buckets[cache_key]
+
+
+class GsSession:
+    def __init__(self, access_key, secret_key, num_retries=5):
+        self.access_key  = access_key
+        self.secret_key  = secret_key
+        self.num_retries = num_retries
+
+        if not boto.config.has_section('Boto'):
+            boto.config.add_section('Boto')
+        boto.config.setbool('Boto', 'https_validate_certificates', True)
+        boto.config.set('Boto', 'num_retries', str(self.num_retries))
+
+        self._conn = None
+
+    def connect(self):
+        if not self._conn:
+            try:
+                self._conn = GSConnection(self.access_key, self.secret_key)
+            except Exception, e:
+                raise OperationError("Unable to connect to Google Cloud Storage! Error: %s" % e)
+        return self._conn
+
+    def get_bucket(self, bucket_name):
+        try:
+            # the bucket is validated by the first listing or upload
+            return self.connect().get_bucket(bucket_name, validate=False)
+        except Exception, e:
+            raise OperationError("Unable to get Google Cloud Storage bucket %s! Error: %s" % (bucket_name, e))
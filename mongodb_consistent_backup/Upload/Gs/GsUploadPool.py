@@ -0,0 +1,303 @@
+import logging
+import os
+
+from boto.exception import GSResponseError
+from copy_reg import pickle
+from hashlib import md5
+from multiprocessing import Pool
+from Queue import Empty, Queue
+from time import time
+from types import MethodType
+
+from GsSession import get_session_bucket
+from GsUploadThread import GsUploadThread
+
+from mongodb_consistent_backup.Common import checksum_md5hexes
+from mongodb_consistent_backup.Errors import OperationError
+from mongodb_consistent_backup.Upload.S3.S3ETag import S3ETag, get_chunks
+
+
+# Allows pooled .apply_async()s to work on Class-methods:
+def _reduce_method(m):
+    if m.im_self is None:
+        return getattr, (m.im_class, m.im_func.func_name)
+    else:
+        return getattr, (m.im_self, m.im_func.func_name)
+
+
+pickle(MethodType, _reduce_method)
+
+
+# Uploads files to Google Cloud Storage with a pool of processes. Files
+# larger than one chunk are uploaded as parallel component objects that are
+# composed into the final object by GCS, without downloading them again.
+# Every upload uses a GCS resumable session kept in a tracker file, so an
+# interrupted upload continues from the bytes GCS already has. Objects and
+# components that were already uploaded are found in a single listing of
+# the upload prefix.
+class GsUploadPool:
+    def __init__(self, bucket_name, access_key, secret_key, threads=4, remove_uploaded=False, chunk_bytes=50 * 1024 * 1024,
+                 retries=5, upload_state=None):
+        self.bucket_name     = bucket_name
+        self.access_key      = access_key
+        self.secret_key      = secret_key
+        self.threads         = threads
+        self.remove_uploaded = remove_uploaded
+        self.chunk_bytes     = chunk_bytes
+        self.retries         = retries
+        self.upload_state    = upload_state
+
+        # GCS composes at most 32 objects per request
+        self.compose_max_components = 32
+        self.tracker_dir = None
+        if self.upload_state:
+            self.tracker_dir = os.path.join(self.upload_state.state_dir, "gs-trackers")
+
+        self._closed    = False
+        self._listed    = {}
+        self._uploads   = {}
+        self._pool      = Pool(processes=self.threads)
+        self._etag      = S3ETag()
+        self._completed = 0
+
+        # results of uploads in the pool are put in the completion queue by the pool callback
+        self._completions = Queue()
+        self._pending     = {}
+
+        self.bucket = get_session_bucket(self.access_key, self.secret_key, self.bucket_name, self.retries)
+
+    def close(self, code=None, frame=None):
+        if self._closed:
+            return
+        if self._pool:
+            logging.info("Stopping Google Cloud Storage upload pool")
+            self._pool.terminate()
+            self._pool.join()
+        self._etag.close()
+        if self.upload_state:
+            self.upload_state.write()
+        self._closed = True
+
+    def list_objects(self, prefix):
+        # sizes and etags of all objects under the prefix, the etag of non-composite objects is their md5
+        logging.info("Listing existing objects in gs://%s/%s" % (self.bucket_name, prefix))
+        try:
+            for key in self.bucket.list(prefix=prefix):
+                self._listed[key.name] = (key.size, key.etag.strip('"'))
+        except Exception, e:
+            raise OperationError("Cannot list Google Cloud Storage bucket %s! Error: %s" % (self.bucket_name, e))
+        logging.debug("Found %i existing object(s) in gs://%s/%s" % (len(self._listed), self.bucket_name, prefix))
+
+    def is_listed(self, object_name, byte_count, etag):
+        return self._listed.get(object_name) == (byte_count, etag)
+
+    def get_manifest(self, object_name):
+        if self.upload_state:
+            return self.upload_state.get('uploads').get(object_name)
+
+    def get_tracker_file(self, object_name, component=None):
+        if self.tracker_dir:
+            if not os.path.isdir(self.tracker_dir):
+                os.makedirs(self.tracker_dir)
+            return os.path.join(self.tracker_dir, "%s.%s.tracker" % (md5(object_name).hexdigest(), component))
+
+    def get_component_name(self, object_name, component):
+        return "%s.component-%04i" % (object_name, component)
+
+    def get_file_size(self, file_name):
+        if not os.path.isfile(file_name):
+            logging.error("Upload file does not exist (or is not a file): %s" % file_name)
+            raise OperationError("Upload file does not exist (or is not a file)!")
+        return os.stat(file_name).st_size
+
+    def remove_file(self, file_name):
+        if os.path.isfile(file_name):
+            logging.debug("Removing uploaded file: %s" % file_name)
+            os.remove(file_name)
+
+    def copy(self, file_name, object_name, src_object_name):
+        # server-side copy of an object with the same data as the file, False when there is no such object of the same size
+        file_size = self.get_file_size(file_name)
+        try:
+            src_key = self.bucket.get_key(src_object_name)
+            if not src_key or src_key.size != file_size:
+                logging.debug("No object gs://%s/%s of %i bytes to copy, uploading %s" % (self.bucket_name, src_object_name, file_size, file_name))
+                return False
+            logging.info("Copying gs://%s/%s to gs://%s/%s" % (self.bucket_name, src_object_name, self.bucket_name, object_name))
+            self.bucket.copy_key(object_name, self.bucket_name, src_object_name)
+        except GSResponseError, e:
+            logging.warning("Cannot copy gs://%s/%s, uploading %s: %s" % (self.bucket_name, src_object_name, file_name, e))
+            return False
+        if self.remove_uploaded:
+            self.remove_file(file_name)
+        return True
+
+    def is_uploaded(self, object_name, file_size, md5hexes):
+        if len(md5hexes) == 1:
+            return self.is_listed(object_name, file_size, md5hexes[0])
+        # composite objects have no md5 etag, the etag after composing is kept with the component md5s
+        manifest = self.get_manifest(object_name)
+        if manifest and manifest['md5hexes'] == md5hexes:
+            return self.is_listed(object_name, file_size, manifest['etag'])
+        return False
+
+    def start(self, file_name, object_name, offset, byte_count, md5hex, component=None):
+        logging.debug("Adding to pool: gs://%s/%s (component: %s)" % (self.bucket_name, object_name, component))
+        self._pending[(file_name, component)] = self._pool.apply_async(
+            GsUploadThread(
+                self.bucket_name,
+                self.access_key,
+                self.secret_key,
+                file_name,
+                object_name,
+                offset,
+                byte_count,
+                md5hex,
+                component,
+                self.get_tracker_file(object_name, component),
+                self.retries
+            ).run,
+            callback=self._completions.put
+        )
+
+    def upload(self, file_name, object_name, checksum=None):
+        # the md5s are taken from the checksum of the file if it has the md5s of the same chunks, each
+        # upload is verified against them, so composite objects are made of verified components only
+        file_size = self.get_file_size(file_name)
+        chunks    = [(0, file_size)]
+        if file_size > self.chunk_bytes:
+            chunks = get_chunks(file_size, self.chunk_bytes)
+        md5hexes = checksum_md5hexes(checksum, file_name, self.chunk_bytes, len(chunks) > 1)
+        if not md5hexes:
+            md5hexes = self._etag.md5hexes(file_name, chunks)
+        if self.is_uploaded(object_name, file_size, md5hexes):
+            logging.warning("Object gs://%s/%s already exists with the same checksum, skipping" % (self.bucket_name, object_name))
+            return
+        upload = {
+            "object":     object_name,
+            "complete":   False,
+            "md5hexes":   md5hexes,
+            "components": {}
+        }
+        self._uploads[file_name] = upload
+        if len(chunks) == 1:
+            self.start(file_name, object_name, 0, file_size, md5hexes[0])
+            return
+        # components of an interrupted upload are kept until the object is composed
+        for component, (offset, byte_count) in enumerate(chunks):
+            component_name = self.get_component_name(object_name, component)
+            upload["components"][component] = self.is_listed(component_name, byte_count, md5hexes[component])
+        for component, (offset, byte_count) in enumerate(chunks):
+            if not upload["components"][component]:
+                self.check_uploads()
+                self.start(file_name, self.get_component_name(object_name, component), offset, byte_count, md5hexes[component], component)
+        logging.info("Uploading gs://%s/%s as %i components (%i already uploaded)" % (
+            self.bucket_name,
+            object_name,
+            len(chunks),
+            len(filter(None, upload["components"].values()))
+        ))
+        self.compose_upload(file_name)
+
+    def compose(self, object_name, component_names):
+        # composes in rounds of up to 32 objects, the intermediate objects are returned for removal
+        temp_names = []
+        depth      = 0
+        while len(component_names) > self.compose_max_components:
+            depth += 1
+            round_names = []
+            for i in range(0, len(component_names), self.compose_max_components):
+                round_name = "%s.compose-%i-%04i" % (object_name, depth, i / self.compose_max_components)
+                self.bucket.new_key(round_name).compose(
+                    [self.bucket.new_key(name) for name in component_names[i:i + self.compose_max_components]]
+                )
+                round_names.append(round_name)
+            temp_names.extend(round_names)
+            component_names = round_names
+        self.bucket.new_key(object_name).compose([self.bucket.new_key(name) for name in component_names])
+        return temp_names
+
+    def compose_upload(self, file_name):
+        upload = self._uploads[file_name]
+        if upload["complete"] or not all(upload["components"].values()):
+            return
+        object_name     = upload["object"]
+        component_names = [self.get_component_name(object_name, component) for component in sorted(upload["components"])]
+        logging.debug("Composing gs://%s/%s from %i components" % (self.bucket_name, object_name, len(component_names)))
+        try:
+            temp_names = self.compose(object_name, component_names)
+            etag       = self.bucket.get_key(object_name).etag.strip('"')
+            for name in component_names + temp_names:
+                self.bucket.delete_key(name)
+        except Exception, e:
+            raise OperationError("Cannot compose Google Cloud Storage object gs://%s/%s! Error: %s" % (self.bucket_name, object_name, e))
+        if self.upload_state:
+            self.upload_state.get('uploads')[object_name] = {'md5hexes': upload["md5hexes"], 'etag': etag}
+            self.upload_state.write()
+        self.success(file_name)
+
+    def success(self, file_name):
+        upload = self._uploads[file_name]
+        upload["complete"] = True
+        if self.remove_uploaded:
+            self.remove_file(file_name)
+        logging.info("Uploaded Google Cloud Storage object successfully: gs://%s/%s" % (self.bucket_name, upload["object"]))
+
+    def complete(self, output_tuple):
+        file_name, component, object_name, md5hex, error = output_tuple
+        del self._pending[(file_name, component)]
+        if error:
+            logging.error("Got error from upload pool thread for gs://%s/%s: %s" % (self.bucket_name, object_name, error))
+            raise OperationError(error)
+        self._completed += 1
+        if component is None:
+            self.success(file_name)
+        else:
+            self._uploads[file_name]["components"][component] = True
+            self.compose_upload(file_name)
+
+    def in_flight(self):
+        return len(self._pending)
+
+    def completed(self):
+        return self._completed
+
+    def incomplete(self):
+        return filter(lambda file_name: not self._uploads[file_name]["complete"], self._uploads)
+
+    def check_failed(self):
+        # uploads return their errors, this only catches pool processes failing outside of an upload
+        for upload in self._pending:
+            result = self._pending[upload]
+            if result.ready() and not result.successful():
+                try:
+                    result.get()
+                except Exception, e:
+                    logging.error("Got error from upload pool thread: %s" % e)
+                    raise OperationError(e)
+
+    def check_uploads(self):
+        while True:
+            try:
+                self.complete(self._completions.get_nowait())
+            except Empty:
+                break
+
+    def wait(self, poll_secs=1, status_secs=30):
+        logging.debug("Waiting for upload pool to complete %d uploads" % len(self.incomplete()))
+        status_time = time()
+        while len(self._pending) > 0:
+            try:
+                self.complete(self._completions.get(True, poll_secs))
+            except Empty:
+                self.check_failed()
+            if time() - status_time >= status_secs:
+                logging.info("Google Cloud Storage upload progress: %i upload(s)/component(s) completed, %i in flight, %i file(s) remaining" % (
+                    self.completed(),
+                    self.in_flight(),
+                    len(self.incomplete())
+                ))
+                status_time = time()
+        incomplete = self.incomplete()
+        if len(incomplete) > 0:
+            raise OperationError("Upload of file(s) did not complete: %s" % ", ".join(incomplete))
@@ -1,95 +1,119 @@
-import boto
 import logging
 import os
 
-from mongodb_consistent_backup.Common.Util import file_md5hash
-from mongodb_consistent_backup.Errors import OperationError
+from binascii import hexlify
+from boto.gs.resumable_upload_handler import ResumableUploadHandler
+from time import sleep
+
+from GsSession import get_session_bucket, reset_session_bucket
+
+from mongodb_consistent_backup.Common import consume_rate_limit, is_rate_limited
+from mongodb_consistent_backup.Upload.S3.S3ETag import get_content_md5
+
+
+# A read-only file object of a byte range of a file, GCS resumable uploads
+# take the size of the upload from seeking to the end of the file object.
+class GsFileRange:
+    def __init__(self, file_path, offset, byte_count):
+        self.file_path  = file_path
+        self.offset     = offset
+        self.byte_count = byte_count
+
+        self._file = open(file_path, "rb")
+        self._pos  = 0
+        self._file.seek(self.offset)
+
+    def read(self, size=-1):
+        remaining = self.byte_count - self._pos
+        if size < 0 or size > remaining:
+            size = remaining
+        data = self._file.read(size)
+        self._pos += len(data)
+        return data
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            pos += self._pos
+        elif whence == os.SEEK_END:
+            pos += self.byte_count
+        self._pos = max(0, min(pos, self.byte_count))
+        self._file.seek(self.offset + self._pos)
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        self._file.close()
 
 
 class GsUploadThread:
-    def __init__(self, backup_dir, file_path, gs_path, bucket, project_id, access_key, secret_key, remove_uploaded=False, retries=5):
-        self.backup_dir      = backup_dir
-        self.file_path       = file_path
-        self.gs_path         = gs_path
-        self.bucket          = bucket
-        self.project_id      = project_id
-        self.access_key      = access_key
-        self.secret_key      = secret_key
-        self.remove_uploaded = remove_uploaded
-        self.retries         = retries
-
-        self.path          = "%s/%s" % (self.bucket, self.gs_path)
-        self.meta_data_dir = "mongodb_consistent_backup-META"
-        self._metadata     = None
-
-    def configure(self):
-        if not boto.config.has_section("Credentials"):
-            boto.config.add_section("Credentials")
-        boto.config.set("Credentials", "gs_access_key_id", self.access_key)
-        boto.config.set("Credentials", "gs_secret_access_key", self.secret_key)
-        if not boto.config.has_section("Boto"):
-            boto.config.add_section("Boto")
-        boto.config.setbool('Boto', 'https_validate_certificates', True)
-
-    def get_uri(self):
-        return boto.storage_uri(self.path, 'gs')
-
-    def gs_exists(self):
-        try:
-            self.metadata()
-            return True
-        except boto.exception.InvalidUriError:
-            return False
-
-    def metadata(self):
-        logging.debug("Getting metadata for path: %s" % self.path)
-        if not self._metadata:
-            self._metadata = self.get_uri().get_key()
-        return self._metadata
-
-    def gs_md5hash(self):
-        key = self.metadata()
-        if hasattr(key, 'etag'):
-            return key.etag.strip('"\'')
-
-    def success(self):
-        if self.remove_uploaded and not self.file_path.startswith(os.path.join(self.backup_dir, self.meta_data_dir)):
-            logging.debug("Removing successfully uploaded file: %s" % self.file_path)
-            os.remove(self.file_path)
+    def __init__(self, bucket_name, access_key, secret_key, file_path, object_name, offset, byte_count, md5hex,
+                 component=None, tracker_file=None, retries=5, retry_sleep_secs=1):
+        self.bucket_name      = bucket_name
+        self.access_key       = access_key
+        self.secret_key       = secret_key
+        self.file_path        = file_path
+        self.object_name      = object_name
+        self.offset           = offset
+        self.byte_count       = byte_count
+        self.md5hex           = md5hex
+        self.component        = component
+        self.tracker_file     = tracker_file
+        self.retries          = retries
+        self.retry_sleep_secs = retry_sleep_secs
 
-    def run(self):
-        f = None
+        self.path        = "gs://%s/%s" % (self.bucket_name, self.object_name)
+        self.rate_limits = ("upload", "gs")
+        self._last_bytes = 0
+
+    def status(self, bytes_uploaded, bytes_total):
+        if bytes_uploaded > self._last_bytes:
+            consume_rate_limit(bytes_uploaded - self._last_bytes, *self.rate_limits)
+        self._last_bytes = bytes_uploaded
+
+    def upload(self):
+        f = GsFileRange(self.file_path, self.offset, self.byte_count)
         try:
-            self.configure()
-            if self.gs_exists():
-                gs_md5hash = self.gs_md5hash()
-                if gs_md5hash and file_md5hash(self.file_path) == gs_md5hash:
-                    logging.debug("Path %s already exists with the same checksum (%s), skipping" % (self.path, self.gs_md5hash()))
-                    return
-                logging.debug("Path %s checksum and local checksum differ, re-uploading" % self.path)
+            # the resumable session is kept in the tracker file until the upload completes, a later
+            # run (or retry) continues the session from the bytes the server already has
+            key     = get_session_bucket(self.access_key, self.secret_key, self.bucket_name).new_key(self.object_name)
+            handler = ResumableUploadHandler(tracker_file_name=self.tracker_file, num_retries=self.retries)
+            if is_rate_limited(*self.rate_limits):
+                # rate limits are applied in the callback, requested every 0.5MB
+                self._last_bytes = 0
+                key.set_contents_from_file(f, res_upload_handler=handler, md5=get_content_md5(self.md5hex), cb=self.status,
+                                           num_cb=max(10, self.byte_count / 524288))
             else:
-                logging.debug("Path %s does not exist, uploading" % self.path)
+                key.set_contents_from_file(f, res_upload_handler=handler, md5=get_content_md5(self.md5hex))
+            # the handler checked the upload against the md5 of the data it sent, which must match the hashed file
+            if self.md5hex and hexlify(key.local_hashes.get('md5', '')) != self.md5hex:
+                raise IOError("File %s changed during the upload to %s" % (self.file_path, self.path))
+        finally:
+            f.close()
 
+    def run(self):
+        tries     = 0
+        exception = None
+        while tries < self.retries:
+            tries += 1
             try:
-                f     = open(self.file_path, 'r')
-                uri   = self.get_uri()
-                retry = 0
-                error = None
-                while retry < self.retries:
-                    try:
-                        logging.info("Uploading %s to Google Cloud Storage (attempt %i/%i)" % (self.path, retry, self.retries))
-                        uri.new_key().set_contents_from_file(f)
-                    except Exception, e:
-                        logging.error("Received error for Google Cloud Storage upload of %s: %s" % (self.path, e))
-                        error  = e
-                        retry += 1
-                        continue
-                if retry >= self.retries and error:
-                    raise error
-            finally:
-                if f:
-                    f.close()
-            self.success()
-        except Exception, e:
-            logging.error("Uploading to Google Cloud Storage failed! Error: %s" % e)
-            raise OperationError(e)
+                logging.info("Uploading %s to Google Cloud Storage: %s (component: %s, size: %.2fmb, attempt %i/%i)" % (
+                    self.file_path,
+                    self.path,
+                    self.component,
+                    float(self.byte_count / 1024.00 / 1024.00),
+                    tries,
+                    self.retries
+                ))
+                self.upload()
+                exception = None
+                break
+            except Exception, e:
+                logging.error("Received error for Google Cloud Storage upload of %s: %s" % (self.path, e))
+                reset_session_bucket(self.access_key, self.secret_key, self.bucket_name)
+                exception = e
+                if tries < self.retries:
+                    sleep(self.retry_sleep_secs)
+        if exception:
+            return self.file_path, self.component, self.object_name, None, str(exception)
+        return self.file_path, self.component, self.object_name, self.md5hex, None
@@ -12,4 +12,8 @@ def config(parser):
                         help="Google Cloud Storage destination bucket name")
     parser.add_argument("--upload.gs.bucket_prefix", dest="upload.gs.bucket_prefix", type=str,
                         help="Google Cloud Storage destination bucket path prefix")
+    parser.add_argument("--upload.gs.chunk_size_mb", dest="upload.gs.chunk_size_mb", default=50, type=int,
+                        help="Google Cloud Storage files larger than this are uploaded as parallel components in megabytes (default: 50)")
+    parser.add_argument("--upload.gs.target_mb_per_second", dest="upload.gs.target_mb_per_second", default=None, type=int,
+                        help="Google Cloud Storage target bandwidth in MB/s for all upload threads (default: unlimited)")
     return parser
@@ -0,0 +1,120 @@
+import logging
+import os
+
+from copy_reg import pickle
+from multiprocessing import Pool
+from time import time
+from types import MethodType
+
+from LocalUploadThread import LocalUploadThread
+
+from mongodb_consistent_backup.Common import parse_config_bool
+from mongodb_consistent_backup.Errors import OperationError
+from mongodb_consistent_backup.Pipeline import Task
+from mongodb_consistent_backup.Upload.Util import get_checksums, get_upload_files
+
+
+# Allows pooled .apply_async()s to work on Class-methods:
+def _reduce_method(m):
+    if m.im_self is None:
+        return getattr, (m.im_class, m.im_func.func_name)
+    else:
+        return getattr, (m.im_self, m.im_func.func_name)
+
+
+pickle(MethodType, _reduce_method)
+
+
+class Local(Task):
+    def __init__(self, manager, config, timer, base_dir, backup_dir, **kwargs):
+        super(Local, self).__init__(self.__class__.__name__, manager, config, timer, base_dir, backup_dir, **kwargs)
+        self.remove_uploaded = self.config.upload.remove_uploaded
+        self.local_path      = self.config.upload.local.path
+        self.fsync           = parse_config_bool(self.config.upload.local.fsync)
+        self.verify          = parse_config_bool(self.config.upload.local.verify)
+        if self.config.upload.file_regex == "none":
+            self.upload_file_regex = None
+        else:
+            self.upload_file_regex = self.config.upload.file_regex
+
+        self.threads(self.config.upload.threads)
+        self.unit_support = True
+        self._pool        = None
+        self._results     = []
+
+        if not self.local_path:
+            raise OperationError("Invalid or missing local upload path detected!")
+        elif os.path.realpath(self.local_path).startswith(os.path.realpath(self.config.backup.location) + os.sep):
+            raise OperationError("Local upload path %s cannot be inside the backup location!" % self.local_path)
+
+    def get_dest_path(self, file_path=None):
+        if file_path:
+            return os.path.join(self.local_path, self.base_dir, os.path.relpath(file_path, self.backup_dir))
+        return os.path.join(self.local_path, self.base_dir)
+
+    def done(self, result):
+        self._results.append(result)
+
+    def wait(self):
+        if self._pool:
+            logging.info("Waiting for local upload threads to stop")
+            self._pool.close()
+            self._pool.join()
+
+    def run(self):
+        if not os.path.isdir(self.backup_dir):
+            logging.error("The source directory: %s does not exist or is not a directory! Skipping local upload!" % self.backup_dir)
+            return
+        try:
+            self.running = True
+            self.timer.start(self.timer_name)
+            file_paths = filter(self.is_unit_path, get_upload_files(self.backup_dir, self.upload_file_regex))
+            checksums  = {}
+            if self.verify:
+                checksums = get_checksums(self.backup_dir, self.config, file_paths, self.unit, self.threads())
+            logging.info("Copying %i file(s) to %s (threads=%i, fsync=%s, verify=%s)" % (
+                len(file_paths),
+                self.get_dest_path(),
+                self.threads(),
+                self.fsync,
+                self.verify
+            ))
+            start      = time()
+            self._pool = Pool(processes=self.threads())
+            # largest first, so the largest copy does not start last
+            for file_path in sorted(file_paths, key=os.path.getsize, reverse=True):
+                self._pool.apply_async(LocalUploadThread(
+                    file_path,
+                    self.get_dest_path(file_path),
+                    self.fsync,
+                    self.remove_uploaded,
+                    checksums.get(os.path.relpath(file_path, self.backup_dir))
+                ).run, callback=self.done)
+            self.wait()
+            failed = filter(lambda result: result[4], self._results)
+            if len(failed) > 0 or len(self._results) < len(file_paths):
+                raise OperationError("Local upload of file(s) failed: %s" % ", ".join([result[0] for result in failed]))
+            byte_count = sum([result[1] for result in self._results])
+            duration   = max(time() - start, 0.001)
+            logging.info("Copied %.2fmb to %s in %.2f secs (%.2f MB/sec, methods: %s)" % (
+                float(byte_count / 1024.00 / 1024.00),
+                self.get_dest_path(),
+                duration,
+                byte_count / duration / 1024 / 1024,
+                ", ".join(sorted(set(filter(None, [result[2] for result in self._results]))))
+            ))
+            self.exit_code = 0
+            self.completed = True
+        except Exception, e:
+            logging.error("Local upload failed! Error: %s" % e)
+            raise OperationError(e)
+        finally:
+            self.timer.stop(self.timer_name)
+            self.stopped = True
+
+    def close(self, code=None, frame=None):
+        if self._pool and not self.stopped:
+            logging.error("Stopping local upload threads")
+            self._pool.terminate()
+            self._pool.join()
+            self.stopped = True
@@ -0,0 +1,77 @@
+import logging
+import os
+
+from time import time
+
+from mongodb_consistent_backup.Common import consume_rate_limit, copy_file, file_checksum, fsync_dir
+
+
+class LocalUploadThread:
+    def __init__(self, file_path, dest_path, fsync=False, remove_uploaded=False, checksum=None):
+        self.file_path       = file_path
+        self.dest_path       = dest_path
+        self.fsync           = fsync
+        self.remove_uploaded = remove_uploaded
+        self.checksum        = checksum
+
+        self.meta_dir    = "mongodb-consistent-backup_META"
+        self.rate_limits = ("upload",)
+        self.temp_path   = "%s.tmp-%i" % (self.dest_path, os.getpid())
+
+    def status(self, byte_count):
+        consume_rate_limit(byte_count, *self.rate_limits)
+
+    def is_uploaded(self):
+        # copies keep the mtime of the source file
+        if os.path.isfile(self.dest_path):
+            src  = os.stat(self.file_path)
+            dest = os.stat(self.dest_path)
+            return src.st_size == dest.st_size and int(src.st_mtime) == int(dest.st_mtime)
+        return False
+
+    def verify(self):
+        # reads the copy back, against the checksum of the source file
+        if self.checksum:
+            sha256 = file_checksum(self.temp_path)['sha256']
+            if sha256 != self.checksum['sha256']:
+                raise IOError("Checksum of copy %s does not match the source file (source: %s, copy: %s)!" % (
+                    self.temp_path,
+                    self.checksum['sha256'],
+                    sha256
+                ))
+
+    def handle_success(self):
+        if self.remove_uploaded and self.meta_dir not in self.file_path:
+            logging.debug("Removing uploaded file: %s" % self.file_path)
+            os.remove(self.file_path)
+
+    def run(self):
+        try:
+            if self.is_uploaded():
+                logging.info("File %s already exists with the same size and mtime, skipping" % self.dest_path)
+                return self.file_path, 0, None, None, None
+            dest_dir = os.path.dirname(self.dest_path)
+            if not os.path.isdir(dest_dir):
+                try:
+                    os.makedirs(dest_dir)
+                except OSError:
+                    if not os.path.isdir(dest_dir):
+                        raise
+            # copied to a temporary file renamed to the destination when complete, a destination
+            # file is never partially written
+            start  = time()
+            method = copy_file(self.file_path, self.temp_path, callback=self.status, fsync=self.fsync)
+            stat   = os.stat(self.file_path)
+            os.utime(self.temp_path, (stat.st_atime, stat.st_mtime))
+            self.verify()
+            os.rename(self.temp_path, self.dest_path)
+            if self.fsync:
+                fsync_dir(dest_dir)
+            logging.info("Copied %s to %s (%.2fmb, %s)" % (self.file_path, self.dest_path, float(stat.st_size / 1024.00 / 1024.00), method))
+            self.handle_success()
+            return self.file_path, stat.st_size, method, time() - start, None
+        except Exception, e:
+            logging.error("Copying %s to %s failed! Error: %s" % (self.file_path, self.dest_path, e))
+            if os.path.isfile(self.temp_path):
+                os.remove(self.temp_path)
+            return self.file_path, 0, None, None, str(e)
@@ -0,0 +1,11 @@
+from Local import Local  # NOQA
+
+
+def config(parser):
+    parser.add_argument("--upload.local.path", dest="upload.local.path", default=None, type=str,
+                        help="Local upload destination path, eg: a NFS mount or second disk (required for local upload)")
+    parser.add_argument("--upload.local.fsync", dest="upload.local.fsync", default=False, action="store_true",
+                        help="Fsync copied files and their directories before completing (default: false)")
+    parser.add_argument("--upload.local.verify", dest="upload.local.verify", default=False, action="store_true",
+                        help="Verify copied files against the backup checksums by reading them back (default: false)")
+    return parser
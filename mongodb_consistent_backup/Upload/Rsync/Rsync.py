@@ -4,14 +4,15 @@ import re
 
 from copy_reg import pickle
 from multiprocessing import Pool
-from subprocess import check_output
+from subprocess import PIPE, Popen, check_output
 from types import MethodType
 
 from RsyncUploadThread import RsyncUploadThread
 
-from mongodb_consistent_backup.Common import config_to_string
+from mongodb_consistent_backup.Common import RateLimiter, config_to_string, get_rate_limit, parse_config_bool, register_rate_limiter
 from mongodb_consistent_backup.Errors import OperationError
 from mongodb_consistent_backup.Pipeline import Task
+from mongodb_consistent_backup.Upload.Util import get_checksums
 
 
 # Allows pooled .apply_async()s to work on Class-methods:
@@ -37,14 +38,21 @@ class Rsync(Task):
         self.rsync_host      = self.config.upload.rsync.host
         self.rsync_port      = self.config.upload.rsync.port
         self.rsync_ssh_key   = self.config.upload.rsync.ssh_key
+        self.rsync_link_dest = parse_config_bool(self.config.upload.rsync.link_dest)
+        self.rsync_split_mb  = self.config.upload.rsync.split_mb
         self.rsync_binary    = "rsync"
 
         self.rsync_flags   = ["--archive", "--compress"]
         self.rsync_version = None
         self._rsync_info   = None
 
+        if self.config.upload.rsync.target_mb_per_second is not None:
+            register_rate_limiter("rsync", RateLimiter(self.config.upload.rsync.target_mb_per_second * 1024 * 1024))
+
         self.threads(self.config.upload.threads)
-        self._pool = Pool(processes=self.threads())
+        self.unit_support = True
+        self._pool        = None
+        self._failed      = []
 
     def init(self):
         if not self.host_has_rsync():
@@ -69,11 +77,48 @@ class Rsync(Task):
     def get_dest_path(self):
         return os.path.join(self.rsync_path, self.base_dir)
 
+    def get_ssh_cmd(self):
+        ssh_cmd = ["ssh", "-p", str(self.rsync_port)]
+        if self.rsync_ssh_key:
+            ssh_cmd.extend(["-i", self.rsync_ssh_key])
+        return ssh_cmd
+
+    def get_previous_dest_path(self):
+        # the latest backup on the remote host older than this one, backup directories are named by their sortable time
+        backups_path = os.path.join(self.rsync_path, os.path.dirname(self.base_dir))
+        backup_time  = os.path.basename(self.base_dir)
+        try:
+            output = check_output(self.get_ssh_cmd() + ["%s@%s" % (self.rsync_user, self.rsync_host), "ls", "-1", backups_path])
+        except Exception, e:
+            logging.warning("Cannot list previous backups in %s on %s, uploading without --link-dest: %s" % (backups_path, self.rsync_host, e))
+            return
+        previous = sorted(filter(lambda name: re.match(r"^\d{8}_\d{4}$", name) and name < backup_time, output.splitlines()))
+        if len(previous) > 0:
+            return os.path.join(backups_path, previous[-1])
+
+    def get_split_files(self, src_path):
+        # splits the files of a large directory into buckets of about equal size, for parallel rsyncs
+        if self.rsync_split_mb <= 0 or self.threads() <= 1:
+            return
+        files = []
+        for root, dirs, file_names in os.walk(src_path):
+            for file_name in file_names:
+                file_path = os.path.join(root, file_name)
+                files.append((os.path.getsize(file_path), os.path.relpath(file_path, self.backup_dir)))
+        total_bytes  = sum([size for size, file_name in files])
+        bucket_count = min(self.threads(), len(files), int(total_bytes / (self.rsync_split_mb * 1024 * 1024)) + 1)
+        if bucket_count <= 1:
+            return
+        buckets = [[0, []] for i in range(bucket_count)]
+        for size, file_name in sorted(files, reverse=True):
+            bucket = min(buckets)
+            bucket[0] += size
+            bucket[1].append(file_name)
+        return [file_names for size, file_names in buckets]
+
     def prepare_dest_dir(self):
         # mkdir -p the rsync dest path via ssh
-        ssh_mkdir_cmd = ["ssh"]
-        if self.rsync_ssh_key:
-            ssh_mkdir_cmd.extend(["-i", self.rsync_ssh_key])
+        ssh_mkdir_cmd = self.get_ssh_cmd()
         ssh_mkdir_cmd.extend([
             "%s@%s" % (self.rsync_user, self.rsync_host),
             "mkdir", "-p", self.get_dest_path()
@@ -91,19 +136,64 @@ class Rsync(Task):
 
         return True
 
+    def get_bwlimit_flags(self, concurrent_jobs):
+        # rsync cannot share a rate limiter, each rsync gets an even share of the limit at its start
+        rate = get_rate_limit("upload", "rsync")
+        if rate > 0:
+            return ["--bwlimit=%i" % max(1, rate / 1024 / max(1, concurrent_jobs))]
+        return []
+
+    def get_files(self, src_paths):
+        file_paths = []
+        for src_path in src_paths:
+            if os.path.isfile(src_path):
+                file_paths.append(src_path)
+            for root, dirs, file_names in os.walk(src_path):
+                file_paths.extend([os.path.join(root, file_name) for file_name in file_names])
+        return file_paths
+
+    def verify_remote(self, checksums, file_paths):
+        # checks the uploaded files with sha256sum on the remote host, against the checksums of the local files
+        lines = []
+        for file_path in file_paths:
+            rel_path = os.path.relpath(file_path, self.backup_dir)
+            if rel_path in checksums:
+                lines.append("%s  %s\n" % (checksums[rel_path]['sha256'], rel_path))
+        if len(lines) == 0:
+            return
+        logging.info("Verifying checksums of %i uploaded file(s) on %s" % (len(lines), self.rsync_host))
+        ssh_cmd = self.get_ssh_cmd() + ["%s@%s" % (self.rsync_user, self.rsync_host), "cd %s && sha256sum --quiet -c -" % self.get_dest_path()]
+        process = Popen(ssh_cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        stdout, stderr = process.communicate("".join(lines))
+        if process.returncode != 0:
+            raise OperationError("Checksums of uploaded files on %s do not match the local checksums! Output: %s" % (
+                self.rsync_host,
+                (stdout + stderr).strip()
+            ))
+        logging.info("Verified checksums of %i uploaded file(s) on %s" % (len(lines), self.rsync_host))
+
     def done(self, data):
-        logging.info(data)
+        completed, src_path = data
+        if not completed:
+            self._failed.append(src_path)
 
     def run(self):
         try:
             self.init()
             self.timer.start(self.timer_name)
+            self._pool = Pool(processes=self.threads())
 
             logging.info("Preparing destination path on %s" % self.rsync_host)
             self.prepare_dest_dir()
 
+            link_dest = None
+            if self.rsync_link_dest:
+                link_dest = self.get_previous_dest_path()
+
             rsync_config = {
                 "dest": "%s@%s:%s" % (self.rsync_user, self.rsync_host, self.get_dest_path()),
+                "link_dest": link_dest,
+                "split_mb": self.rsync_split_mb,
                 "threads": self.threads(),
                 "retries": self.retries
             }
@@ -112,20 +202,43 @@ class Rsync(Task):
                 self.rsync_info()['version'],
                 config_to_string(rsync_config)
             ))
-            for child in os.listdir(self.backup_dir):
+            jobs      = []
+            src_paths = filter(self.is_unit_path, [os.path.join(self.backup_dir, child) for child in os.listdir(self.backup_dir)])
+            # hashed before the upload, as uploaded files may be removed
+            file_paths = self.get_files(src_paths)
+            checksums  = get_checksums(self.backup_dir, self.config, file_paths, self.unit, self.threads())
+            for src_path in src_paths:
+                buckets = None
+                if os.path.isdir(src_path):
+                    buckets = self.get_split_files(src_path)
+                if buckets:
+                    logging.info("Splitting upload of %s into %i parallel rsyncs" % (src_path, len(buckets)))
+                    jobs.extend([(src_path, files) for files in buckets])
+                else:
+                    jobs.append((src_path, None))
+            rsync_flags = self.rsync_flags + ["--rsh=%s" % " ".join(self.get_ssh_cmd())]
+            rsync_flags.extend(self.get_bwlimit_flags(min(self.threads(), len(jobs))))
+            self._failed = []
+            for src_path, files in jobs:
                 self._pool.apply_async(RsyncUploadThread(
-                    os.path.join(self.backup_dir, child),
+                    src_path,
                     self.base_dir,
-                    self.rsync_flags,
+                    rsync_flags,
                     self.rsync_path,
                     self.rsync_user,
                     self.rsync_host,
                     self.rsync_port,
                     self.rsync_ssh_key,
                     self.remove_uploaded,
-                    self.retries
+                    self.retries,
+                    self.rsync_binary,
+                    files,
+                    link_dest
                 ).run, callback=self.done)
             self.wait()
+            if len(self._failed) > 0:
+                raise OperationError("Rsync upload of path(s) failed: %s" % ", ".join(sorted(set(self._failed))))
+            self.verify_remote(checksums, file_paths)
         except Exception, e:
             logging.error("Rsync upload failed! Error: %s" % e)
             raise OperationError(e)
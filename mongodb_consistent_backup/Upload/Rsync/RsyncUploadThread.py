@@ -3,6 +3,7 @@ import os
 
 from shutil import rmtree
 from subprocess import Popen, PIPE
+from tempfile import mkstemp
 
 from mongodb_consistent_backup.Common import wait_popen
 
@@ -10,7 +11,7 @@ from mongodb_consistent_backup.Common import wait_popen
 class RsyncUploadThread:
     def __init__(self, src_path, base_path, rsync_flags, rsync_path, rsync_user, rsync_host,
                  rsync_port=22, rsync_ssh_key=None, remove_uploaded=False, retries=5,
-                 rsync_binary="rsync"):
+                 rsync_binary="rsync", files=None, link_dest=None):
         self.src_path        = src_path
         self.base_path       = base_path
         self.rsync_flags     = rsync_flags
@@ -22,17 +23,38 @@ class RsyncUploadThread:
         self.remove_uploaded = remove_uploaded
         self.retries         = retries
         self.rsync_binary    = rsync_binary
+        self.files           = files
+        self.link_dest       = link_dest
 
-        self.completed = False
-        self.rsync_url = None
-        self.rsync_cmd = None
-        self.meta_dir  = "mongodb-consistent-backup_META"
+        self.completed  = False
+        self.rsync_url  = None
+        self.rsync_cmd  = None
+        self.files_from = None
+        self.meta_dir   = "mongodb-consistent-backup_META"
+        self._command   = None
 
     def init(self):
         self.rsync_url = "%s@%s:%s" % (self.rsync_user, self.rsync_host, self.get_dest_path())
         self.rsync_cmd = [self.rsync_binary]
         self.rsync_cmd.extend(self.rsync_flags)
-        self.rsync_cmd.extend([self.src_path, self.rsync_url])
+        if self.link_dest:
+            # files unchanged since the previous backup become hardlinks to it on the remote host
+            self.rsync_cmd.append("--link-dest=%s" % self.link_dest)
+        if self.files is not None:
+            # a bucket of files of the directory, relative to its parent like a full directory upload
+            self.write_files_from()
+            self.rsync_cmd.extend(["--files-from=%s" % self.files_from, "%s/" % os.path.dirname(self.src_path), self.rsync_url])
+        else:
+            self.rsync_cmd.extend([self.src_path, self.rsync_url])
+
+    def write_files_from(self):
+        fd, self.files_from = mkstemp(prefix="rsync-files-from.")
+        f = os.fdopen(fd, "w")
+        try:
+            for file_name in self.files:
+                f.write("%s\n" % file_name)
+        finally:
+            f.close()
 
     def get_dest_path(self):
         return os.path.join(self.rsync_path, self.base_path)
@@ -41,6 +63,10 @@ class RsyncUploadThread:
         if self.remove_uploaded:
             if self.meta_dir in self.src_path:
                 logging.info("Skipping removal of metadata path: %s" % self.src_path)
+            elif self.files is not None:
+                logging.info("Removing %i uploaded file(s) of path: %s" % (len(self.files), self.src_path))
+                for file_name in self.files:
+                    os.remove(os.path.join(os.path.dirname(self.src_path), file_name))
             else:
                 logging.info("Removing uploaded path: %s" % self.src_path)
                 rmtree(self.src_path)
@@ -61,22 +87,25 @@ class RsyncUploadThread:
     def run(self):
         self.init()
         try:
-            logging.info("Uploading to %s" % (self.rsync_url))
+            if self.files is not None:
+                logging.info("Uploading %i file(s) of %s to %s" % (len(self.files), self.src_path, self.rsync_url))
+            else:
+                logging.info("Uploading %s to %s" % (self.src_path, self.rsync_url))
             logging.debug("Rsync cmd: %s" % self.rsync_cmd)
-            self._command  = Popen(self.rsync_cmd, stderr=PIPE, stdout=PIPE)
-            self.completed = wait_popen(self._command, self.stderr, self.stdout)
-
-            if self.completed:
+            self._command = Popen(self.rsync_cmd, stderr=PIPE, stdout=PIPE)
+            wait_popen(self._command, self.stderr, self.stdout)
+            if self._command.returncode == 0:
+                self.completed = True
                 self.handle_success()
+            else:
+                logging.error("Rsync upload of %s failed with exit code: %s" % (self.src_path, self._command.returncode))
         finally:
             self.close()
+            if self.files_from and os.path.isfile(self.files_from):
+                os.remove(self.files_from)
             return self.completed, self.src_path
 
     def close(self, code=None, frame=None):
-        logging.info("Stopping upload to %s@%s:%s" % (
-            self.rsync_user,
-            self.rsync_host,
-            self.dest_path
-        ))
-        if not self.completed and self._command:
+        if not self.completed and self._command and self._command.poll() is None:
+            logging.info("Stopping upload to %s" % self.rsync_url)
             self._command.terminate()
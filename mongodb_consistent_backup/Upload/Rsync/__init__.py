@@ -7,4 +7,10 @@ def config(parser):
     parser.add_argument("--upload.rsync.host", dest="upload.rsync.host", help="Rsync upload SSH hostname/IP", default=None, type=str)
     parser.add_argument("--upload.rsync.port", dest="upload.rsync.port", help="Rsync upload SSH port number (default: 22)", default=22, type=int)
     parser.add_argument("--upload.rsync.ssh_key", dest="upload.rsync.ssh_key", help="Rsync upload SSH key path", default=None, type=str)
+    parser.add_argument("--upload.rsync.link_dest", dest="upload.rsync.link_dest", default=False, action="store_true",
+                        help="Hardlink files unchanged since the previous uploaded backup on the remote host with --link-dest (default: false)")
+    parser.add_argument("--upload.rsync.split_mb", dest="upload.rsync.split_mb", default=1024, type=int,
+                        help="Split directories larger than this in megabytes across parallel rsyncs by file size (default: 1024, 0 - disabled)")
+    parser.add_argument("--upload.rsync.target_mb_per_second", dest="upload.rsync.target_mb_per_second", default=None, type=int,
+                        help="Rsync upload target bandwidth in MB/s for all upload threads (default: unlimited)")
     return parser
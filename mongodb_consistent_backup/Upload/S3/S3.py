@@ -3,9 +3,11 @@ import logging
 
 from S3UploadPool import S3UploadPool
 
+from mongodb_consistent_backup.Common import RateLimiter, parse_config_bool, register_rate_limiter
 from mongodb_consistent_backup.Errors import OperationError
 from mongodb_consistent_backup.Pipeline import Task
-from mongodb_consistent_backup.Upload.Util import get_upload_files
+from mongodb_consistent_backup.State import StateUpload
+from mongodb_consistent_backup.Upload.Util import copy_reused_files, get_checksums, get_s3_key_name, get_upload_files
 
 
 class S3(Task):
@@ -21,24 +23,29 @@ class S3(Task):
         self.secret_key          = getattr(self.config.upload.s3, 'secret_key', None)
         self.chunk_size_mb       = self.config.upload.s3.chunk_size_mb
         self.chunk_size          = self.chunk_size_mb * 1024 * 1024
-        self.target_bandwidth    = None
-        if self.config.upload.s3.target_mb_per_second is not None:
-            self.target_bandwidth    = self.config.upload.s3.target_mb_per_second * 1024 * 1024
         self.s3_acl              = self.config.upload.s3.acl
         self.key_prefix          = base_dir
         self.validate_bucket     = not self.config.upload.s3.skip_bucket_validation
+        self.resumable           = parse_config_bool(self.config.upload.s3.resumable)
         if self.config.upload.file_regex == "none":
             self.upload_file_regex = None
         else:
             self.upload_file_regex = self.config.upload.file_regex
 
+        # limits all S3 uploads, on top of the 'upload.bandwidth' limit
+        if self.config.upload.s3.target_mb_per_second is not None:
+            register_rate_limiter("s3", RateLimiter(self.config.upload.s3.target_mb_per_second * 1024 * 1024))
+
         self.threads(self.config.upload.threads)
-        self._pool = None
+        self.unit_support = True
+        self._pool        = None
 
         if self.region is None:
             raise OperationError("Invalid or missing AWS S3 region detected!")
 
-        self._pool = S3UploadPool(
+    def get_pool(self, upload_state=None, keep_incomplete=False):
+        # started by .run(), as pipeline jobs run the task in a child process
+        return S3UploadPool(
             self.bucket_name,
             self.region,
             self.access_key,
@@ -48,18 +55,55 @@ class S3(Task):
             self.chunk_size,
             self.s3_acl,
             validate_bucket=self.validate_bucket,
-            target_bandwidth=self.target_bandwidth
+            upload_state=upload_state,
+            keep_incomplete=keep_incomplete,
+            key_prefixes=self.get_key_prefixes()
         )
 
     def get_key_name(self, file_path):
         rel_path = os.path.relpath(file_path, self.backup_dir)
+        return get_s3_key_name(self.bucket_prefix, self.key_prefix, rel_path, self.bucket_explicit_key)
+
+    def get_key_prefixes(self):
+        # the key names of the files of this task start with these, the files of a unit are '<unit>/' or '<unit>.<ext>'
         if self.bucket_explicit_key:
-            key_name = self.bucket_explicit_key
-        elif self.bucket_prefix == "/":
-            key_name = "/%s/%s" % (self.key_prefix, rel_path)
-        else:
-            key_name = "%s/%s/%s" % (self.bucket_prefix, self.key_prefix, rel_path)
-        return key_name
+            return [self.bucket_explicit_key]
+        elif self.unit:
+            unit_key = get_s3_key_name(self.bucket_prefix, self.key_prefix, self.unit)
+            return ["%s/" % unit_key, "%s." % unit_key]
+        return [get_s3_key_name(self.bucket_prefix, self.key_prefix, "")]
+
+    def get_previous_key_name(self, backup_name, rel_path):
+        # the key of a file of an earlier backup of the same name
+        key_prefix = os.path.join(os.path.dirname(self.key_prefix), backup_name)
+        return get_s3_key_name(self.bucket_prefix, key_prefix, rel_path)
+
+    def copy_file(self, file_path, src_key_name):
+        return self._pool.copy(file_path, self.get_key_name(file_path), src_key_name)
+
+    def upload_files(self, upload_state=None, keep_incomplete=False):
+        try:
+            self._pool = self.get_pool(upload_state, keep_incomplete)
+            file_paths = []
+            for file_path in get_upload_files(self.backup_dir, self.upload_file_regex):
+                if not self.is_unit_path(file_path):
+                    continue
+                elif upload_state and file_path == upload_state.state_file:
+                    continue
+                file_paths.append(file_path)
+            # files of collections reused from the previous backup are copied from its keys
+            if not self.bucket_explicit_key:
+                file_paths = copy_reused_files(self.backup_dir, self.config, file_paths, self.copy_file,
+                                               self.get_previous_key_name, self.threads())
+            # parts are sent with the md5s of the checksums, S3 rejects parts that do not match them
+            checksums = get_checksums(self.backup_dir, self.config, file_paths, self.unit, self.threads())
+            for file_path in file_paths:
+                key_name = self.get_key_name(file_path)
+                self._pool.upload(file_path, key_name, checksums.get(os.path.relpath(file_path, self.backup_dir)))
+            self._pool.wait()
+        finally:
+            if self._pool:
+                self._pool.close()
 
     def run(self):
         if not os.path.isdir(self.backup_dir):
@@ -67,22 +111,34 @@ class S3(Task):
             return
         try:
             self.timer.start(self.timer_name)
-            logging.info("Starting AWS S3 upload to %s (%i threads, %imb multipart chunks, %i retries)" % (
+            logging.info("Starting AWS S3 upload to %s (%i threads, %imb multipart chunks, %i retries, resumable: %s)" % (
                 self.bucket_name,
                 self.threads(),
                 self.chunk_size_mb,
-                self.retries
+                self.retries,
+                self.resumable
             ))
-            for file_path in get_upload_files(self.backup_dir, self.upload_file_regex):
-                key_name = self.get_key_name(file_path)
-                self._pool.upload(file_path, key_name)
-            self._pool.wait()
+            # resumable uploads are retried from the parts already uploaded, uploads still incomplete
+            # after the last attempt are aborted so their parts are not stored (and billed) by S3
+            attempts = 1
+            if self.resumable:
+                attempts = max(self.retries, 1)
+            for attempt in range(1, attempts + 1):
+                upload_state = None
+                if self.resumable:
+                    upload_state = StateUpload(self.backup_dir, self.config, self.unit)
+                try:
+                    self.upload_files(upload_state, attempt < attempts)
+                    break
+                except Exception, e:
+                    if attempt >= attempts:
+                        raise e
+                    logging.warning("AWS S3 upload attempt %i/%i failed, resuming incomplete uploads. Error: %s" % (attempt, attempts, e))
         except Exception, e:
             logging.error("Uploading to AWS S3 failed! Error: %s (error type: %s)" % (e, type(e)))
             raise OperationError(e)
         finally:
             self.timer.stop(self.timer_name)
-            self._pool.close()
 
         self.completed = True
 
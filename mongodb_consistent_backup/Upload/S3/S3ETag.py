@@ -0,0 +1,70 @@
+from base64 import b64encode
+from binascii import unhexlify
+from hashlib import md5
+from math import ceil
+from mmap import mmap, ACCESS_READ, ALLOCATIONGRANULARITY
+from multiprocessing import Pool, cpu_count
+
+
+def chunk_md5hex(job):
+    # md5 of a chunk of a file, hashed from a memory-map of the chunk only
+    file_name, offset, byte_count, block_bytes = job
+    md5hash = md5()
+    if byte_count > 0:
+        map_offset = offset - (offset % ALLOCATIONGRANULARITY)
+        start      = offset - map_offset
+        end        = start + byte_count
+        with open(file_name, "rb") as f:
+            data = mmap(f.fileno(), end, access=ACCESS_READ, offset=map_offset)
+            try:
+                for pos in xrange(start, end, block_bytes):
+                    md5hash.update(data[pos:min(pos + block_bytes, end)])
+            finally:
+                data.close()
+    return md5hash.hexdigest()
+
+
+def get_chunks(file_size, chunk_bytes):
+    # (offset, byte count) of the parts of a multipart upload
+    chunks = []
+    for i in range(int(ceil(file_size / float(chunk_bytes)))):
+        offset = chunk_bytes * i
+        chunks.append((offset, min(chunk_bytes, file_size - offset)))
+    return chunks
+
+
+def get_etag(md5hexes, multipart=False):
+    # S3 ETags of multipart uploads are the md5 of the binary part md5s, with the part count
+    if not multipart:
+        return md5hexes[0]
+    return "%s-%i" % (md5("".join([unhexlify(md5hex) for md5hex in md5hexes])).hexdigest(), len(md5hexes))
+
+
+def get_content_md5(md5hex):
+    # the (hex, base64) md5 tuple boto sends as Content-MD5, instead of hashing the data again
+    if md5hex:
+        return md5hex, b64encode(unhexlify(md5hex))
+
+
+# Hashes the chunks of a file in parallel, giving the per-part md5s of an
+# upload and its S3 ETag with a single read of the file.
+class S3ETag:
+    def __init__(self, threads=None, block_bytes=1024 * 1024):
+        self.threads     = threads or cpu_count()
+        self.block_bytes = block_bytes
+
+        self._pool = None
+
+    def md5hexes(self, file_name, chunks):
+        jobs = [(file_name, offset, byte_count, self.block_bytes) for offset, byte_count in chunks]
+        if len(jobs) == 1:
+            return [chunk_md5hex(jobs[0])]
+        if not self._pool:
+            self._pool = Pool(processes=self.threads)
+        return self._pool.map(chunk_md5hex, jobs)
+
+    def close(self):
+        if self._pool:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
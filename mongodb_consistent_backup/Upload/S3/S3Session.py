@@ -1,4 +1,5 @@
 import logging
+import os
 
 import boto
 import boto.s3
@@ -7,6 +8,25 @@ from boto.s3.connection import OrdinaryCallingFormat, SubdomainCallingFormat
 from mongodb_consistent_backup.Errors import OperationError
 
 
+# buckets of the current process, keeping one keep-alive connection per upload pool process
+_session_buckets = {}
+
+
+def get_session_bucket(region, access_key, secret_key, bucket_name, secure=True, num_retries=5, validate_bucket=False):
+    # the pid is part of the key, as forked processes must not share the connection of their parent
+    cache_key = (os.getpid(), region, access_key, secret_key, bucket_name, secure)
+    if cache_key not in _session_buckets:
+        s3_conn = S3Session(region, access_key, secret_key, bucket_name, secure, num_retries, validate_bucket=validate_bucket)
+        _session_buckets[cache_key] = s3_conn.get_bucket(bucket_name)
+    return _session_buckets[cache_key]
+
+
+def reset_session_bucket(region, access_key, secret_key, bucket_name, secure=True):
+    cache_key = (os.getpid(), region, access_key, secret_key, bucket_name, secure)
+    if cache_key in _session_buckets:
+        del _session_buckets[cache_key]
+
+
 class S3Session:
     def __init__(self, region, access_key, secret_key, bucket_name, secure=True, num_retries=5, socket_timeout=15,
                  **kwargs):
@@ -0,0 +1,225 @@
+import exceptions
+import httplib
+import logging
+import socket
+
+from boto.s3.key import Key
+from boto.s3.multipart import MultiPartUpload
+from cStringIO import StringIO
+from math import ceil
+from Queue import Queue
+from threading import BoundedSemaphore, Thread
+from time import sleep
+
+from S3Session import S3Session
+
+from mongodb_consistent_backup.Common import consume_rate_limit, is_rate_limited
+from mongodb_consistent_backup.Errors import OperationError
+
+
+# Uploads a stream of unknown length (eg: tar output) to a single S3 key as a
+# multipart upload. Parts are cut from the stream in memory and uploaded by
+# worker threads, .write() blocks once 'max_inflight_parts' parts are queued
+# or uploading, bounding memory use to about max_inflight_parts x chunk_bytes.
+# When the size of the stream is known ('byte_count', eg: the size of the
+# archived files) parts are grown to keep the upload below S3's part limit.
+class S3StreamUpload:
+    def __init__(self, bucket_name, region, access_key, secret_key, key_name, chunk_bytes=50 * 1024 * 1024, threads=4,
+                 max_inflight_parts=4, key_acl=None, retries=5, secure=True, validate_bucket=True, retry_sleep_secs=1,
+                 byte_count=None):
+        self.bucket_name        = bucket_name
+        self.region             = region
+        self.access_key         = access_key
+        self.secret_key         = secret_key
+        self.key_name           = key_name
+        self.threads            = threads
+        self.max_inflight_parts = max_inflight_parts
+        self.key_acl            = key_acl
+        self.retries            = retries
+        self.secure             = secure
+        self.validate_bucket    = validate_bucket
+        self.retry_sleep_secs   = retry_sleep_secs
+        self.rate_limits        = ("upload", "s3")
+
+        # S3 requires all parts but the last to be at least 5MB
+        self.multipart_min_bytes = 5242880
+        self.chunk_bytes         = max(chunk_bytes, self.multipart_min_bytes)
+
+        # S3 allows 10000 parts per upload, leave room for a stream up to 10% larger than expected
+        self.multipart_max_parts = 10000
+        if byte_count:
+            min_chunk_bytes = int(ceil(byte_count * 1.1 / 9000))
+            if min_chunk_bytes > self.chunk_bytes:
+                logging.info("Raising AWS S3 stream part size of s3://%s%s to %.2fmb for %.2fmb of data" % (
+                    self.bucket_name,
+                    self.key_name,
+                    float(min_chunk_bytes / 1024.00 / 1024.00),
+                    float(byte_count / 1024.00 / 1024.00)
+                ))
+                self.chunk_bytes = min_chunk_bytes
+
+        self.bucket        = None
+        self.byte_count    = 0
+        self._multipart    = None
+        self._buffer       = []
+        self._buffer_bytes = 0
+        self._part_num     = 0
+        self._inflight     = BoundedSemaphore(max(1, self.max_inflight_parts))
+        self._queue        = Queue()
+        self._workers      = []
+        self._error        = None
+        self._closed       = False
+
+    def get_bucket(self):
+        s3_conn = S3Session(self.region, self.access_key, self.secret_key, self.bucket_name, self.secure, self.retries,
+                            validate_bucket=self.validate_bucket)
+        return s3_conn.get_bucket(self.bucket_name)
+
+    def start(self):
+        try:
+            self.bucket     = self.get_bucket()
+            self._multipart = self.bucket.initiate_multipart_upload(self.key_name)
+            logging.info("Started streaming AWS S3 upload: s3://%s%s (%i threads, max %i in-flight parts)" % (
+                self.bucket_name,
+                self.key_name,
+                self.threads,
+                self.max_inflight_parts
+            ))
+        except Exception, e:
+            logging.error("Cannot start streaming AWS S3 upload to s3://%s%s! Error: %s" % (self.bucket_name, self.key_name, e))
+            raise OperationError(e)
+        for i in range(max(1, min(self.threads, self.max_inflight_parts))):
+            worker = Thread(target=self.upload_parts)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def rate_limit_callback(self):
+        # boto reports the bytes sent so far, the rate limits take the bytes sent since the last callback
+        sent = [0]
+
+        def callback(bytes_sent, bytes_total):
+            consume_rate_limit(bytes_sent - sent[0], *self.rate_limits)
+            sent[0] = bytes_sent
+        return callback
+
+    def upload_part(self, multipart, part_num, data):
+        tries = 0
+        while True:
+            try:
+                logging.debug("Uploading AWS S3 stream part: s3://%s%s (part: %i, size: %.2fmb)" % (
+                    self.bucket_name,
+                    self.key_name,
+                    part_num,
+                    float(len(data) / 1024.00 / 1024.00)
+                ))
+                if is_rate_limited(*self.rate_limits):
+                    return multipart.upload_part_from_file(StringIO(data), part_num, cb=self.rate_limit_callback(),
+                                                           num_cb=max(10, len(data) / 524288))
+                return multipart.upload_part_from_file(StringIO(data), part_num)
+            except (httplib.HTTPException, exceptions.IOError, socket.error, socket.gaierror) as e:
+                tries += 1
+                if tries >= self.retries:
+                    raise e
+                logging.error("Got exception during upload of part %i: '%s', retrying upload" % (part_num, e))
+                sleep(self.retry_sleep_secs)
+
+    def upload_parts(self):
+        multipart = None
+        while True:
+            part = self._queue.get()
+            if part is None:
+                break
+            part_num, data = part
+            try:
+                if not self._error:
+                    if not multipart:
+                        # boto connections are not thread-safe, use one per worker
+                        multipart          = MultiPartUpload(self.get_bucket())
+                        multipart.key_name = self.key_name
+                        multipart.id       = self._multipart.id
+                    self.upload_part(multipart, part_num, data)
+            except Exception, e:
+                logging.error("AWS S3 stream upload of part %i failed! Error: %s" % (part_num, e))
+                self._error = e
+            finally:
+                self._inflight.release()
+
+    def check_error(self):
+        if self._error:
+            raise OperationError("AWS S3 stream upload to s3://%s%s failed! Error: %s" % (self.bucket_name, self.key_name, self._error))
+
+    def queue_part(self, data):
+        if self._part_num >= self.multipart_max_parts:
+            raise OperationError("AWS S3 stream upload to s3://%s%s exceeds the limit of %i parts of %.2fmb! Raise 'upload.s3.chunk_size_mb'" % (
+                self.bucket_name,
+                self.key_name,
+                self.multipart_max_parts,
+                float(self.chunk_bytes / 1024.00 / 1024.00)
+            ))
+        self._inflight.acquire()
+        self._part_num += 1
+        self._queue.put((self._part_num, data))
+
+    def write(self, data):
+        self.check_error()
+        self._buffer.append(data)
+        self._buffer_bytes += len(data)
+        self.byte_count    += len(data)
+        if self._buffer_bytes >= self.chunk_bytes:
+            data = "".join(self._buffer)
+            while len(data) >= self.chunk_bytes:
+                self.queue_part(data[:self.chunk_bytes])
+                data = data[self.chunk_bytes:]
+            self._buffer       = [data]
+            self._buffer_bytes = len(data)
+
+    def stop_workers(self):
+        for worker in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def complete(self):
+        try:
+            if self._buffer_bytes > 0:
+                self.queue_part("".join(self._buffer))
+                self._buffer       = []
+                self._buffer_bytes = 0
+            self.stop_workers()
+            self.check_error()
+            if self._part_num == 0:
+                # empty stream, a multipart upload needs at least one part
+                self._multipart.cancel_upload()
+                key = Key(bucket=self.bucket, name=self.key_name)
+                key.set_contents_from_string("")
+            else:
+                self._multipart.complete_upload()
+            if self.key_acl:
+                self.bucket.set_acl(self.key_acl, self.key_name)
+            self._closed = True
+            logging.info("Uploaded AWS S3 key successfully: s3://%s%s (%i parts, %.2fmb)" % (
+                self.bucket_name,
+                self.key_name,
+                self._part_num,
+                float(self.byte_count / 1024.00 / 1024.00)
+            ))
+        except Exception, e:
+            self.cancel()
+            raise OperationError(e)
+        return self.byte_count
+
+    def cancel(self):
+        if self._closed:
+            return
+        self._closed = True
+        if not self._error:
+            self._error = OperationError("Upload cancelled")
+        self.stop_workers()
+        if self._multipart:
+            logging.info("Cancelling multipart upload: s3://%s%s" % (self.bucket_name, self.key_name))
+            try:
+                self._multipart.cancel_upload()
+            except Exception, e:
+                logging.error("Cannot cancel multipart upload s3://%s%s! Error: %s" % (self.bucket_name, self.key_name, e))
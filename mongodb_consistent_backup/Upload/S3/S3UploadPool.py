@@ -2,17 +2,21 @@ import boto.s3.multipart
 import logging
 import os
 
+from boto.exception import S3ResponseError
 from boto.s3.key import Key
+from boto.s3.multipart import MultiPartUpload
 from copy_reg import pickle
-from math import ceil
-from multiprocessing import Pool, TimeoutError
-from time import sleep
+from multiprocessing import Pool
+from Queue import Empty, Queue
+from threading import RLock
+from time import time
 from types import MethodType
 
+from S3ETag import S3ETag, get_chunks, get_etag
 from S3Session import S3Session
 from S3UploadThread import S3UploadThread
 
-from mongodb_consistent_backup.Common.Util import file_md5hash
+from mongodb_consistent_backup.Common import checksum_md5hexes
 from mongodb_consistent_backup.Errors import OperationError
 
 
@@ -38,15 +42,34 @@ class S3UploadPool():
         self.chunk_bytes     = chunk_bytes
         self.key_acl         = key_acl
         self.validate_bucket = kwargs.get("validate_bucket")
-        self.target_bandwidth = kwargs.get("target_bandwidth")
         self.upload_file_regex = kwargs.get("upload_file_regex")
+        self.upload_state    = kwargs.get("upload_state")
+
+        # incomplete multipart uploads are kept in the upload state to be resumed by the next upload
+        # attempt, unless 'keep_incomplete' is unset: the last attempt aborts them when it fails
+        self.resumable           = self.upload_state is not None
+        self.keep_incomplete     = kwargs.get("keep_incomplete", False)
+        # the key name prefixes of the files of this upload, other uploads may share the bucket and backup
+        self.key_prefixes        = kwargs.get("key_prefixes")
+        self.manifest_flush_secs = 10
 
         self.multipart_min_bytes = 5242880
+        # the largest object S3 copies in a single request
+        self.copy_max_bytes      = 5 * 1024 * 1024 * 1024
 
         self._closed     = False
         self._uploads    = {}
         self._mp_uploads = {}
         self._pool       = Pool(processes=self.threads)
+        self._etag       = S3ETag()
+
+        # results of uploads in the pool are put in the completion queue by the pool callback
+        self._completions = Queue()
+        self._pending     = {}
+        self._completed   = 0
+
+        self._manifest_lock    = RLock()
+        self._manifest_flushed = 0
 
         try:
             self.s3_conn = S3Session(self.region, self.access_key, self.secret_key, self.bucket_name,
@@ -62,6 +85,7 @@ class S3UploadPool():
             logging.info("Stopping AWS S3 upload pool")
             self._pool.terminate()
             self._pool.join()
+        self._etag.close()
         self.cancel_multipart_uploads()
         self._closed = True
 
@@ -86,14 +110,108 @@ class S3UploadPool():
             if key:
                 key.close()
 
+    def get_manifest(self, key_name):
+        return self.upload_state.get('uploads').get(key_name)
+
+    def flush_manifest(self, force=True):
+        if self.resumable and (force or time() - self._manifest_flushed >= self.manifest_flush_secs):
+            with self._manifest_lock:
+                self.upload_state.write()
+                self._manifest_flushed = time()
+
+    def start_manifest(self, file_name, key_name, file_size, mp_id):
+        if self.resumable:
+            with self._manifest_lock:
+                self.upload_state.get('uploads')[key_name] = {
+                    'file':        file_name,
+                    'file_size':   file_size,
+                    'file_mtime':  int(os.stat(file_name).st_mtime),
+                    'upload_id':   mp_id,
+                    'chunk_bytes': self.chunk_bytes,
+                    'parts':       {}
+                }
+                self.flush_manifest()
+
+    def update_manifest(self, key_name, mp_num, etag, offset, byte_count):
+        manifest = self.resumable and self.get_manifest(key_name)
+        if manifest:
+            with self._manifest_lock:
+                manifest['parts'][str(mp_num)] = {'etag': etag, 'offset': offset, 'bytes': byte_count}
+                self.flush_manifest(False)
+
+    def remove_manifest(self, key_name):
+        if self.resumable and self.get_manifest(key_name):
+            with self._manifest_lock:
+                del self.upload_state.get('uploads')[key_name]
+                self.flush_manifest()
+
+    def resume_multipart_upload(self, file_name, key_name, file_size, md5hexes):
+        # returns the multipart upload of a previous run for this file and the etags of its uploaded parts
+        manifest = self.get_manifest(key_name)
+        if not manifest:
+            return None, {}
+        multipart          = MultiPartUpload(self.bucket)
+        multipart.id       = manifest['upload_id']
+        multipart.key_name = key_name
+        if manifest['file_size'] != file_size or manifest['file_mtime'] != int(os.stat(file_name).st_mtime) or manifest['chunk_bytes'] != self.chunk_bytes:
+            logging.info("File %s or chunk size changed since multipart upload %s was started, not resuming it" % (file_name, multipart.id))
+            try:
+                multipart.cancel_upload()
+            except S3ResponseError:
+                pass
+            return None, {}
+        try:
+            listed = {}
+            for part in boto.s3.multipart.part_lister(multipart):
+                listed[part.part_number] = (part.etag.strip('"'), part.size)
+        except S3ResponseError, e:
+            logging.info("Cannot resume multipart upload %s for s3://%s%s, starting a new upload: %s" % (multipart.id, self.bucket_name, key_name, e))
+            return None, {}
+        uploaded = {}
+        for part_num in manifest['parts']:
+            part = manifest['parts'][part_num]
+            # the etag of a part is its md5, it must match the local chunk too
+            etag = part['etag'].strip('"')
+            if listed.get(int(part_num)) == (etag, part['bytes']) and md5hexes[int(part_num) - 1] == etag:
+                uploaded[int(part_num)] = part['etag']
+        return multipart, uploaded
+
+    def abort_multipart_upload(self, multipart):
+        # parts of incomplete multipart uploads are stored (and billed) until the upload is aborted
+        logging.info("Aborting multipart upload %s of s3://%s%s" % (multipart.id, self.bucket_name, multipart.key_name))
+        try:
+            multipart.cancel_upload()
+        except S3ResponseError, e:
+            logging.error("Cannot abort multipart upload %s of s3://%s%s, abort it to remove its uploaded parts: %s" % (
+                multipart.id,
+                self.bucket_name,
+                multipart.key_name,
+                e
+            ))
+        self.remove_manifest(multipart.key_name)
+
     def cancel_multipart_uploads(self):
+        if self.resumable and self.keep_incomplete:
+            if len(self.incomplete()):
+                logging.info("Keeping incomplete multipart uploads to be resumed, see: %s" % self.upload_state.state_file)
+            self.flush_manifest()
+            return
         if len(self._mp_uploads):
             for file_name in self._mp_uploads:
                 mp_upload = self._mp_uploads[file_name]
                 if not mp_upload["complete"]:
                     logging.info("Cancelling multipart upload: %s" % file_name)
-                    mp_upload["upload"].cancel_upload()
+                    self.abort_multipart_upload(mp_upload["upload"])
                     mp_upload["complete"] = True
+        if self.resumable:
+            # uploads kept by earlier attempts that this attempt did not get to
+            for key_name, manifest in self.upload_state.get('uploads').items():
+                if self.key_prefixes and not key_name.startswith(tuple(self.key_prefixes)):
+                    continue
+                multipart          = MultiPartUpload(self.bucket)
+                multipart.id       = manifest['upload_id']
+                multipart.key_name = key_name
+                self.abort_multipart_upload(multipart)
 
     def is_dir_empty(self, dir_name):
         if os.path.isdir(dir_name):
@@ -117,6 +235,26 @@ class S3UploadPool():
             except Exception:
                 logging.exception("Unable to set ACLs on uploaded key: {}.".format(key_name))
 
+    def copy(self, file_name, key_name, src_key_name):
+        # server-side copy of a key with the same data as the file, False when there is no such key of the same size
+        file_size = self.get_file_size(file_name)
+        if file_size > self.copy_max_bytes:
+            return False
+        try:
+            src_key = self.bucket.get_key(src_key_name)
+            if not src_key or src_key.size != file_size:
+                logging.debug("No key s3://%s%s of %i bytes to copy, uploading %s" % (self.bucket_name, src_key_name, file_size, file_name))
+                return False
+            logging.info("Copying s3://%s%s to s3://%s%s" % (self.bucket_name, src_key_name, self.bucket_name, key_name))
+            self.bucket.copy_key(key_name, self.bucket_name, src_key_name)
+        except S3ResponseError, e:
+            logging.warning("Cannot copy s3://%s%s, uploading %s: %s" % (self.bucket_name, src_key_name, file_name, e))
+            return False
+        self.set_key_acl(key_name)
+        if self.remove_uploaded:
+            self.remove_file(file_name)
+        return True
+
     def get_uploaded_multiparts(self, file_name, key_name):
         logging.debug("Getting completed upload parts for s3://%s%s" % (self.bucket_name, key_name))
         mp    = self.get_multipart_upload(file_name, key_name)
@@ -129,6 +267,9 @@ class S3UploadPool():
         if file_name in self._uploads:
             upload = self._uploads[file_name]
             if 'multipart' in upload and upload['multipart']:
+                # parts complete while later parts are still being added
+                if len(upload['parts']) < upload['part_count']:
+                    return False
                 for part in upload['parts']:
                     if not upload['parts'][part]['complete']:
                         return False
@@ -144,21 +285,46 @@ class S3UploadPool():
                 logging.debug("Completing multipart upload for key: s3://%s%s" % (self.bucket_name, key_name))
                 multipart = self.get_multipart_upload(file_name, key_name)
                 if multipart:
-                    multipart.complete_upload()
+                    self.verify_etag(key_name, multipart.complete_upload().etag, get_etag(upload['md5hexes'], True))
                     self._mp_uploads[file_name]["complete"] = True
                     upload['complete'] = True
+                    self.remove_manifest(key_name)
                     self.set_key_acl(key_name)
                     if self.remove_uploaded:
                         self.remove_file(file_name)
                     logging.info("Uploaded AWS S3 key successfully: s3://%s%s" % (self.bucket_name, key_name))
 
+    def verify_etag(self, key_name, s3_etag, file_etag):
+        if s3_etag and s3_etag.strip('"') != file_etag:
+            raise OperationError("Checksum of s3://%s%s does not match the local checksum after upload (local: %s, s3: %s)!" % (
+                self.bucket_name,
+                key_name,
+                file_etag,
+                s3_etag.strip('"')
+            ))
+        logging.debug("Verified checksum of s3://%s%s: %s" % (self.bucket_name, key_name, file_etag))
+
+    def in_flight(self):
+        return len(self._pending)
+
+    def completed(self):
+        return self._completed
+
     def complete(self, output_tuple):
-        file_name, key_name, mp_num = output_tuple
+        file_name, key_name, mp_num, etag, error = output_tuple
+        del self._pending[(file_name, mp_num)]
+        if error:
+            logging.error("Got error from upload pool thread for s3://%s%s (multipart: %s): %s" % (self.bucket_name, key_name, mp_num, error))
+            self.cancel_multipart_uploads()
+            raise OperationError(error)
+        self._completed += 1
         if file_name:
             upload = self._uploads[file_name]
             logging.debug("Got success callback for upload: s3://%s%s (multipart: %s)" % (self.bucket_name, key_name, mp_num))
             if mp_num and "parts" in upload and mp_num in upload["parts"]:
-                upload["parts"][mp_num]["complete"] = True
+                part = upload["parts"][mp_num]
+                part["complete"] = True
+                self.update_manifest(key_name, mp_num, etag, part["offset"], part["bytes"])
                 self.complete_multipart(file_name, key_name)
             else:
                 upload["complete"] = True
@@ -182,9 +348,9 @@ class S3UploadPool():
             logging.error("Upload file does not exist (or is not a file): %s" % file_name)
             raise OperationError("Upload file does not exist (or is not a file)!")
 
-    def start(self, file_name, key_name, byte_count, mp_id=None, mp_num=None, mp_parts=None, mp_offset=None):
+    def start(self, file_name, key_name, byte_count, mp_id=None, mp_num=None, mp_parts=None, mp_offset=None, md5hex=None):
         logging.debug("Adding to pool: s3://%s%s (multipart: %s)" % (self.bucket_name, key_name, mp_num))
-        return self._pool.apply_async(
+        self._pending[(file_name, mp_num)] = self._pool.apply_async(
             S3UploadThread(
                 self.bucket_name,
                 self.region,
@@ -193,59 +359,88 @@ class S3UploadPool():
                 file_name,
                 key_name,
                 byte_count,
-                self.target_bandwidth,
                 mp_id,
                 mp_num,
                 mp_parts,
-                mp_offset
+                mp_offset,
+                md5hex=md5hex
             ).run,
-            callback=self.complete
+            callback=self._completions.put
         )
 
-    def upload_multipart(self, file_name, key_name, file_size):
+    def upload_multipart(self, file_name, key_name, file_size, chunks, md5hexes):
         if file_name not in self._uploads:
             self._uploads[file_name] = {
                 "complete":  False,
                 "multipart": True,
                 "parts":     {},
+                "md5hexes":  md5hexes
             }
         part_num    = 0
-        chunk_count = int(ceil(file_size / float(self.chunk_bytes)))
-        mp_upload   = self.get_multipart_upload(file_name, key_name)
-        for i in range(chunk_count):
-            self.check_uploads()
-            offset     = self.chunk_bytes * i
-            part_num  += 1
-            byte_count = min(self.chunk_bytes, file_size - offset)
-            result     = self.start(file_name, key_name, byte_count, mp_upload.id, part_num, chunk_count, offset)
+        chunk_count = len(chunks)
+        mp_upload   = None
+        self._uploads[file_name]['part_count'] = chunk_count
+        uploaded    = {}
+        if self.resumable:
+            mp_upload, uploaded = self.resume_multipart_upload(file_name, key_name, file_size, md5hexes)
+        if mp_upload:
+            logging.info("Resuming multipart upload s3://%s%s, %i/%i parts already uploaded" % (
+                self.bucket_name, key_name, len(uploaded), chunk_count
+            ))
+            self._mp_uploads[file_name] = {"upload": mp_upload, "complete": False}
+        else:
+            mp_upload = self.get_multipart_upload(file_name, key_name)
+            self.start_manifest(file_name, key_name, file_size, mp_upload.id)
+        for offset, byte_count in chunks:
+            part_num += 1
+            if part_num in uploaded:
+                self._uploads[file_name]['parts'][part_num] = {
+                    "complete": True,
+                    "offset":   offset,
+                    "bytes":    byte_count
+                }
+                continue
             self._uploads[file_name]['parts'][part_num] = {
                 "complete": False,
-                "result":   result
+                "offset":   offset,
+                "bytes":    byte_count
             }
+            self.check_uploads()
+            self.start(file_name, key_name, byte_count, mp_upload.id, part_num, chunk_count, offset, md5hexes[part_num - 1])
+        # all parts may have been uploaded by a previous run
+        self.complete_multipart(file_name, key_name)
 
-    def upload(self, file_name, key_name):
+    def upload(self, file_name, key_name, checksum=None):
+        # the part md5s give the ETag for the existing key check and are sent as Content-MD5 of the parts,
+        # they are taken from the checksum of the file if it has the md5s of the same chunks
+        file_size = self.get_file_size(file_name)
+        multipart = file_size >= self.multipart_min_bytes and file_size >= self.chunk_bytes
+        chunks    = [(0, file_size)]
+        if multipart:
+            chunks = get_chunks(file_size, self.chunk_bytes)
+        md5hexes = checksum_md5hexes(checksum, file_name, self.chunk_bytes, multipart)
+        if not md5hexes:
+            md5hexes = self._etag.md5hexes(file_name, chunks)
         if self.s3_exists(key_name):
-            s3_md5hex   = self.s3_md5hex(key_name)
-            file_md5hex = file_md5hash(file_name)
-            if s3_md5hex and file_md5hex == s3_md5hex:
-                logging.warning("Key %s already exists with same checksum (%s), skipping" % (key_name, s3_md5hex))
+            s3_etag   = self.s3_md5hex(key_name)
+            file_etag = get_etag(md5hexes, multipart)
+            if s3_etag and file_etag == s3_etag:
+                logging.warning("Key %s already exists with same checksum (%s), skipping" % (key_name, s3_etag))
                 return
             else:
                 logging.debug("Key %s already exists but the local file checksum differs (local:%s, s3:%s). Re-uploading" % (
                     key_name,
-                    file_md5hex,
-                    s3_md5hex
+                    file_etag,
+                    s3_etag
                 ))
-        file_size = self.get_file_size(file_name)
-        if file_size >= self.multipart_min_bytes and file_size >= self.chunk_bytes:
-            self.upload_multipart(file_name, key_name, file_size)
+        if multipart:
+            self.upload_multipart(file_name, key_name, file_size, chunks, md5hexes)
         else:
-            result = self.start(file_name, key_name, file_size)
             self._uploads[file_name] = {
                 "complete":  False,
-                "multipart": False,
-                "result":    result
+                "multipart": False
             }
+            self.start(file_name, key_name, file_size, md5hex=md5hexes[0])
 
     def incomplete(self):
         incomplete = {}
@@ -256,33 +451,40 @@ class S3UploadPool():
             incomplete[file_name] = upload
         return incomplete
 
-    def check_upload(self, upload, poll_secs=0.5):
-        if 'result' in upload:
+    def check_failed(self):
+        # uploads return their errors, this only catches pool processes failing outside of an upload
+        for upload in self._pending:
+            result = self._pending[upload]
+            if result.ready() and not result.successful():
+                try:
+                    result.get()
+                except Exception, e:
+                    logging.error("Got error from upload pool thread: %s" % e)
+                    self.cancel_multipart_uploads()
+                    raise OperationError(e)
+
+    def check_uploads(self):
+        while True:
             try:
-                output = upload['result'].get(poll_secs)
-                if output:
-                    return output
-            except TimeoutError:
-                pass
-            except Exception as e:
-                logging.error("Got error from upload pool thread: %s" % e)
-                self.cancel_multipart_uploads()
-                raise e
-
-    def check_uploads(self, poll_secs=0.5):
-        for file_name in self._uploads:
-            upload = self._uploads[file_name]
-            if 'multipart' in upload and upload['multipart']:
-                for part_num in upload['parts']:
-                    part = upload['parts'][part_num]
-                    self.check_upload(part, poll_secs)
-            else:
-                self.check_upload(upload, poll_secs)
-
-    def wait(self, poll_secs=0.5):
+                self.complete(self._completions.get_nowait())
+            except Empty:
+                break
+
+    def wait(self, poll_secs=1, status_secs=30):
+        logging.debug("Waiting for upload pool to complete %d uploads" % len(self.incomplete()))
+        status_time = time()
+        while len(self._pending) > 0:
+            try:
+                self.complete(self._completions.get(True, poll_secs))
+            except Empty:
+                self.check_failed()
+            if time() - status_time >= status_secs:
+                logging.info("AWS S3 upload progress: %i upload(s)/part(s) completed, %i in flight, %i file(s) remaining" % (
+                    self.completed(),
+                    self.in_flight(),
+                    len(self.incomplete())
+                ))
+                status_time = time()
         incomplete = self.incomplete()
-        logging.debug("Waiting for upload pool to complete %d uploads" % len(incomplete))
-        while len(incomplete):
-            self.check_uploads()
-            incomplete = self.incomplete()
-            sleep(poll_secs)
+        if len(incomplete) > 0:
+            raise OperationError("Upload of file(s) did not complete: %s" % ", ".join(incomplete.keys()))
@@ -4,13 +4,15 @@ import logging
 import socket
 
 from boto.s3.key import Key
+from boto.s3.multipart import MultiPartUpload
 from filechunkio import FileChunkIO
 from progress.bar import Bar
 from time import sleep
-from time import time
 
-from S3Session import S3Session
+from S3ETag import get_content_md5
+from S3Session import get_session_bucket, reset_session_bucket
 
+from mongodb_consistent_backup.Common import consume_rate_limit, is_rate_limited
 from mongodb_consistent_backup.Errors import OperationError
 
 
@@ -29,8 +31,8 @@ class S3ProgressBar(Bar):
 
 
 class S3UploadThread:
-    def __init__(self, bucket_name, region, access_key, secret_key, file_name, key_name, byte_count, target_bandwidth, multipart_id=None,
-                 multipart_num=None, multipart_parts=None, multipart_offset=None, retries=5, secure=True, retry_sleep_secs=1):
+    def __init__(self, bucket_name, region, access_key, secret_key, file_name, key_name, byte_count, multipart_id=None,
+                 multipart_num=None, multipart_parts=None, multipart_offset=None, retries=5, secure=True, retry_sleep_secs=1, md5hex=None):
         self.bucket_name      = bucket_name
         self.region           = region
         self.access_key       = access_key
@@ -38,7 +40,6 @@ class S3UploadThread:
         self.file_name        = file_name
         self.key_name         = key_name
         self.byte_count       = byte_count
-        self.target_bandwidth = target_bandwidth
         self.multipart_id     = multipart_id
         self.multipart_num    = multipart_num
         self.multipart_parts  = multipart_parts
@@ -46,24 +47,33 @@ class S3UploadThread:
         self.retries          = retries
         self.secure           = secure
         self.retry_sleep_secs = retry_sleep_secs
+        self.md5hex           = md5hex
         self.do_stop          = False
+        self.rate_limits      = ("upload", "s3")
+        self.rate_limited     = is_rate_limited(*self.rate_limits)
 
-        if self.target_bandwidth is not None:
-            logging.debug("Target bandwidth: %.2f" % self.target_bandwidth)
         progress_key_name = self.short_key_name(self.key_name)
         if self.multipart_num and self.multipart_parts:
             progress_key_name = "%s %d/%d" % (self.short_key_name(self.key_name), self.multipart_num, self.multipart_parts)
         self._progress    = S3ProgressBar(progress_key_name, max=float(self.byte_count / 1024.00 / 1024.00))
         self._last_bytes  = None
-        self._last_status_ts = None
+        self.bucket       = None
 
+    def get_bucket(self):
+        # the connection is created in, and reused by, the pool process running the upload
         try:
-            self.s3_conn = S3Session(self.region, self.access_key, self.secret_key, self.bucket_name, self.secure, self.retries)
-            self.bucket  = self.s3_conn.get_bucket(self.bucket_name)
+            return get_session_bucket(self.region, self.access_key, self.secret_key, self.bucket_name, self.secure, self.retries)
         except Exception, e:
             logging.fatal("Could not get AWS S3 connection to bucket %s! Error: %s" % (self.bucket_name, e))
             raise OperationError("Could not get AWS S3 connection to bucket")
 
+    def get_multipart_upload(self):
+        # parts are uploaded to the upload id directly, without listing the multipart uploads of the bucket
+        multipart          = MultiPartUpload(self.bucket)
+        multipart.id       = self.multipart_id
+        multipart.key_name = self.key_name
+        return multipart
+
     def close(self, code=None, frame=None):
         self.do_stop = True
 
@@ -77,6 +87,12 @@ class S3UploadThread:
         else:
             return key_name
 
+    def callback_count(self):
+        if self.rate_limited:
+            # request a callback every 0.5MB, rate limits are applied in the callback
+            return max(10, int(self.byte_count / 1024 / 1024 / 0.5))
+        return 10
+
     def status(self, bytes_uploaded, bytes_total):
         self._progress.max = float(bytes_total / 1024.00 / 1024.00)
         update_bytes = bytes_uploaded
@@ -85,54 +101,30 @@ class S3UploadThread:
         if update_bytes > 0:
             self._progress.next(float(update_bytes / 1024.00 / 1024.00))
         self._last_bytes = bytes_uploaded
-        if self.target_bandwidth is not None:
-            self.throttle(update_bytes)
-
-    def throttle(self, update_bytes):
-        if self._last_status_ts:
-            current_ts = float(time())
-            duration = current_ts - self._last_status_ts
-            logging.debug("Transferred %d bytes in %.2f seconds" % (update_bytes, duration))
-            actual_bytes_per_second = float(update_bytes / duration)
-            target_bytes_per_second = self.target_bandwidth
-            bps_factor = actual_bytes_per_second / target_bytes_per_second
-            if bps_factor > 1.0:
-                logging.debug("Actual speed is %.2f bytes/s vs target speed %.0f bytes/s. "
-                              "This is %.2f times too fast." % (actual_bytes_per_second, target_bytes_per_second,
-                                                                bps_factor))
-                throttle_secs_computed = float(duration * bps_factor)
-                throttle_secs_ceiling = 3
-                throttle_secs = min(throttle_secs_computed, throttle_secs_ceiling)
-                logging.debug("Sleeping for %.2fs (but %.2fs at most), trying to approximate target bandwidth." % (
-                    throttle_secs_computed, throttle_secs_ceiling))
-                sleep(throttle_secs)
-        self._last_status_ts = float(time())
+        if self.rate_limited:
+            consume_rate_limit(update_bytes, *self.rate_limits)
 
     def run(self):
         try:
             tries     = 0
             exception = None
+            etag      = None
             while tries < self.retries:
                 if self.do_stop:
                     break
                 try:
+                    self.bucket = self.get_bucket()
                     if self.multipart_id and self.multipart_num and self.multipart_parts:
                         mp_log_info = "s3://%s%s (multipart: %d/%d, size: %.2fmb)" % (
                             self.bucket_name, self.short_key_name(self.key_name), self.multipart_num,
                             self.multipart_parts, float(self.byte_count / 1024.00 / 1024.00))
-                        for mp in self.bucket.get_all_multipart_uploads():
-                            if mp.id == self.multipart_id:
-                                logging.info("Uploading AWS S3 key: %s" % mp_log_info)
-                                callback_count = 10
-                                if self.target_bandwidth is not None:
-                                    # request a callback every 0.5MB to allow for somewhat decent throttling
-                                    callback_count = self.byte_count / 1024 / 1024 / 0.5
-                                with FileChunkIO(self.file_name, 'r', offset=self.multipart_offset, bytes=self.byte_count) as fp:
-                                    mp.upload_part_from_file(fp=fp, cb=self.status, num_cb=callback_count, part_num=self.multipart_num)
-                                break
-                        else:
-                            raise OperationError("Missing multipart upload id %s for %s in S3 response." %
-                                                 (self.multipart_id, mp_log_info))
+                        logging.info("Uploading AWS S3 key: %s" % mp_log_info)
+                        callback_count = self.callback_count()
+                        multipart = self.get_multipart_upload()
+                        with FileChunkIO(self.file_name, 'r', offset=self.multipart_offset, bytes=self.byte_count) as fp:
+                            part = multipart.upload_part_from_file(fp=fp, cb=self.status, num_cb=callback_count, part_num=self.multipart_num,
+                                                                   md5=get_content_md5(self.md5hex))
+                            etag = part.etag
                     else:
                         key = None
                         try:
@@ -141,25 +133,26 @@ class S3UploadThread:
                                 float(self.byte_count / 1024.00 / 1024.00)
                             ))
                             key = Key(bucket=self.bucket, name=self.key_name)
-                            callback_count = 10
-                            if self.target_bandwidth is not None:
-                                # request a callback every 0.5MB to allow for somewhat decent throttling
-                                callback_count = self.byte_count / 1024.00 / 1024.00 / 0.5
-                            key.set_contents_from_filename(self.file_name, cb=self.status, num_cb=callback_count)
+                            callback_count = self.callback_count()
+                            key.set_contents_from_filename(self.file_name, cb=self.status, num_cb=callback_count, md5=get_content_md5(self.md5hex))
                         finally:
                             if key:
                                 key.close()
+                    exception = None
                     break
                 except (httplib.HTTPException, exceptions.IOError, socket.error, socket.gaierror) as e:
                     logging.error("Got exception during upload: '%s', retrying upload" % e)
                     exception = e
-                finally:
+                    # reconnect on the next try
+                    reset_session_bucket(self.region, self.access_key, self.secret_key, self.bucket_name, self.secure)
                     sleep(self.retry_sleep_secs)
+                finally:
                     tries += 1
             if tries >= self.retries and exception:
                 raise exception
         except Exception as e:
+            # errors are returned to the pool's completion callback, as exceptions are not
             logging.fatal("AWS S3 upload failed after %i retries! Error: %s" % (self.retries, e))
-            raise e
+            return self.file_name, self.key_name, self.multipart_num, None, str(e)
 
-        return self.file_name, self.key_name, self.multipart_num
+        return self.file_name, self.key_name, self.multipart_num, etag, None
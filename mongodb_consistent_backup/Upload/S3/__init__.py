@@ -20,8 +20,14 @@ def config(parser):
                         help="S3 Uploader explicit storage key within the S3 bucket")
     parser.add_argument("--upload.s3.chunk_size_mb", dest="upload.s3.chunk_size_mb", default=50, type=int,
                         help="S3 Uploader upload chunk size, in megabytes (default: 50)")
+    parser.add_argument("--upload.s3.max_inflight_parts", dest="upload.s3.max_inflight_parts", default=4, type=int,
+                        help="S3 Uploader maximum number of multipart chunks held in memory per streamed archive (default: 4)")
+    parser.add_argument("--upload.s3.resumable", dest="upload.s3.resumable", default=False, action="store_true",
+                        help="S3 Uploader keeps incomplete multipart uploads in the backup state and resumes them when "
+                             "retrying a failed upload, up to 'upload.retries' times. Uploads still incomplete after the "
+                             "last attempt are aborted (default: false)")
     parser.add_argument("--upload.s3.target_mb_per_second", dest="upload.s3.target_mb_per_second", default=None,
-                        type=int, help="S3 Uploader target bandwidth in MB/s per upload thread. (default: unlimited)")
+                        type=int, help="S3 Uploader target bandwidth in MB/s for all upload threads. (default: unlimited)")
     parser.add_argument("--upload.s3.secure", dest="upload.s3.secure", default=True, action="store_false",
                         help="S3 Uploader connect over SSL (default: true)")
     parser.add_argument("--upload.s3.acl", dest="upload.s3.acl", default=None, type=str,
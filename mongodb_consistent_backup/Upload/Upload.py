@@ -1,6 +1,9 @@
+from mongodb_consistent_backup.Upload.Dedup import Dedup  # NOQA
 from mongodb_consistent_backup.Upload.Gs import Gs  # NOQA
+from mongodb_consistent_backup.Upload.Local import Local  # NOQA
 from mongodb_consistent_backup.Upload.S3 import S3  # NOQA
 from mongodb_consistent_backup.Upload.Rsync import Rsync  # NOQA
+from mongodb_consistent_backup.Common import RateLimiter, register_rate_limiter
 from mongodb_consistent_backup.Pipeline import Stage
 
 
@@ -8,4 +11,10 @@ class Upload(Stage):
     def __init__(self, manager, config, timer, base_dir, backup_dir):
         super(Upload, self).__init__(self.__class__.__name__, manager, config, timer, base_dir, backup_dir)
         self.task = self.config.upload.method
+        self.init_rate_limiter()
         self.init()
+
+    def init_rate_limiter(self):
+        # created before any upload/archive process is forked, to be shared by all of them
+        bandwidth = self.config.upload.bandwidth
+        register_rate_limiter("upload", RateLimiter(bandwidth.mb_per_second * 1024 * 1024, bandwidth.schedule))
@@ -2,6 +2,13 @@ import os
 import re
 import logging
 
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from mongodb_consistent_backup.Common import file_checksum_job, get_checksum_chunk_bytes, is_checksum_current
+from mongodb_consistent_backup.Errors import OperationError
+from mongodb_consistent_backup.State import StateChecksums, StateCollections
+
 
 def get_upload_files(backup_dir, regex=None):
     upload_files = []
@@ -23,3 +30,68 @@ def get_upload_files(backup_dir, regex=None):
             else:
                 upload_files.append(os.path.join(root, f))
     return upload_files
+
+
+def get_s3_key_name(bucket_prefix, key_prefix, rel_path, explicit_key=None):
+    if explicit_key:
+        return explicit_key
+    elif bucket_prefix == "/":
+        return "/%s/%s" % (key_prefix, rel_path)
+    return "%s/%s/%s" % (bucket_prefix, key_prefix, rel_path)
+
+
+def get_checksums(backup_dir, config, file_paths, unit=None, threads=None):
+    # checksums of the files to upload by path relative to the backup dir. Files the archive stage did not
+    # hash (or archiving is disabled) are hashed here, once for all uploads. META files change and are skipped
+    state     = StateChecksums(backup_dir, config, unit)
+    checksums = state.load_files()
+    missing   = []
+    for file_path in file_paths:
+        rel_path = os.path.relpath(file_path, backup_dir)
+        if rel_path.split(os.sep)[0] != state.meta_name and not is_checksum_current(checksums.get(rel_path), file_path):
+            missing.append(file_path)
+    if len(missing) > 0:
+        logging.info("Computing checksums of %i file(s) to upload" % len(missing))
+        chunk_bytes = get_checksum_chunk_bytes(config)
+        pool        = Pool(processes=threads)
+        try:
+            results = pool.map(file_checksum_job, [(file_path, chunk_bytes) for file_path in missing])
+            pool.close()
+        except Exception, e:
+            pool.terminate()
+            raise OperationError("Cannot compute checksums of files to upload! Error: %s" % e)
+        finally:
+            pool.join()
+        for file_path, checksum in results:
+            rel_path = os.path.relpath(file_path, backup_dir)
+            checksums[rel_path] = checksum
+            state.add_file(rel_path, checksum)
+        state.write()
+    return checksums
+
+
+def copy_reused_files(backup_dir, config, file_paths, copy, source_name, threads=1):
+    # server-side copies of the files of collections reused from a previous backup, from the uploaded files
+    # of that backup. 'source_name' gives the key of a file path in the previous backup, 'copy' copies a file
+    # path from that key and returns False if it could not. The file paths that were not copied are returned
+    reused = StateCollections(backup_dir, config).load_reused_files()
+    jobs   = []
+    for file_path in file_paths:
+        rel_path = os.path.relpath(file_path, backup_dir)
+        if rel_path in reused:
+            jobs.append((file_path, source_name(reused[rel_path], rel_path)))
+    if len(jobs) == 0:
+        return file_paths
+    logging.info("Copying %i file(s) of reused collections from previous backup(s)" % len(jobs))
+    pool = ThreadPool(processes=threads)
+    try:
+        copied = pool.map(lambda job: copy(*job) and job[0], jobs)
+        pool.close()
+    except Exception, e:
+        pool.terminate()
+        raise OperationError("Cannot copy files of reused collections! Error: %s" % e)
+    finally:
+        pool.join()
+    copied = set(filter(None, copied))
+    logging.info("Copied %i of %i file(s) of reused collections, uploading the others" % (len(copied), len(jobs)))
+    return [file_path for file_path in file_paths if file_path not in copied]
@@ -2,7 +2,7 @@ from Upload import Upload  # NOQA
 
 
 def config(parser):
-    parser.add_argument("--upload.method", dest="upload.method", default='none', choices=['gs', 'rsync', 's3', 'none'],
+    parser.add_argument("--upload.method", dest="upload.method", default='none', choices=['dedup', 'gs', 'local', 'rsync', 's3', 'none'],
                         help="Uploader method (default: none)")
     parser.add_argument("--upload.remove_uploaded", dest="upload.remove_uploaded", default=False, action="store_true",
                         help="Remove source files after successful upload (default: false)")
@@ -10,6 +10,11 @@ def config(parser):
                         help="Number of times to retry upload attempts (default: 5)")
     parser.add_argument("--upload.threads", dest="upload.threads", default=4, type=int,
                         help="Number of threads to use for upload (default: 4)")
+    parser.add_argument("--upload.bandwidth.mb_per_second", dest="upload.bandwidth.mb_per_second", default=0, type=float,
+                        help="Limit the combined bandwidth of all upload threads, in megabytes per second (default: 0 - unlimited)")
+    parser.add_argument("--upload.bandwidth.schedule", dest="upload.bandwidth.schedule", default='none', type=str,
+                        help="Upload bandwidth limits by local time of day as 'HH:MM-HH:MM=MB[,...]', the "
+                             "'mb_per_second' limit applies outside of these windows (default: none)")
     parser.add_argument("--upload.file_regex", dest="upload.file_regex", default='none', type=str,
                         help="Limit uploaded file names to those matching a regular expression. (default: none)")
     return parser
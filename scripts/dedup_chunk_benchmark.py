@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#
+# Compares the dedup Chunker against only hashing a mongodump-like .bson
+# file, checks that the chunks cover the file and that inserting documents
+# only changes the chunks around them.
+#
+# Usage: python scripts/dedup_chunk_benchmark.py [--file dump.bson] [--count N] [--payload-bytes N] [--avg-chunk-kb N]
+#
+# Without --file a synthetic collection is written to a temporary directory.
+
+import os
+import sys
+import tempfile
+
+from argparse import ArgumentParser
+from bson import BSON
+from hashlib import sha256
+from shutil import rmtree
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mongodb_consistent_backup.Upload.Dedup.Chunker import Chunker  # NOQA
+
+
+def write_collection(bson_file, count, payload_bytes, insert_every=0):
+    # 'insert_every' adds an extra document after every N documents, as inserts between two backups
+    with open(bson_file, "wb") as f:
+        for i in xrange(count):
+            payload = sha256(str(i)).hexdigest() * (payload_bytes / 64 + 1)
+            f.write(BSON.encode({"_id": i, "payload": payload[:payload_bytes], "n": i}))
+            if insert_every and i % insert_every == 0:
+                f.write(BSON.encode({"_id": "inserted-%i" % i, "payload": "y" * payload_bytes}))
+
+
+def chunk_file(bson_file, avg_bytes):
+    chunks = []
+    with open(bson_file, "rb") as f:
+        for chunk in Chunker(avg_bytes).chunks(f):
+            chunks.append(chunk)
+    return chunks
+
+
+def hash_file(bson_file, read_bytes=8 * 1024 * 1024):
+    # the sha256 of the chunks bounds the chunker speed
+    checksum = sha256()
+    with open(bson_file, "rb") as f:
+        while True:
+            data = f.read(read_bytes)
+            if not data:
+                break
+            checksum.update(data)
+    return checksum.hexdigest()
+
+
+def check_chunks(bson_file, chunks):
+    # the chunks are contiguous, cover the whole file and have the sha256 of their data
+    offset = 0
+    with open(bson_file, "rb") as f:
+        for chunk_offset, length, sha in chunks:
+            if chunk_offset != offset or sha256(f.read(length)).hexdigest() != sha:
+                return False
+            offset += length
+    return offset == os.path.getsize(bson_file)
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark the dedup chunker")
+    parser.add_argument("--file", dest="file", default=None, help="Existing .bson file to chunk (default: synthetic collection)")
+    parser.add_argument("--count", dest="count", default=500000, type=int, help="Documents in the synthetic collection (default: 500000)")
+    parser.add_argument("--payload-bytes", dest="payload_bytes", default=512, type=int, help="Payload size of synthetic documents (default: 512)")
+    parser.add_argument("--avg-chunk-kb", dest="avg_chunk_kb", default=1024, type=int, help="Average chunk size in kilobytes (default: 1024)")
+    parser.add_argument("--insert-every", dest="insert_every", default=5000, type=int,
+                        help="Documents between inserts of the changed synthetic collection (default: 5000)")
+    args = parser.parse_args()
+
+    tmp_dir   = None
+    bson_file = args.file
+    avg_bytes = args.avg_chunk_kb * 1024
+    try:
+        if not bson_file:
+            tmp_dir   = tempfile.mkdtemp()
+            bson_file = os.path.join(tmp_dir, "collection.bson")
+            print("Writing %i synthetic documents to %s" % (args.count, bson_file))
+            write_collection(bson_file, args.count, args.payload_bytes)
+        size = os.path.getsize(bson_file)
+        print("File size: %i bytes" % size)
+
+        start = time()
+        hash_file(bson_file)
+        duration = max(time() - start, 0.001)
+        print("sha256 only:       %10s        in %8.3f secs (%.2f MB/sec)" % ("", duration, size / duration / 1024 / 1024))
+
+        start    = time()
+        chunks   = chunk_file(bson_file, avg_bytes)
+        duration = max(time() - start, 0.001)
+        print("Chunker:           %10i chunks in %8.3f secs (%.2f MB/sec, average chunk: %ikb)" % (
+            len(chunks),
+            duration,
+            size / duration / 1024 / 1024,
+            size / max(len(chunks), 1) / 1024
+        ))
+        if not check_chunks(bson_file, chunks):
+            print("ERROR: chunks do not cover the file!")
+            sys.exit(1)
+
+        if tmp_dir and args.insert_every:
+            changed_file = os.path.join(tmp_dir, "changed.bson")
+            write_collection(changed_file, args.count, args.payload_bytes, args.insert_every)
+            changed = chunk_file(changed_file, avg_bytes)
+            known   = set([sha for offset, length, sha in chunks])
+            reused  = sum([length for offset, length, sha in changed if sha in known])
+            print("Changed file:      %10i chunks, %.1f%% of the data in unchanged chunks (inserts every %i documents)" % (
+                len(changed),
+                reused * 100.0 / os.path.getsize(changed_file),
+                args.insert_every
+            ))
+    finally:
+        if tmp_dir:
+            rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
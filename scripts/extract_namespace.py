@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+#
+# Extracts the dump files of one collection from an indexed archive
+# ('archive.native.format: indexed'), reading only the archive index and the
+# files of the collection. Uploaded archives are read with byte-range GETs.
+#
+# Usage: python scripts/extract_namespace.py [options] <archive|s3://bucket/key|gs://bucket/object> <db.collection> <dest dir>
+#        python scripts/extract_namespace.py [options] --list <archive|s3://bucket/key|gs://bucket/object>
+#
+# The extracted .bson and .metadata.json files can be restored with
+# 'mongorestore --nsInclude <db.collection> <dest dir>/<path>/dump'.
+
+import logging
+import os
+import sys
+
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mongodb_consistent_backup.Archive.Native.IndexedArchive import FileSource, IndexedArchiveReader, KeySource  # NOQA
+from mongodb_consistent_backup.Errors import OperationError  # NOQA
+from mongodb_consistent_backup.Upload.Gs.GsSession import get_session_bucket as get_gs_bucket  # NOQA
+from mongodb_consistent_backup.Upload.S3.S3Session import get_session_bucket as get_s3_bucket  # NOQA
+
+
+def get_source(args):
+    # a local archive file, or the key of an uploaded archive
+    if "://" not in args.archive:
+        if not os.path.isfile(args.archive):
+            raise OperationError("Archive %s does not exist or is not a file!" % args.archive)
+        return FileSource(args.archive)
+    scheme, path = args.archive.split("://", 1)
+    if "/" not in path:
+        raise OperationError("Archive URI %s has no key name!" % args.archive)
+    bucket_name, key_name = path.split("/", 1)
+    if scheme == "s3":
+        bucket = get_s3_bucket(args.region, args.access_key, args.secret_key, bucket_name)
+    elif scheme == "gs":
+        bucket = get_gs_bucket(args.access_key, args.secret_key, bucket_name)
+    else:
+        raise OperationError("Unsupported archive URI scheme: %s!" % scheme)
+    key = bucket.get_key(key_name)
+    if not key:
+        raise OperationError("Archive %s does not exist!" % args.archive)
+    return KeySource(key)
+
+
+def main():
+    parser = ArgumentParser(description="Extract the files of one collection from an indexed archive")
+    parser.add_argument("archive", help="Indexed archive file, s3://bucket/key or gs://bucket/object")
+    parser.add_argument("namespace", nargs="?", default=None, help="Namespace (db.collection) to extract")
+    parser.add_argument("dest_dir", nargs="?", default=None, help="Directory to extract the files to")
+    parser.add_argument("--list", dest="list", default=False, action="store_true", help="List the namespaces in the archive")
+    parser.add_argument("--region", dest="region", default="us-east-1", help="AWS S3 region of s3:// archives (default: us-east-1)")
+    parser.add_argument("--access-key", dest="access_key", default=None,
+                        help="AWS S3 or Google Cloud Storage access key (default: from the environment or boto config)")
+    parser.add_argument("--secret-key", dest="secret_key", default=None,
+                        help="AWS S3 or Google Cloud Storage secret key (default: from the environment or boto config)")
+    parser.add_argument("--verbose", dest="verbose", default=False, action="store_true", help="Verbose logging")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="[%(asctime)s] [%(levelname)s] %(message)s")
+    if not args.list and (not args.namespace or not args.dest_dir):
+        parser.error("a namespace and destination directory are required, unless --list is set")
+
+    try:
+        reader = IndexedArchiveReader(get_source(args))
+        if args.list:
+            for namespace in reader.namespaces():
+                print(namespace)
+            return
+        logging.info("Extracting namespace %s from %s to %s" % (args.namespace, args.archive, args.dest_dir))
+        for path in reader.extract_namespace(args.namespace, args.dest_dir):
+            logging.info("Extracted %s (%i bytes)" % (path, os.path.getsize(path)))
+    except OperationError, e:
+        logging.error("Extracting namespace failed! Error: %s" % e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+#
+# Compares counting an oplog file with bson.decode_file_iter (the previous
+# Oplog.load() path) against the length-prefix OplogScanner.
+#
+# Usage: python scripts/oplog_scan_benchmark.py [--file oplog.bson] [--gzip] [--count N] [--payload-bytes N]
+#
+# Without --file a synthetic oplog is written to a temporary directory.
+
+import os
+import sys
+import tempfile
+
+from argparse import ArgumentParser
+from bson import SON, decode_file_iter
+from bson.codec_options import CodecOptions
+from bson.timestamp import Timestamp
+from gzip import GzipFile
+from shutil import rmtree
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mongodb_consistent_backup.Oplog import Oplog, OplogScanner  # NOQA
+from mongodb_consistent_backup.Oplog.OplogScanner import get_ts  # NOQA
+
+
+def write_oplog(oplog_file, do_gzip, count, payload_bytes):
+    oplog   = Oplog(oplog_file, do_gzip, "w+", flush_docs=count + 1, flush_secs=3600)
+    payload = "x" * payload_bytes
+    batch   = []
+    for i in xrange(count):
+        # field order as written by mongod, 'ts' first
+        batch.append(SON([
+            ("ts", Timestamp(1500000000 + (i / 1000), i % 1000)),
+            ("t",  1),
+            ("h",  i),
+            ("v",  2),
+            ("op", "i"),
+            ("ns", "bench.collection"),
+            ("o",  {"_id": i, "payload": payload, "nested": {"a": i, "b": [1, 2, 3]}})
+        ]))
+        if len(batch) >= 10000:
+            oplog.add_batch(batch, False)
+            batch = []
+    oplog.add_batch(batch, False)
+    oplog.close()
+
+
+def decode_count(oplog_file, do_gzip):
+    if do_gzip:
+        f = GzipFile(oplog_file, "rb")
+    else:
+        f = open(oplog_file, "rb")
+    count   = 0
+    last_ts = None
+    for change in decode_file_iter(f, CodecOptions(unicode_decode_error_handler="ignore")):
+        if "ts" in change:
+            last_ts = change["ts"]
+        count += 1
+    f.close()
+    return count, last_ts
+
+
+def scan_count(oplog_file, do_gzip):
+    count   = 0
+    last_ts = None
+    for offset, size, ts in OplogScanner(oplog_file, do_gzip).scan():
+        if ts:
+            last_ts = ts
+        count += 1
+    return count, get_ts(last_ts)
+
+
+def timed(name, func, *args):
+    start    = time()
+    result   = func(*args)
+    duration = time() - start
+    print("%-18s %10i changes in %8.3f secs (last ts: %s)" % (name, result[0], duration, result[1]))
+    return result, duration
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark oplog file counting methods")
+    parser.add_argument("--file", dest="file", default=None, help="Existing oplog file to scan (default: synthetic oplog)")
+    parser.add_argument("--gzip", dest="gzip", default=False, action="store_true", help="Oplog file is/should be gzip compressed")
+    parser.add_argument("--count", dest="count", default=1000000, type=int, help="Changes in the synthetic oplog (default: 1000000)")
+    parser.add_argument("--payload-bytes", dest="payload_bytes", default=256, type=int, help="Payload size of synthetic changes (default: 256)")
+    args = parser.parse_args()
+
+    tmp_dir    = None
+    oplog_file = args.file
+    try:
+        if not oplog_file:
+            tmp_dir    = tempfile.mkdtemp()
+            oplog_file = os.path.join(tmp_dir, "oplog.bson")
+            print("Writing %i synthetic changes to %s" % (args.count, oplog_file))
+            write_oplog(oplog_file, args.gzip, args.count, args.payload_bytes)
+        print("Oplog file size: %i bytes" % os.path.getsize(oplog_file))
+
+        decoded, decode_secs = timed("decode_file_iter:", decode_count, oplog_file, args.gzip)
+        scanned, scan_secs   = timed("OplogScanner:", scan_count, oplog_file, args.gzip)
+        if decoded != scanned:
+            print("ERROR: results differ!")
+            sys.exit(1)
+        if scan_secs > 0:
+            print("Speedup: %.1fx" % (decode_secs / scan_secs))
+    finally:
+        if tmp_dir:
+            rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+#
+# Restores the files of a backup uploaded by the dedup uploader
+# ('upload.method: dedup'), from the recipe of the backup and the chunks in
+# the chunk store of an S3 or Google Cloud Storage bucket. The sha256 of
+# each chunk, and of each file when the recipe has it, is verified.
+#
+# Usage: python scripts/restore_dedup.py [options] <s3://bucket[/prefix]|gs://bucket[/prefix]> <backup> <dest dir>
+#        python scripts/restore_dedup.py [options] --list <s3://bucket[/prefix]|gs://bucket[/prefix]>
+#
+# <backup> is the name of a recipe, eg: 'default/20170424_0000' for the
+# recipe 'recipes/default/20170424_0000.json'. The prefix is the
+# 'bucket_prefix' of the upload.
+
+import json
+import logging
+import os
+import sys
+
+from argparse import ArgumentParser
+from hashlib import sha256
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mongodb_consistent_backup.Errors import OperationError  # NOQA
+from mongodb_consistent_backup.Upload.Gs.GsSession import get_session_bucket as get_gs_bucket  # NOQA
+from mongodb_consistent_backup.Upload.S3.S3Session import get_session_bucket as get_s3_bucket  # NOQA
+
+
+# the key layout of mongodb_consistent_backup.Upload.Dedup.DedupStore
+def key_name(prefix, *parts):
+    return "/".join(filter(None, [prefix] + list(parts)))
+
+
+def chunk_key_name(prefix, sha):
+    return key_name(prefix, "chunks", sha[:2], sha)
+
+
+def recipe_key_name(prefix, backup_name):
+    return key_name(prefix, "recipes", "%s.json" % backup_name)
+
+
+def get_store(args):
+    # the bucket and prefix of the chunk store
+    if "://" not in args.store:
+        raise OperationError("Chunk store %s is not a s3:// or gs:// URI!" % args.store)
+    scheme, path = args.store.split("://", 1)
+    bucket_name, prefix = (path.split("/", 1) + [""])[:2]
+    if scheme == "s3":
+        bucket = get_s3_bucket(args.region, args.access_key, args.secret_key, bucket_name)
+    elif scheme == "gs":
+        bucket = get_gs_bucket(args.access_key, args.secret_key, bucket_name)
+    else:
+        raise OperationError("Unsupported chunk store URI scheme: %s!" % scheme)
+    return bucket, prefix.strip("/")
+
+
+def list_backups(bucket, prefix):
+    recipes_prefix = key_name(prefix, "recipes") + "/"
+    for key in bucket.list(prefix=recipes_prefix):
+        if key.name.endswith(".json"):
+            yield key.name[len(recipes_prefix):-len(".json")]
+
+
+def get_recipe(bucket, prefix, backup_name):
+    recipe_key = recipe_key_name(prefix, backup_name)
+    key = bucket.get_key(recipe_key)
+    if not key:
+        raise OperationError("Recipe %s of backup %s does not exist!" % (recipe_key, backup_name))
+    recipe = json.loads(key.get_contents_as_string())
+    if recipe.get('version') != 1:
+        raise OperationError("Unsupported recipe version: %s!" % recipe.get('version'))
+    return recipe
+
+
+def get_chunk(bucket, prefix, sha, length):
+    chunk_key = chunk_key_name(prefix, sha)
+    key = bucket.get_key(chunk_key)
+    if not key:
+        raise OperationError("Chunk %s does not exist!" % chunk_key)
+    data = key.get_contents_as_string()
+    if len(data) != length or sha256(data).hexdigest() != sha:
+        raise OperationError("Chunk %s is corrupt, expected %i bytes with sha256 %s!" % (chunk_key, length, sha))
+    return data
+
+
+def restore_file(bucket, prefix, rel_path, entry, dest_dir):
+    # rebuilds one file of the recipe from its chunks, a file that fails verification is removed
+    file_path = os.path.normpath(os.path.join(dest_dir, rel_path))
+    if os.path.isabs(rel_path) or not file_path.startswith(os.path.join(os.path.normpath(dest_dir), "")):
+        raise OperationError("Recipe file %s is outside of the destination directory!" % rel_path)
+    if not os.path.isdir(os.path.dirname(file_path)):
+        os.makedirs(os.path.dirname(file_path))
+    checksum   = sha256()
+    byte_count = 0
+    try:
+        with open(file_path, "wb") as f:
+            for sha, length in entry['chunks']:
+                data = get_chunk(bucket, prefix, sha, length)
+                f.write(data)
+                checksum.update(data)
+                byte_count += len(data)
+        if byte_count != entry['size']:
+            raise OperationError("Restored %s has %i bytes, expected %i!" % (file_path, byte_count, entry['size']))
+        elif 'sha256' in entry and checksum.hexdigest() != entry['sha256']:
+            raise OperationError("Restored %s has sha256 %s, expected %s!" % (file_path, checksum.hexdigest(), entry['sha256']))
+    except Exception, e:
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+        raise e
+    return file_path
+
+
+def main():
+    parser = ArgumentParser(description="Restore the files of a backup uploaded by the dedup uploader")
+    parser.add_argument("store", help="Chunk store: s3://bucket[/prefix] or gs://bucket[/prefix]")
+    parser.add_argument("backup", nargs="?", default=None, help="Backup to restore, the name of its recipe")
+    parser.add_argument("dest_dir", nargs="?", default=None, help="Directory to restore the files to")
+    parser.add_argument("--list", dest="list", default=False, action="store_true", help="List the backups in the chunk store")
+    parser.add_argument("--region", dest="region", default="us-east-1", help="AWS S3 region of s3:// chunk stores (default: us-east-1)")
+    parser.add_argument("--access-key", dest="access_key", default=None,
+                        help="AWS S3 or Google Cloud Storage access key (default: from the environment or boto config)")
+    parser.add_argument("--secret-key", dest="secret_key", default=None,
+                        help="AWS S3 or Google Cloud Storage secret key (default: from the environment or boto config)")
+    parser.add_argument("--verbose", dest="verbose", default=False, action="store_true", help="Verbose logging")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="[%(asctime)s] [%(levelname)s] %(message)s")
+    if not args.list and (not args.backup or not args.dest_dir):
+        parser.error("a backup and destination directory are required, unless --list is set")
+
+    try:
+        bucket, prefix = get_store(args)
+        if args.list:
+            for backup_name in list_backups(bucket, prefix):
+                print(backup_name)
+            return
+        recipe = get_recipe(bucket, prefix, args.backup)
+        logging.info("Restoring %i file(s) of backup %s from %s to %s" % (len(recipe['files']), args.backup, args.store, args.dest_dir))
+        for rel_path in sorted(recipe['files']):
+            entry     = recipe['files'][rel_path]
+            file_path = restore_file(bucket, prefix, rel_path, entry, args.dest_dir)
+            verified  = "size"
+            if 'sha256' in entry:
+                verified = "sha256"
+            logging.info("Restored %s (%i bytes, %i chunks, verified %s)" % (file_path, entry['size'], len(entry['chunks']), verified))
+    except (OperationError, IOError, OSError), e:
+        logging.error("Restoring backup failed! Error: %s" % e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
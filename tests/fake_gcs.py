@@ -0,0 +1,118 @@
+from boto.exception import GSResponseError
+from hashlib import md5
+from threading import Lock
+from zlib import crc32
+
+
+# An in-process stand-in for a Google Cloud Storage bucket, with the parts of
+# the boto bucket and key API the Gs uploader uses. Resumable uploads keep
+# the bytes of their session until they complete, like GCS does, and an
+# upload of an object in 'interrupt' is cut after that many bytes.
+class FakeGsKey:
+    def __init__(self, bucket, name, size=None, etag=None):
+        self.bucket = bucket
+        self.name   = name
+        self.size   = size
+        self.etag   = etag
+
+        self.local_hashes = {}
+
+    def set_contents_from_file(self, fp, headers=None, replace=True, cb=None, num_cb=10, policy=None, md5=None,
+                               res_upload_handler=None, **kwargs):
+        self.bucket.add_object(self.name, self.bucket.receive(self.name, fp, md5, res_upload_handler))
+        self.local_hashes = {'md5': self.bucket.md5(self.name)}
+
+    def compose(self, components):
+        if len(components) > self.bucket.compose_max_components:
+            raise GSResponseError(400, "Bad Request", "A maximum of %i components can be composed" % self.bucket.compose_max_components)
+        with self.bucket.lock:
+            self.bucket.composes.append((self.name, [component.name for component in components]))
+        data = "".join([self.bucket.get_data(component.name) for component in components])
+        self.bucket.add_object(self.name, data, True)
+
+
+class FakeGsBucket:
+    def __init__(self, name="fake-bucket", compose_max_components=32):
+        self.name                   = name
+        self.compose_max_components = compose_max_components
+
+        self.lock       = Lock()
+        self.objects    = {}
+        self.composite  = set()
+        self.sessions   = {}
+        self.interrupt  = {}
+        self.uploads    = []
+        self.composes   = []
+        self.listings   = []
+        self.bytes_sent = 0
+
+    def add_object(self, name, data, composite=False):
+        with self.lock:
+            self.objects[name] = data
+            if composite:
+                self.composite.add(name)
+            else:
+                self.composite.discard(name)
+
+    def get_data(self, name):
+        if name not in self.objects:
+            raise GSResponseError(404, "Not Found", "No such object: %s" % name)
+        return self.objects[name]
+
+    def md5(self, name):
+        return md5(self.objects[name]).digest()
+
+    def etag(self, name):
+        # composite objects have no md5 etag
+        if name in self.composite:
+            return '"composite-%08x"' % (crc32(self.objects[name]) & 0xffffffff)
+        return '"%s"' % md5(self.objects[name]).hexdigest()
+
+    def receive(self, name, fp, md5hex=None, handler=None):
+        # the data of a resumable upload, continuing the session in the tracker file of the handler
+        with self.lock:
+            self.uploads.append(name)
+            session = handler and handler.tracker_uri
+            if session not in self.sessions:
+                session = "https://fake-gcs.local/upload/%s?upload_id=%i" % (self.name, len(self.sessions))
+                self.sessions[session] = ""
+                if handler and handler.tracker_file_name:
+                    handler._set_tracker_uri(session)
+                    handler._save_tracker_uri_to_file()
+            received = self.sessions[session]
+            interrupt = self.interrupt.pop(name, None)
+        fp.seek(len(received))
+        data = fp.read()
+        with self.lock:
+            if interrupt is not None:
+                self.sessions[session] = received + data[:interrupt]
+                self.bytes_sent += min(interrupt, len(data))
+                raise IOError("Connection reset during the upload of %s" % name)
+            self.bytes_sent += len(data)
+            data = received + data
+            del self.sessions[session]
+        if md5hex and md5(data).hexdigest() != md5hex[0]:
+            raise GSResponseError(400, "Bad Request", "The MD5 of the upload of %s does not match" % name)
+        if handler:
+            handler._remove_tracker_file()
+        return data
+
+    def new_key(self, name):
+        return FakeGsKey(self, name)
+
+    def get_key(self, name):
+        if name in self.objects:
+            return FakeGsKey(self, name, len(self.objects[name]), self.etag(name))
+
+    def list(self, prefix=""):
+        self.listings.append(prefix)
+        return [self.get_key(name) for name in sorted(self.objects) if name.startswith(prefix)]
+
+    def delete_key(self, name):
+        with self.lock:
+            self.objects.pop(name, None)
+            self.composite.discard(name)
+
+    def copy_key(self, new_key_name, src_bucket_name, src_key_name):
+        self.add_object(new_key_name, self.get_data(src_key_name), src_key_name in self.composite)
+        return self.get_key(new_key_name)
@@ -0,0 +1,153 @@
+import os
+import sys
+import tempfile
+import unittest
+
+from multiprocessing.pool import ThreadPool
+from shutil import rmtree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fake_gcs import FakeGsBucket  # NOQA
+from mongodb_consistent_backup.Errors import OperationError  # NOQA
+from mongodb_consistent_backup.State import StateUpload  # NOQA
+from mongodb_consistent_backup.Upload.Gs import GsUploadPool as GsUploadPoolModule  # NOQA
+from mongodb_consistent_backup.Upload.Gs import GsUploadThread as GsUploadThreadModule  # NOQA
+
+
+class Config:
+    class backup:
+        name = "test"
+
+
+# Drives GsUploadPool against the in-process fake bucket. The upload pool
+# runs in threads, so the pool processes share the fake bucket.
+class GsUploadPoolTest(unittest.TestCase):
+    chunk_bytes = 1024
+
+    def setUp(self):
+        self.bucket     = FakeGsBucket()
+        self.backup_dir = tempfile.mkdtemp()
+        self.patched    = {}
+        self.patch(GsUploadPoolModule, "Pool", ThreadPool)
+        self.patch(GsUploadPoolModule, "get_session_bucket", self.get_session_bucket)
+        self.patch(GsUploadThreadModule, "get_session_bucket", self.get_session_bucket)
+        self.patch(GsUploadThreadModule, "reset_session_bucket", lambda *args: None)
+
+    def tearDown(self):
+        for (module, name), value in self.patched.iteritems():
+            setattr(module, name, value)
+        rmtree(self.backup_dir)
+
+    def patch(self, module, name, value):
+        self.patched[(module, name)] = getattr(module, name)
+        setattr(module, name, value)
+
+    def get_session_bucket(self, access_key, secret_key, bucket_name, num_retries=5):
+        return self.bucket
+
+    def write_file(self, name, byte_count):
+        path = os.path.join(self.backup_dir, name)
+        with open(path, "wb") as f:
+            f.write("".join([chr(i % 251) for i in xrange(byte_count)]))
+        return path
+
+    def upload(self, files, retries=1, unit=None):
+        # uploads the files like a run of the Gs uploader, with the upload state of the backup dir
+        pool = GsUploadPoolModule.GsUploadPool(self.bucket.name, "access", "secret", 4, False, self.chunk_bytes, retries,
+                                               StateUpload(self.backup_dir, Config, unit))
+        try:
+            pool.list_objects("backup/")
+            for path in files:
+                pool.upload(path, "backup/%s" % os.path.basename(path))
+            pool.wait(poll_secs=0.1)
+        finally:
+            pool.close()
+        return pool
+
+    def tracker_files(self, pool):
+        if not os.path.isdir(pool.tracker_dir):
+            return []
+        return os.listdir(pool.tracker_dir)
+
+    def test_upload_single_object(self):
+        path = self.write_file("small.bson", 100)
+        self.upload([path])
+        self.assertEqual(self.bucket.objects["backup/small.bson"], open(path, "rb").read())
+        self.assertEqual(self.bucket.composes, [])
+
+    def test_compose_rounds_of_32(self):
+        # 100 components are composed into 4 intermediate objects, then into the object
+        path = self.write_file("large.bson", self.chunk_bytes * 99 + 10)
+        pool = self.upload([path])
+        self.assertEqual(self.bucket.objects["backup/large.bson"], open(path, "rb").read())
+        self.assertEqual([len(components) for name, components in self.bucket.composes], [32, 32, 32, 4, 4])
+        self.assertEqual(self.bucket.composes[-1][0], "backup/large.bson")
+        self.assertEqual(sorted(self.bucket.objects.keys()), ["backup/large.bson"])
+        self.assertEqual(self.tracker_files(pool), [])
+
+    def test_resume_from_tracker_files(self):
+        # an interrupted component continues from the bytes of its session, in the tracker file of the upload state
+        path = self.write_file("large.bson", self.chunk_bytes * 3)
+        self.bucket.interrupt["backup/large.bson.component-0001"] = 600
+        self.assertRaises(OperationError, self.upload, [path])
+        trackers = os.listdir(os.path.join(self.backup_dir, "mongodb-consistent-backup_META", "gs-trackers"))
+        self.assertEqual(len(trackers), 1)
+        self.assertTrue(trackers[0].endswith(".1.tracker"))
+        self.assertEqual(self.bucket.bytes_sent, self.chunk_bytes * 2 + 600)
+
+        self.bucket.uploads = []
+        pool = self.upload([path])
+        self.assertEqual(self.bucket.objects["backup/large.bson"], open(path, "rb").read())
+        self.assertEqual(self.bucket.uploads, ["backup/large.bson.component-0001"])
+        self.assertEqual(self.bucket.bytes_sent, self.chunk_bytes * 3)
+        self.assertEqual(self.tracker_files(pool), [])
+
+    def test_skip_uploaded_from_one_listing(self):
+        small = self.write_file("small.bson", 100)
+        large = self.write_file("large.bson", self.chunk_bytes * 40)
+        self.upload([small, large])
+        self.bucket.uploads  = []
+        self.bucket.composes = []
+        self.bucket.listings = []
+        self.upload([small, large])
+        self.assertEqual(self.bucket.listings, ["backup/"])
+        self.assertEqual(self.bucket.uploads, [])
+        self.assertEqual(self.bucket.composes, [])
+
+    def test_unit_upload_states(self):
+        # uploads of concurrent pipeline units keep the composite object manifests in their own state files
+        rs0 = self.write_file("rs0.tar", self.chunk_bytes * 3)
+        rs1 = self.write_file("rs1.tar", self.chunk_bytes * 3)
+        pool_rs0 = GsUploadPoolModule.GsUploadPool(self.bucket.name, "access", "secret", 2, False, self.chunk_bytes, 1,
+                                                   StateUpload(self.backup_dir, Config, "rs0"))
+        pool_rs1 = GsUploadPoolModule.GsUploadPool(self.bucket.name, "access", "secret", 2, False, self.chunk_bytes, 1,
+                                                   StateUpload(self.backup_dir, Config, "rs1"))
+        try:
+            pool_rs0.upload(rs0, "backup/rs0.tar")
+            pool_rs1.upload(rs1, "backup/rs1.tar")
+            pool_rs0.wait(poll_secs=0.1)
+            pool_rs1.wait(poll_secs=0.1)
+        finally:
+            pool_rs0.close()
+            pool_rs1.close()
+        self.bucket.uploads  = []
+        self.bucket.composes = []
+        self.upload([rs0], unit="rs0")
+        self.upload([rs1], unit="rs1")
+        self.assertEqual(self.bucket.uploads, [])
+        self.assertEqual(self.bucket.composes, [])
+
+    def test_reupload_changed_object(self):
+        path = self.write_file("small.bson", 100)
+        self.upload([path])
+        with open(path, "ab") as f:
+            f.write("changed")
+        self.bucket.uploads = []
+        self.upload([path])
+        self.assertEqual(self.bucket.uploads, ["backup/small.bson"])
+        self.assertEqual(self.bucket.objects["backup/small.bson"], open(path, "rb").read())
+
+
+if __name__ == "__main__":
+    unittest.main()